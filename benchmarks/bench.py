@@ -0,0 +1,272 @@
+# filename:     bench.py
+# description:  Timed benchmarks of the scan, VDF, rule, exclusion and clean
+#               phases against synthetic libraries built by libsynth.
+#
+# usage:        python -m benchmarks.bench [options]
+
+import benchmarks.libsynth as libsynth
+import engine.libexclude as libexclude
+import engine.librules as librules
+import engine.libscan as libscan
+import providers.libsteam as libsteam
+import providers.libvdf as libvdf
+import steamclean as sc
+
+from datetime import datetime
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+DROPCACHES = '/proc/sys/vm/drop_caches'
+
+
+def drop_caches():
+    """ Drop the operating system page, dentry and inode caches so the next
+        phase reads from disk. Only possible as root on Linux, returns
+        whether the caches were dropped. """
+
+    if not os.access(DROPCACHES, os.W_OK):
+        return False
+    os.sync()
+    with open(DROPCACHES, 'w') as cachefile:
+        cachefile.write('3\n')
+    return True
+
+
+def measure(func, repeat=5, cold=False, setup=None):
+    """ Time func over repeat warm runs, preceded by a cold run after
+        dropping the caches if cold is set. setup, if given, is called
+        untimed before every run and its result passed to func. Returns a
+        dictionary of timings in seconds and the count returned by the last
+        run of func. """
+
+    def run(flush=False):
+        # output of the functions measured is not part of the benchmark
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            arg = setup() if setup is not None else None
+            if flush and not drop_caches():
+                return None, None
+            start = time.perf_counter()
+            count = func(arg) if setup is not None else func()
+            return time.perf_counter() - start, count
+
+    result = {'cold': None}
+    if cold:
+        result['cold'], count = run(flush=True)
+
+    warm = []
+    for number in range(repeat):
+        seconds, count = run()
+        warm.append(seconds)
+
+    result.update({'warm': warm, 'min': min(warm),
+                   'median': statistics.median(warm),
+                   'mean': statistics.mean(warm), 'count': count})
+    return result
+
+
+def run_benchmarks(args, workdir):
+    """ Build the synthetic installation in workdir and time every phase.
+        Returns a dictionary of results keyed by phase name. """
+
+    # log as a normal run does, the log is kept within workdir
+    sc.setup_logging()
+
+    options = dict(libraries=args.libraries, games=args.games,
+                   depth=args.depth, files=args.files, density=args.density,
+                   vdf=not args.no_vdf, scale=args.scale, seed=args.seed)
+
+    start = time.perf_counter()
+    install = libsynth.generate(os.path.join(workdir, 'library'), **options)
+    results = {'generate': {'seconds': time.perf_counter() - start,
+                            'games': install['games'],
+                            'redist': install['redist'],
+                            'bytes': install['bytes']}}
+    libdirs = install['libraries']
+    gamesdirs = [libsteam.fix_game_path(libdir) for libdir in libdirs]
+
+    def phase(name, func, cold=True, setup=None):
+        print('Running %s...' % (name), file=sys.stderr)
+        results[name] = measure(func, args.repeat, cold and args.cold, setup)
+
+    def get_libraries():
+        libvdf._cache.clear()
+        return len(libsteam.get_libraries(install['steam']))
+
+    def read_manifests():
+        libvdf._cache.clear()
+        return sum(len(libsteam.read_manifests(gamesdir))
+                   for gamesdir in gamesdirs)
+
+    gamedirs = [gamedir for gamesdir in gamesdirs
+                for gamedir in libscan.list_gamedirs(gamesdir)]
+
+    def check_vdf():
+        libvdf._cache.clear()
+        return len(libsteam.check_vdf(dict.fromkeys(gamedirs), args.jobs))
+
+    phase('get_libraries', get_libraries)
+    phase('read_manifests', read_manifests)
+    phase('check_vdf', check_vdf)
+
+    vdftext = libsynth.make_vdf(args.vdf_sections, args.seed)
+    phase('vdf_parse', lambda: len(libvdf.parse(vdftext)['root']),
+          cold=False)
+    results['vdf_parse']['bytes'] = len(vdftext)
+
+    paths = libsynth.make_paths(args.paths, args.seed)
+    matcher = librules.get_matcher('steam')
+
+    def match_rules():
+        return sum(1 for path in paths if matcher.match_path(path))
+
+    phase('match_rules', match_rules, cold=False)
+
+    excludelines = (
+        ['# synthetic exclusions', '*.msi', 'vcredist/2015',
+         os.path.join(gamesdirs[0], 'Game 0000')] +
+        [os.path.join(gamesdir, 'Game %04d' % number, '_CommonRedist')
+         for gamesdir in gamesdirs for number in range(0, args.games, 7)])
+    excludes = libexclude.ExcludeSet(excludelines)
+    fullpaths = [os.path.join(gamesdirs[0], path) for path in paths]
+
+    def match_excludes():
+        return sum(1 for path in fullpaths if excludes.excluded(path))
+
+    phase('match_excludes', match_excludes, cold=False)
+
+    def find_redist():
+        return len(sc.find_redist(customdirs=libdirs, jobs=args.jobs))
+
+    phase('find_redist', find_redist)
+
+    def find_targeted():
+        libvdf._cache.clear()
+        return sum(1 for candidate in sc.iter_redist(
+            customdirs=libdirs, jobs=args.jobs, targeted=True))
+
+    phase('find_redist_targeted', find_targeted)
+
+    def scan_providers():
+        count = 0
+        for provider, gamesdir in install['providers'].items():
+            matcher = librules.get_matcher(provider)
+            for gamedir in libscan.list_gamedirs(gamesdir):
+                count += len(libscan.scan_gamedir(gamedir, matcher=matcher))
+        return count
+
+    if install['providers']:
+        phase('scan_providers', scan_providers)
+
+    # exclusions are read from excludes.txt in the working directory
+    with open(libexclude.EXCLUDESFILE, 'w') as excludefile:
+        excludefile.write('\n'.join(excludelines) + '\n')
+    phase('find_redist_excluded', find_redist)
+    os.remove(libexclude.EXCLUDESFILE)
+
+    # removal needs a fresh copy of the installation for every run
+    cleandir = os.path.join(workdir, 'clean')
+
+    def fresh_library():
+        shutil.rmtree(cleandir, ignore_errors=True)
+        clean = libsynth.generate(cleandir, **options)
+        return sc.find_redist(customdirs=clean['libraries'], jobs=args.jobs)
+
+    def clean_data(cleanable):
+        return sc.clean_data(cleanable, confirm='y', jobs=args.jobs)[0]
+
+    phase('clean_data', clean_data, setup=fresh_library)
+    shutil.rmtree(cleandir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    """ Parse the commandline, run every benchmark and write the results
+        as JSON. """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark steamclean against synthetic game libraries.')
+    parser.add_argument('--libraries', type=int, default=2,
+                        help='Number of Steam libraries (default 2)')
+    parser.add_argument('--games', type=int, default=50,
+                        help='Number of games in each library (default 50)')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='Directory depth of game content (default 3)')
+    parser.add_argument('--files', type=int, default=8,
+                        help='Files in each game content directory '
+                        '(default 8)')
+    parser.add_argument('--density', type=float, default=0.5,
+                        help='Fraction of games shipping redistributables '
+                        '(default 0.5)')
+    parser.add_argument('--scale', type=float, default=0.01,
+                        help='Multiplier applied to realistic file sizes '
+                        '(default 0.01)')
+    parser.add_argument('--no-vdf', action='store_true',
+                        help='Do not write installation scripts')
+    parser.add_argument('--vdf-sections', type=int, default=20000,
+                        help='Sections in the VDF parsing benchmark '
+                        '(default 20000)')
+    parser.add_argument('--paths', type=int, default=200000,
+                        help='Paths in the rule and exclusion benchmarks '
+                        '(default 200000)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Jobs passed to steamclean (default 1)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Warm runs of each phase (default 5)')
+    parser.add_argument('--cold', action='store_true',
+                        help='Also time a run of each phase after dropping '
+                        'the operating system caches, requires root')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the generated data (default 0)')
+    parser.add_argument('--workdir',
+                        help='Directory to build libraries in, kept after '
+                        'the run (default a temporary directory)')
+    parser.add_argument('-o', '--output',
+                        help='File to write the JSON results to '
+                        '(default stdout)')
+    args = parser.parse_args()
+
+    if args.cold and not os.access(DROPCACHES, os.W_OK):
+        print('Unable to drop caches, cold runs are skipped',
+              file=sys.stderr)
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.workdir or
+                              tempfile.mkdtemp(prefix='steamclean_bench_'))
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = run_benchmarks(args, workdir)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {key: value for key, value in vars(args).items()
+                    if key not in ('workdir', 'output')},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as outfile:
+            outfile.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
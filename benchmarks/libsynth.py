@@ -0,0 +1,275 @@
+# filename:     libsynth.py
+# description:  Generator for synthetic Steam, GOG Galaxy and Origin libraries
+#               used to benchmark steamclean without a Windows installation.
+
+import engine.libscan as libscan
+
+import logging
+import os
+import random
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libsynth')
+
+# redistributable installers shipped with games, as paths relative to the
+# redist directory and their size in KiB, shared by every game like the real
+# ones so identical copies appear in many games
+REDISTFILES = [
+    ('DirectX/Jun2010/DXSETUP.exe', 512),
+    ('DirectX/Jun2010/dsetup32.dll', 1536),
+    ('DirectX/Jun2010/Jun2010_d3dx9_43_x64.cab', 1024),
+    ('DirectX/Jun2010/Jun2010_d3dx11_43_x86.cab', 256),
+    ('vcredist/2015/vc_redist.x64.exe', 2048),
+    ('vcredist/2015/vc_redist.x86.exe', 2048),
+    ('DotNet/4.8/ndp48-web.exe', 1024),
+    ('PhysX/PhysX-9.19.0218-SystemSoftware.msi', 3072),
+]
+# game content which must never be matched
+GAMEEXTS = ['.pak', '.dll', '.bin', '.txt', '.ogg', '.dds', '.ini']
+# name of the redist directory, relative to the game directory, used by
+# each provider
+REDISTDIRS = {
+    'steam': '_CommonRedist',
+    'galaxy': '__redist',
+    'origin': '__Installer',
+}
+
+
+def _write(path, size):
+    """ Write a file of size bytes, creating its directory as needed. """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as outfile:
+        # identical contents for identical sizes, as redists are
+        outfile.write(bytes(size))
+
+
+def make_game(gamedir, provider='steam', rng=None, depth=3, files=8,
+              redist=True, scale=1.0):
+    """ Build a single game directory with files nested up to depth levels
+        and, if redist is set, the provider's redist directory. File sizes
+        are multiplied by scale. Returns a list of the redist paths written
+        relative to the game directory and the number of bytes written. """
+
+    rng = rng or random.Random(0)
+    written = 0
+
+    # game content spread over a chain of nested directories
+    parent = gamedir
+    for level in range(depth):
+        parent = os.path.join(parent, 'data%s' % level)
+        for number in range(files):
+            size = int(rng.randint(1, 64) * 1024 * scale)
+            _write(os.path.join(parent, 'file%s%s' % (
+                number, rng.choice(GAMEEXTS))), size)
+            written += size
+
+    # the game executable is never a redistributable
+    size = int(256 * 1024 * scale)
+    _write(os.path.join(gamedir, 'game.exe'), size)
+    written += size
+
+    redists = []
+    if redist:
+        for relpath, kib in REDISTFILES:
+            if rng.random() < 0.25:
+                continue
+            relpath = os.path.join(REDISTDIRS[provider],
+                                   *relpath.split('/'))
+            size = int(kib * 1024 * scale)
+            _write(os.path.join(gamedir, relpath), size)
+            written += size
+            redists.append(relpath)
+
+    return redists, written
+
+
+def _installscript(redists):
+    """ Build an installscript.vdf naming each redist installer. """
+
+    lines = ['"InstallScript"', '{', '\t"Run Process"', '\t{']
+    for number, relpath in enumerate(redists):
+        if not relpath.lower().endswith(('.exe', '.msi')):
+            continue
+        lines += ['\t\t"redist%s"' % number, '\t\t{',
+                  '\t\t\t"process 1"\t\t"%%INSTALLDIR%%\\\\%s"' %
+                  relpath.replace(os.sep, '\\\\'),
+                  '\t\t\t"command 1"\t\t"/q /norestart"',
+                  '\t\t}']
+    lines += ['\t}', '}', '']
+    return '\n'.join(lines)
+
+
+def _manifest(appid, installdir):
+    """ Build an appmanifest_*.acf file for a single game. """
+
+    return ('"AppState"\n{\n\t"appid"\t\t"%s"\n\t"Universe"\t\t"1"\n'
+            '\t"name"\t\t"%s"\n\t"StateFlags"\t\t"4"\n'
+            '\t"installdir"\t\t"%s"\n}\n' % (appid, installdir, installdir))
+
+
+def make_library(libdir, provider='steam', games=50, depth=3, files=8,
+                 density=0.5, vdf=True, scale=1.0, seed=0, firstid=1000):
+    """ Build a library of games for provider at libdir using the layout
+        of that provider. Steam libraries get an app manifest for each game
+        and, when vdf is set, an installscript.vdf naming its installers.
+        density is the fraction of games shipping redists. Returns a
+        dictionary of statistics about the files written. """
+
+    rng = random.Random(seed)
+    if provider == 'steam':
+        appsdir = os.path.join(libdir, 'SteamApps')
+        gamesdir = os.path.join(appsdir, 'common')
+    elif provider == 'galaxy':
+        gamesdir = os.path.join(libdir, 'Games')
+    else:
+        gamesdir = libdir
+
+    stats = {'path': gamesdir, 'games': games, 'redist': 0, 'bytes': 0}
+    for number in range(games):
+        name = 'Game %04d' % (number)
+        gamedir = os.path.join(gamesdir, name)
+        redists, written = make_game(gamedir, provider, rng, depth, files,
+                                     rng.random() < density, scale)
+        stats['redist'] += len(redists)
+        stats['bytes'] += written
+
+        if provider != 'steam':
+            continue
+
+        appid = firstid + number
+        with open(os.path.join(appsdir, 'appmanifest_%s.acf' % appid),
+                  'w') as acffile:
+            acffile.write(_manifest(appid, name))
+        if vdf and redists:
+            with open(os.path.join(gamedir, 'installscript.vdf'),
+                      'w') as vdffile:
+                vdffile.write(_installscript(redists))
+
+    liblogger.info('Library of %s %s games with %s redists built at %s',
+                   games, provider, stats['redist'], gamesdir)
+    return stats
+
+
+def make_libraryfolders(steamdir, libdirs):
+    """ Write the libraryfolders.vdf file of the Steam installation at
+        steamdir, in the newer nested format, listing itself and libdirs. """
+
+    lines = ['"libraryfolders"', '{']
+    for number, libdir in enumerate([steamdir] + list(libdirs)):
+        lines += ['\t"%s"' % number, '\t{',
+                  '\t\t"path"\t\t"%s"' % libdir.replace('\\', '\\\\'),
+                  '\t\t"label"\t\t""', '\t\t"contentid"\t\t"%s"' % number,
+                  '\t}']
+    lines += ['}', '']
+
+    # Steam reads steamapps in any case on Windows, the games themselves
+    # are kept under SteamApps as fix_game_path expects
+    appsdir = os.path.join(steamdir, 'steamapps')
+    os.makedirs(appsdir, exist_ok=True)
+    with open(os.path.join(appsdir, 'libraryfolders.vdf'), 'w') as vdffile:
+        vdffile.write('\n'.join(lines))
+
+
+def generate(root, libraries=2, games=50, depth=3, files=8, density=0.5,
+             vdf=True, galaxy=True, origin=True, scale=1.0, seed=0):
+    """ Build a full synthetic installation under root: a Steam directory
+        with libraries - 1 extra Steam libraries listed in its
+        libraryfolders.vdf, and optionally a GOG Galaxy and an Origin
+        library, each holding games games. Returns a dictionary with the
+        Steam directory, the Steam library directories, the games
+        directory of each provider and the totals written. """
+
+    steamdir = os.path.join(root, 'Steam')
+    libdirs = [steamdir] + [os.path.join(root, 'SteamLibrary%s' % number)
+                            for number in range(1, libraries)]
+
+    result = {'steam': steamdir, 'libraries': libdirs, 'providers': {},
+              'games': 0, 'redist': 0, 'bytes': 0}
+
+    libs = [('steam', libdir) for libdir in libdirs]
+    if galaxy:
+        libs.append(('galaxy', os.path.join(root, 'GOG Galaxy')))
+    if origin:
+        libs.append(('origin', os.path.join(root, 'Origin Games')))
+
+    for number, (provider, libdir) in enumerate(libs):
+        stats = make_library(libdir, provider, games, depth, files, density,
+                             vdf, scale, seed + number,
+                             firstid=1000 + number * games)
+        if provider != 'steam':
+            result['providers'][provider] = stats['path']
+        result['games'] += stats['games']
+        result['redist'] += stats['redist']
+        result['bytes'] += stats['bytes']
+
+    make_libraryfolders(steamdir, libdirs[1:])
+    return result
+
+
+def make_vdf(sections=10000, seed=0):
+    """ Build KeyValues text with sections nested sections of several
+        values each, including comments, conditionals and escapes, for
+        benchmarking the parser without touching the disk. """
+
+    rng = random.Random(seed)
+    lines = ['// synthetic KeyValues data', '"root"', '{']
+    for number in range(sections):
+        lines += ['\t"section%s"' % number, '\t{',
+                  '\t\t"name"\t\t"Section \\"%s\\""' % number,
+                  '\t\t"path"\t\t"%%INSTALLDIR%%\\\\_CommonRedist\\\\%s"' %
+                  rng.choice(REDISTFILES)[0].replace('/', '\\\\'),
+                  '\t\t"size"\t\t"%s"' % rng.randint(0, 1 << 30),
+                  '\t\t"win"\t\t"1"\t[$WIN32]',
+                  '\t\tbare\t\tvalue%s' % number,
+                  '\t\t"nested"', '\t\t{', '\t\t\t"key"\t\t"value"',
+                  '\t\t}', '\t}']
+    lines += ['}', '']
+    return '\n'.join(lines)
+
+
+def make_paths(count=100000, seed=0):
+    """ Build count relative paths within game directories, mixing game
+        content and redists of every provider, for benchmarking rules and
+        exclusions without touching the disk. """
+
+    rng = random.Random(seed)
+    redists = [os.path.join(redistdir, *relpath.split('/'))
+               for redistdir in REDISTDIRS.values()
+               for relpath, kib in REDISTFILES]
+    paths = []
+    for number in range(count):
+        game = 'Game %04d' % (rng.randrange(10000))
+        if rng.random() < 0.2:
+            relpath = rng.choice(redists)
+        else:
+            relpath = os.path.join(*['data%s' % level for level in
+                                     range(rng.randint(0, 4))] +
+                                   ['file%s%s' % (number,
+                                                  rng.choice(GAMEEXTS))])
+        paths.append(os.path.join(game, relpath))
+    return paths
+
+
+def make_candidates(count=1000000, root=None, provider='steam'):
+    """ Yield count Candidate records for redists spread over as many game
+        directories as needed, as a scan of a very large library would
+        report, without touching the disk. Every game holds the files in
+        REDISTFILES along with the DirectX archives of each D3DX release
+        as the full DirectX installer does. """
+
+    root = root or os.path.join(os.sep, 'library', 'steamapps', 'common')
+    redistdir = REDISTDIRS[provider]
+    files = [(relpath.split('/'), kib * 1024) for relpath, kib in REDISTFILES]
+    for release in range(24, 43):
+        for arch in ('x86', 'x64'):
+            name = 'Jun2010_d3dx9_%s_%s.cab' % (release, arch)
+            files.append((['DirectX', 'Jun2010', name], 1024 * 1024))
+
+    number = 0
+    while number < count:
+        gamedir = os.path.join(root, 'Game %06d' % (number // len(files)))
+        for parts, size in files[:count - number]:
+            yield libscan.Candidate(os.path.join(gamedir, redistdir, *parts),
+                                    size, gamedir, parts[0], None, provider)
+        number += len(files)
@@ -0,0 +1,90 @@
+# filename:     memory.py
+# description:  Memory benchmark of the structures holding scan results,
+#               comparing a ScanResult against per-file dictionaries and
+#               records for a very large number of files.
+#
+# usage:        python -m benchmarks.memory [options]
+
+import benchmarks.libsynth as libsynth
+import engine.libresult as libresult
+
+from datetime import datetime
+import argparse
+import gc
+import json
+import platform
+import time
+import tracemalloc
+
+# structures compared, each built from the same stream of Candidate records
+STRUCTURES = {
+    # path to approximate size in MB, as returned by find_redist before
+    'dict': lambda candidates: {c.path: ((c.size / 1024) / 1024)
+                                for c in candidates},
+    'records': list,
+    'scanresult': libresult.ScanResult,
+}
+
+
+def measure(name, count):
+    """ Build the structure name from count synthetic records and return
+        the memory it holds once built, the peak while building and the
+        time taken to build it and to read back every path. """
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    structure = STRUCTURES[name](libsynth.make_candidates(count))
+    built = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    if isinstance(structure, libresult.ScanResult):
+        paths = sum(1 for path in structure.paths())
+    elif isinstance(structure, dict):
+        paths = sum(1 for path in structure)
+    else:
+        paths = sum(1 for candidate in structure if candidate.path)
+    read = time.perf_counter() - start
+
+    return {'bytes': current, 'peak': peak,
+            'bytes_per_file': current / max(1, paths),
+            'build': built, 'read_paths': read, 'count': paths}
+
+
+def main():
+    """ Parse the commandline, measure every structure and write the
+        results as JSON. """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the memory used to hold scan results.')
+    parser.add_argument('--files', type=int, default=1000000,
+                        help='Number of files in the result (default '
+                        '1000000)')
+    parser.add_argument('-o', '--output',
+                        help='File to write the JSON results to '
+                        '(default stdout)')
+    args = parser.parse_args()
+
+    results = {name: measure(name, args.files)
+               for name in STRUCTURES}
+
+    report = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {'files': args.files},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# filename:     startup.py
+# description:  Startup time benchmark checking that importing steamclean is
+#               cheap and leaves nothing behind in the working directory.
+#
+# usage:        python -m benchmarks.startup [options]
+
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOTDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules timed, the last imports everything a scan needs
+MODULES = ['providers.libproviders', 'providers.libsteam', 'steamclean']
+
+# statements run in a fresh interpreter for each sample
+STATEMENTS = {
+    'interpreter': 'pass',
+    'import': 'import steamclean',
+    'import_scan': 'import steamclean; '
+                   'steamclean.find_redist(customdirs=[%r])',
+}
+
+
+def time_statement(statement, cwd, repeat):
+    """ Run statement in repeat fresh interpreters started in cwd and return
+        the wall time of each in seconds. """
+
+    env = dict(os.environ, PYTHONPATH=ROOTDIR, PYTHONDONTWRITEBYTECODE='1')
+    samples = []
+    for number in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], cwd=cwd, env=env,
+                       check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def import_times(module, cwd):
+    """ Return the cumulative import time in seconds of module and each of
+        the project modules it imports, as reported by -X importtime. """
+
+    env = dict(os.environ, PYTHONPATH=ROOTDIR)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                           'import ' + module], cwd=cwd, env=env, check=True,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        try:
+            own, cumulative, name = line.split('|')
+            cumulative = int(cumulative) / 1e6
+        except ValueError:
+            continue
+        name = name.strip()
+        if name.split('.')[0] in ('engine', 'providers', 'steamclean'):
+            times[name] = cumulative
+    return times
+
+
+def main():
+    """ Time startup of the package and write the results as JSON. Exits
+        with a failure status if importing created any file. """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the time taken to import steamclean.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Interpreters started for each measurement '
+                        '(default 20)')
+    parser.add_argument('-o', '--output',
+                        help='File to write the JSON results to '
+                        '(default stdout)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='steamclean_startup_')
+    try:
+        libdir = os.path.join(workdir, 'empty', 'SteamApps', 'common')
+        os.makedirs(libdir)
+
+        results = {}
+        for name, statement in STATEMENTS.items():
+            if '%r' in statement:
+                statement = statement % os.path.dirname(
+                    os.path.dirname(libdir))
+            samples = time_statement(statement, workdir, args.repeat)
+            results[name] = {'min': min(samples),
+                             'median': statistics.median(samples),
+                             'mean': statistics.mean(samples)}
+
+        # importing must not create log files or anything else
+        created = sorted(set(os.listdir(workdir)) - {'empty'})
+        modules = import_times(MODULES[-1], workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': results,
+        'imports': modules,
+        'created': created,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(text + '\n')
+    else:
+        print(text)
+
+    if created:
+        print('Files created on import: %s' % ', '.join(created),
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
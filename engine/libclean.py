@@ -0,0 +1,293 @@
+# filename:     libclean.py
+# description:  Batched, parallel removal of files with an append-only
+#               journal of every planned and completed action.
+
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import stat
+
+import engine.liblog as liblog
+import engine.librules as librules
+import engine.libstats as libstats
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libclean')
+
+BATCHSIZE = 256     # number of files handled by a worker at a time
+
+# files left to remove or quarantine in a journal and the game directories
+# they are in
+Pending = namedtuple('Pending', ['paths', 'quarantine', 'games'])
+
+
+class Journal(object):
+    """ Append-only record of file removal written as one JSON object per
+        line. Each file is first recorded as planned, along with the mode
+        when it is to be quarantined, and later as removed, with the bytes
+        freed, or failed, with the reason. Pruned
+        directories and the game directories files are pruned within are
+        also recorded. """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a+', encoding='utf-8')
+
+        # start on a new line if a previous run was interrupted mid-write
+        if self.file.tell() > 0:
+            with open(path, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b'\n':
+                    self.file.write('\n')
+
+    def write(self, op, path, **data):
+        data['op'] = op
+        data['path'] = path
+        self.file.write(json.dumps(data) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_journal(path):
+    """ Read the journal at path and return a Pending record of the files
+        planned which have not yet been removed or quarantined, in the
+        order they were planned, split by whether they were planned for
+        removal or for quarantine, and the game directories they belong
+        to. Files which failed are included so they are attempted again,
+        unless the failure was recorded as permanent. """
+
+    pending = {}        # path: planned for quarantine
+    games = {}
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line may be incomplete after an interruption
+                liblogger.warning('Ignoring invalid journal line in %s', path)
+                continue
+
+            op = entry.get('op')
+            if op == 'planned':
+                pending[entry['path']] = entry.get('mode') == 'quarantine'
+            elif op in ('removed', 'quarantined'):
+                pending.pop(entry['path'], None)
+            elif op == 'failed' and entry.get('retry') is False:
+                # such as a file with no quarantine on its drive, which
+                # must never be removed instead
+                pending.pop(entry['path'], None)
+            elif op == 'game':
+                games[entry['path']] = True
+
+    return Pending([path for path, moved in pending.items() if not moved],
+                   [path for path, moved in pending.items() if moved],
+                   list(games))
+
+
+def _batches(paths, size):
+    """ Split an iterable of paths into lists of at most size items. """
+
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _remove_batch(paths):
+    """ Remove every file in paths, returning a list of (path, removed,
+        detail) tuples where detail is the number of bytes freed or the
+        reason removal failed. Each file is checked with a single lstat. """
+
+    results = []
+    for path in paths:
+        try:
+            st = os.lstat(path)
+            if not (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+                results.append((path, False, 'Not a file'))
+                continue
+
+            os.remove(path)
+            # space is only freed when the last link to a file is removed
+            if stat.S_ISREG(st.st_mode) and st.st_nlink == 1:
+                results.append((path, True, st.st_size))
+            else:
+                results.append((path, True, 0))
+        except OSError as e:
+            results.append((path, False, e.strerror or str(e)))
+
+    return results
+
+
+def prune_dirs(files, journal=None, matcher=None, games=()):
+    """ Remove directories left empty after files were removed, deepest
+        first. Directories are only pruned between each file and its game
+        directory, one of games, up to the deepest one matching a directory
+        rule above the file, so game directories and everything above them
+        are never touched. Returns the number of directories removed. """
+
+    if matcher is None:
+        matcher = librules.get_matcher()
+
+    candidates = set()
+    for path in files:
+        _add_parents(path, candidates, matcher, games)
+
+    return _prune(candidates, journal)
+
+
+def _add_parents(path, candidates, matcher, games):
+    """ Add the directories above path, up to and including the deepest
+        one matching a directory rule, to the set of candidates for
+        pruning. Nothing is added if no directory between path and its
+        game directory matches, or if path does not lie within any of the
+        game directories in games. """
+
+    parents = []
+    parent = os.path.dirname(path)
+    deepest = None      # number of parents up to the deepest match
+    while parent not in candidates:
+        if parent in games:
+            # the game directory and everything above it are never pruned
+            if deepest is not None:
+                candidates.update(parents[:deepest])
+            return
+        parents.append(parent)
+        if deepest is None and \
+                matcher.match_dir(os.path.basename(parent)) is not None:
+            deepest = len(parents)
+        grandparent = os.path.dirname(parent)
+        if grandparent == parent:
+            # not within a game directory
+            return
+        parent = grandparent
+
+    # the rest of the chain was added along with an earlier file
+    candidates.update(parents)
+
+
+def _prune(candidates, journal=None):
+    """ Remove every empty directory in candidates. """
+
+    pruned = 0
+    # deepest directories first so emptied parents can be removed after
+    # their children, non-empty directories simply fail to be removed
+    for directory in sorted(candidates, key=lambda d: d.count(os.sep),
+                            reverse=True):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            continue
+
+        pruned += 1
+        liblogger.debug('Directory %s pruned', directory)
+        if journal is not None:
+            journal.write('pruned', directory)
+
+    return pruned
+
+
+def remove_files(paths, jobs=1, journal=None, prune=True, progress=None,
+                 cancel=None, plan=True, matcher=None, keep=True, games=()):
+    """ Remove all files in paths using batches spread over jobs worker
+        threads. Every action is recorded in the journal when one is given,
+        a list of paths is planned in full before anything is removed while
+        other iterables are planned a batch at a time as they are read.
+        Files are not planned again if plan is False, as when resuming.
+        Directories left empty are pruned within the game directories in
+        games, see prune_dirs, which may be filled while paths is read.
+
+        progress is called with the number of files handled after each
+        batch and removal stops early once the cancel event is set. Returns
+        a dictionary with the removed and failed file counts, the exact
+        bytes freed, the number of directories pruned and the list of
+        removed files, which is left empty unless keep is set so memory use
+        does not grow with the number of files removed. """
+
+    if matcher is None:
+        matcher = librules.get_matcher()
+
+    result = {'removed': 0, 'failed': 0, 'bytes': 0, 'pruned': 0,
+              'files': []}
+    sized = isinstance(paths, list)
+    plan = plan and journal is not None
+    prunable = set()    # directories to try pruning once files are removed
+
+    if plan and sized:
+        for path in paths:
+            journal.write('planned', path)
+        journal.flush()
+
+    def record(results):
+        # every file is stat'ed and then removed
+        libstats.count('stat', len(results))
+        libstats.count('remove', len(results))
+        perfile = liblog.per_file()
+        for path, removed, detail in results:
+            if removed:
+                result['removed'] += 1
+                result['bytes'] += detail
+                if keep:
+                    result['files'].append(path)
+                if prune:
+                    _add_parents(path, prunable, matcher, games)
+                if perfile:
+                    liblogger.debug('File %s removed successfully', path,
+                                    extra={'detail': {'op': 'removed',
+                                                      'path': path,
+                                                      'bytes': detail}})
+                if journal is not None:
+                    journal.write('removed', path, bytes=detail)
+            else:
+                result['failed'] += 1
+                liblogger.error('Unable to remove %s: %s', path, detail,
+                                extra={'detail': {'op': 'failed',
+                                                  'path': path,
+                                                  'error': detail}})
+                print('Unable to remove %s: %s' % (path, detail))
+                if journal is not None:
+                    journal.write('failed', path, error=detail)
+
+        if journal is not None:
+            journal.flush()
+        liblogger.info('%s file(s) removed, %s failed, %s bytes freed',
+                       result['removed'], result['failed'], result['bytes'])
+        if progress is not None:
+            progress(result['removed'] + result['failed'],
+                     len(paths) if sized else None)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        pending = deque()   # batches in flight, handled in order
+        for batch in _batches(paths, BATCHSIZE):
+            if cancel is not None and cancel.is_set():
+                liblogger.warning('Removal cancelled')
+                break
+
+            if plan and not sized:
+                for path in batch:
+                    journal.write('planned', path)
+
+            pending.append(pool.submit(_remove_batch, batch))
+            # keep a bounded number of batches queued so streamed input is
+            # not read far ahead of removal
+            while len(pending) > max(1, jobs) * 2:
+                record(pending.popleft().result())
+
+        while pending:
+            record(pending.popleft().result())
+
+    if prune:
+        result['pruned'] = _prune(prunable, journal)
+        if journal is not None:
+            journal.flush()
+
+    return result
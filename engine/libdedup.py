@@ -0,0 +1,192 @@
+# filename:     libdedup.py
+# description:  Detection of byte-identical redistributable files and their
+#               replacement with hardlinks to a single copy.
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libdedup')
+
+PARTSIZE = 64 * 1024        # bytes hashed from each end of a file
+BUFFERSIZE = 1024 * 1024    # read size used when hashing whole files
+
+# group of identical files of size bytes, the first path is kept as the
+# canonical copy and reclaimable is the space used by all other copies on
+# the same device as an earlier one, as hardlinks cannot cross devices
+DuplicateSet = namedtuple('DuplicateSet', ['size', 'paths', 'reclaimable'])
+
+
+def _partial_hash(path, size):
+    """ Hash the first and last PARTSIZE bytes of a file. Files small
+        enough to be read completely give their full hash. """
+
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        digest.update(file.read(PARTSIZE))
+        if size > 2 * PARTSIZE:
+            file.seek(-PARTSIZE, os.SEEK_END)
+            digest.update(file.read(PARTSIZE))
+        elif size > PARTSIZE:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def _full_hash(path):
+    """ Hash the full contents of a file reading large blocks into a single
+        reused buffer. """
+
+    digest = hashlib.blake2b()
+    buffer = bytearray(BUFFERSIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as file:
+        while True:
+            count = file.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+
+def _group(pool, func, groups):
+    """ Split each group of paths by the result of func, hashing every file
+        on the pool, and return only the groups left with several files. """
+
+    paths = [path for group in groups for path in group]
+    results = {}
+    for path, key in zip(paths, pool.map(_safe(func), paths)):
+        if key is not None:
+            results[path] = key
+
+    split = []
+    for group in groups:
+        keyed = {}
+        for path in group:
+            if path in results:
+                keyed.setdefault(results[path], []).append(path)
+        split.extend(g for g in keyed.values() if len(g) > 1)
+    return split
+
+
+def _safe(func):
+    """ Wrap a hash function so unreadable files are logged and skipped. """
+
+    def wrapper(path):
+        try:
+            return func(path)
+        except OSError as e:
+            liblogger.warning('Unable to read %s: %s', path, e)
+            return None
+    return wrapper
+
+
+def find_duplicates(files, jobs=1):
+    """ Find groups of identical files from a {path: size in bytes}
+        dictionary. Files are grouped by size first so files with a unique
+        size are never read, then by a hash of their head and tail and only
+        then by a hash of their full contents, with hashing spread over jobs
+        worker threads. Paths which are already hardlinks of one another
+        are treated as a single file. Copies on different devices are
+        still reported but only one copy on each device is counted as
+        needed. Returns a list of DuplicateSet. """
+
+    inodes = {}     # first path seen for each (device, inode)
+    devices = {}    # device holding each path
+    bysize = {}
+    for path, size in files.items():
+        # empty files take no space so there is nothing to reclaim
+        if not size:
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if inodes.setdefault((st.st_dev, st.st_ino), path) != path:
+            continue
+        devices[path] = st.st_dev
+        bysize.setdefault(st.st_size, []).append(path)
+
+    groups = [group for group in bysize.values() if len(group) > 1]
+    liblogger.info('%s file size(s) shared by more than one file',
+                   len(groups))
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        sizes = {path: size for size, group in bysize.items()
+                 for path in group}
+        groups = _group(pool, lambda p: _partial_hash(p, sizes[p]), groups)
+        # files no larger than both parts were read in full already
+        small = [g for g in groups if sizes[g[0]] <= 2 * PARTSIZE]
+        large = [g for g in groups if sizes[g[0]] > 2 * PARTSIZE]
+        groups = small + _group(pool, _full_hash, large)
+
+    duplicates = []
+    for group in groups:
+        size = sizes[group[0]]
+        # one copy has to stay on every device holding the file
+        needed = len({devices[path] for path in group})
+        duplicates.append(DuplicateSet(size, sorted(group),
+                                       size * (len(group) - needed)))
+
+    liblogger.info('%s duplicate set(s) found, %s bytes reclaimable',
+                   len(duplicates), sum(d.reclaimable for d in duplicates))
+    return duplicates
+
+
+def link_duplicates(duplicates, journal=None):
+    """ Replace every copy in each DuplicateSet with a hardlink to the first
+        copy on the same device. The link is created beside the copy and
+        renamed over it so the copy is never missing. Returns the number of
+        files replaced, the bytes reclaimed and the number of files which
+        could not be replaced. """
+
+    linked = 0
+    reclaimed = 0
+    failed = 0
+
+    for duplicate in duplicates:
+        canonical = {}  # first copy found on each device
+        for path in duplicate.paths:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                liblogger.error('Unable to read %s: %s', path, e)
+                continue
+
+            source = canonical.setdefault(st.st_dev, path)
+            if source == path:
+                continue
+
+            temp = path + '.steamclean-link'
+            try:
+                os.link(source, temp)
+                os.replace(temp, path)
+            except OSError as e:
+                liblogger.error('Unable to link %s to %s: %s', path, source,
+                                e)
+                failed += 1
+                if journal is not None:
+                    journal.write('failed', path, error=str(e))
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+                continue
+
+            linked += 1
+            # the copy's space is only freed if it had no other links
+            if st.st_nlink == 1:
+                reclaimed += duplicate.size
+            liblogger.debug('File %s linked to %s', path, source)
+            if journal is not None:
+                journal.write('linked', path, source=source,
+                              bytes=duplicate.size)
+
+    if journal is not None:
+        journal.flush()
+
+    liblogger.info('%s file(s) replaced by hardlinks, %s bytes reclaimed',
+                   linked, reclaimed)
+    return linked, reclaimed, failed
@@ -0,0 +1,106 @@
+# filename:     libexclude.py
+# description:  Compiled exclusions read from excludes.txt which are checked
+#               while directories are traversed.
+
+from fnmatch import translate
+import hashlib
+import logging
+import re
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libexclude')
+
+EXCLUDESFILE = 'excludes.txt'
+GLOBCHARS = re.compile(r'[*?\[]')
+ABSPATH = re.compile(r'^(/|[a-z]:/|//)')
+
+
+def _normalize(path):
+    """ Exclusions are not case sensitive and always use / separators. """
+
+    return path.replace('\\', '/').lower()
+
+
+class ExcludeSet(object):
+    """ Exclusions split by kind so each can be checked cheaply. Absolute
+        paths are stored in a trie of path components so a directory and
+        everything below it is excluded with one walk down the trie, glob
+        patterns are matched against the file name or, if they contain a
+        separator, the full path, and any other line is excluded wherever it
+        appears within a path. """
+
+    def __init__(self, lines):
+        self.trie = {}
+        self.count = 0
+        substrings = []
+        pathglobs = []
+        nameglobs = []
+
+        for line in lines:
+            item = _normalize(line.strip())
+            if not item or item.startswith('#'):
+                continue
+            self.count += 1
+
+            if GLOBCHARS.search(item):
+                if '/' in item:
+                    pathglobs.append('^' + translate(item))
+                else:
+                    nameglobs.append(translate(item))
+            elif ABSPATH.match(item):
+                node = self.trie
+                for part in item.rstrip('/').split('/'):
+                    node = node.setdefault(part, {})
+                node[None] = True   # marks the end of an excluded path
+            else:
+                substrings.append(re.escape(item))
+
+        self.pathregex = re.compile('|'.join(substrings + pathglobs)) \
+            if substrings or pathglobs else None
+        self.nameregex = re.compile('|'.join(nameglobs)) \
+            if nameglobs else None
+
+        # identifies the exclusions so cached scan results can be discarded
+        self.signature = hashlib.sha1('\n'.join(
+            sorted(substrings + pathglobs + nameglobs) + [repr(self.trie)])
+            .encode('utf-8')).hexdigest()
+
+    def __bool__(self):
+        return self.count > 0
+
+    def excluded(self, path):
+        """ Return True if path, or any directory above it, is excluded. """
+
+        path = _normalize(path)
+
+        if self.trie:
+            node = self.trie
+            for part in path.split('/'):
+                node = node.get(part)
+                if node is None:
+                    break
+                if None in node:
+                    return True
+
+        if self.pathregex is not None and self.pathregex.search(path):
+            return True
+
+        if self.nameregex is not None and \
+                self.nameregex.match(path.rsplit('/', 1)[-1]):
+            return True
+
+        return False
+
+
+def load_excludes(path=EXCLUDESFILE):
+    """ Read exclusions from path, one per line, returning an ExcludeSet or
+        None if the file does not exist or holds no exclusions. """
+
+    try:
+        with open(path, encoding='utf-8', errors='replace') as excludesfile:
+            excludes = ExcludeSet(excludesfile)
+    except FileNotFoundError:
+        return None
+
+    liblogger.info('%s exclusion(s) read from %s', excludes.count, path)
+    return excludes if excludes else None
@@ -0,0 +1,226 @@
+# filename:     libindex.py
+# description:  Persistent scan index used to skip unchanged game directories
+#               between runs.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from engine.libscan import Candidate
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libindex')
+
+INDEXFILE = 'steamclean_index.db'   # default index stored beside log files
+SCHEMA = 3                          # bump when the table layout changes
+
+# directories modified this close to the time they are recorded may change
+# again within the same timestamp tick so they are never trusted
+RACYWINDOW = 2 * 10 ** 9
+
+
+class ScanIndex(object):
+    """ SQLite backed record of every directory walked within each game
+        directory along with the cleanable files found beneath it. A game
+        directory is only walked again when the mtime or inode of one of its
+        recorded directories has changed. """
+
+    def __init__(self, path=INDEXFILE):
+        self.path = path
+        self.hits = 0       # game directories served from the index
+        self.misses = 0     # game directories walked and stored
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # the index is only a cache so outdated layouts are simply rebuilt
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA:
+            self.conn.executescript('''
+                DROP TABLE IF EXISTS dirs;
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS meta;
+                PRAGMA user_version = %d;''' % SCHEMA)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                gamedir TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                ino INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                gamedir TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                rule TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS dirs_gamedir ON dirs (gamedir);
+            CREATE INDEX IF NOT EXISTS files_gamedir ON files (gamedir);
+        ''')
+
+    def validate(self, signature):
+        """ Discard every record if the detection rules identified by
+            signature differ from those used when the records were stored. """
+
+        signature = json.dumps(signature)
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM meta '
+                                    'WHERE key = ?', ('rules',)).fetchone()
+            if row is not None and row[0] == signature:
+                return
+
+            if row is not None:
+                liblogger.info('Detection rules changed, clearing scan index')
+            self.conn.execute('DELETE FROM dirs')
+            self.conn.execute('DELETE FROM files')
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                              ('rules', signature))
+
+    def lookup(self, gamedir):
+        """ Return the recorded Candidate list for gamedir if none of its
+            directories have changed since they were stored, else None. """
+
+        with self.lock:
+            dirs = self.conn.execute(
+                'SELECT path, mtime_ns, ino FROM dirs WHERE gamedir = ?',
+                (gamedir,)).fetchall()
+        if not dirs:
+            return None
+
+        # directories are checked outside the lock so parallel scans of
+        # separate game directories are not serialized
+        for path, mtime_ns, ino in dirs:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            if st.st_mtime_ns != mtime_ns or st.st_ino != ino:
+                return None
+
+        with self.lock:
+            self.hits += 1
+            return [Candidate(path, size, gamedir, rule)
+                    for path, size, rule in self.conn.execute(
+                        'SELECT path, size, rule FROM files '
+                        'WHERE gamedir = ? ORDER BY rowid', (gamedir,))]
+
+    def store(self, gamedir, dirs, files):
+        """ Replace the records for gamedir with the directories walked, as a
+            {path: stat_result} dictionary, and the Candidate list found. """
+
+        now = time.time_ns()
+        rows = [(path, gamedir, self._mtime(st, now), st.st_ino)
+                for path, st in dirs.items()]
+
+        with self.lock:
+            self.misses += 1
+            self._delete(gamedir)
+            self.conn.executemany('INSERT OR REPLACE INTO dirs '
+                                  'VALUES (?, ?, ?, ?)', rows)
+            self.conn.executemany('INSERT OR REPLACE INTO files '
+                                  'VALUES (?, ?, ?, ?)',
+                                  [(c.path, gamedir, c.size, c.rule)
+                                   for c in files])
+
+    def check(self, path, checked):
+        """ Record in the checked dictionary whether each directory above
+            path is still as the index recorded it. Called for each file
+            before it is removed so forget only trusts directories nothing
+            else has changed since the scan. """
+
+        parent = os.path.dirname(path)
+        while parent not in checked:
+            with self.lock:
+                row = self.conn.execute(
+                    'SELECT mtime_ns, ino FROM dirs WHERE path = ?',
+                    (parent,)).fetchone()
+            try:
+                st = os.stat(parent)
+                checked[parent] = row is not None and \
+                    (st.st_mtime_ns, st.st_ino) == tuple(row)
+            except OSError:
+                checked[parent] = False
+
+            grandparent = os.path.dirname(parent)
+            if grandparent == parent:
+                break
+            parent = grandparent
+
+    def forget(self, paths, checked=None):
+        """ Remove deleted files from the index and refresh the recorded
+            metadata of every directory above them, such as the game and
+            redist directories whose contents changed, so the removal and
+            pruning themselves do not force the next scan to walk the game
+            directory again. Only directories found unchanged by check
+            before the removal are refreshed, any other is walked again on
+            the next scan as something else may have changed it. Recorded
+            directories which were pruned are dropped. """
+
+        if checked is None:
+            checked = {}
+
+        parents = set()
+        for path in paths:
+            parent = os.path.dirname(path)
+            while parent not in parents:
+                parents.add(parent)
+                grandparent = os.path.dirname(parent)
+                if grandparent == parent:
+                    break
+                parent = grandparent
+
+        with self.lock:
+            self.conn.executemany('DELETE FROM files WHERE path = ?',
+                                  [(path,) for path in paths])
+            for parent in parents:
+                # only directories recorded by a scan are updated
+                try:
+                    st = os.stat(parent)
+                except OSError:
+                    # the directory was pruned along with its files
+                    self.conn.execute('DELETE FROM dirs WHERE path = ?',
+                                      (parent,))
+                    continue
+                if checked.get(parent):
+                    self.conn.execute('UPDATE dirs SET mtime_ns = ?, ino = ? '
+                                      'WHERE path = ?',
+                                      (st.st_mtime_ns, st.st_ino, parent))
+                else:
+                    self.conn.execute('UPDATE dirs SET mtime_ns = 0 '
+                                      'WHERE path = ?', (parent,))
+            self.conn.commit()
+
+    def prune_missing(self):
+        """ Drop all records for game directories which no longer exist,
+            such as games that have been uninstalled. """
+
+        with self.lock:
+            gamedirs = [row[0] for row in self.conn.execute(
+                'SELECT DISTINCT gamedir FROM dirs')]
+            missing = [gamedir for gamedir in gamedirs
+                       if not os.path.isdir(gamedir)]
+            for gamedir in missing:
+                liblogger.info('Removing %s from scan index', gamedir)
+                self._delete(gamedir)
+
+        return len(missing)
+
+    def close(self):
+        """ Commit all pending changes and close the index database. """
+
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def _delete(self, gamedir):
+        self.conn.execute('DELETE FROM dirs WHERE gamedir = ?', (gamedir,))
+        self.conn.execute('DELETE FROM files WHERE gamedir = ?', (gamedir,))
+
+    @staticmethod
+    def _mtime(st, now):
+        # store 0 for recently modified directories so they are walked again
+        if now - st.st_mtime_ns < RACYWINDOW:
+            return 0
+        return st.st_mtime_ns
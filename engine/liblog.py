@@ -0,0 +1,123 @@
+# filename:     liblog.py
+# description:  Logging pipeline writing log files on a background thread,
+#               with optional per-game aggregation and a compressed NDJSON
+#               file holding the detail of every file handled.
+
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import queue
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.liblog')
+
+# listener writing queued records, whether per-file lines are replaced by
+# summaries and whether per-file records are wanted at all, set by setup
+_listener = None
+_aggregate = False
+_perfile = True
+
+
+class DetailHandler(logging.Handler):
+    """ Write the detail attached to each record, with the time it was
+        logged, as one JSON object per line of a gzip compressed file.
+        Records without detail are ignored. """
+
+    def __init__(self, path):
+        logging.Handler.__init__(self)
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+
+    def emit(self, record):
+        detail = getattr(record, 'detail', None)
+        if detail is None:
+            return
+        try:
+            data = dict(detail, time=record.created)
+            self.file.write(json.dumps(data) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            self.file.close()
+        finally:
+            self.release()
+        logging.Handler.close(self)
+
+
+class SummaryFilter(logging.Filter):
+    """ Drop per-file records, those carrying detail, below warning level so
+        only summaries and problems reach the log file. """
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or \
+            getattr(record, 'detail', None) is None
+
+
+def setup(logger, filename, level=logging.INFO, formatter=None,
+          aggregate=False, detail=None):
+    """ Send records from logger through a queue to a listener thread which
+        writes those at level or above to the log file at filename, so
+        worker threads never wait on the disk. With aggregate set per-file
+        records are left out of the log file in favour of summaries, and
+        when detail names a file every per-file record is written to it as
+        compressed NDJSON whatever the level. Does nothing if logging is
+        already set up. Returns the QueueListener. """
+
+    global _listener, _aggregate, _perfile
+    if _listener is not None:
+        return _listener
+
+    filehandler = logging.FileHandler(filename)
+    filehandler.setLevel(level)
+    if formatter is not None:
+        filehandler.setFormatter(formatter)
+    if aggregate:
+        filehandler.addFilter(SummaryFilter())
+    handlers = [filehandler]
+
+    if detail:
+        handlers.append(DetailHandler(detail))
+
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    # per-file records are always needed for the detail file
+    logger.setLevel(min(level, logging.DEBUG) if detail else level)
+
+    _aggregate = aggregate
+    _perfile = not aggregate or bool(detail)
+    _listener = logging.handlers.QueueListener(
+        records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop)
+
+    return _listener
+
+
+def stop():
+    """ Write every queued record and close the log files. """
+
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def per_file():
+    """ Return whether records for each file found or removed are wanted,
+        so callers can skip building them when they would be dropped. """
+
+    return _perfile
+
+
+def aggregated():
+    """ Return whether per-game summaries replace per-file log lines. """
+
+    return _aggregate
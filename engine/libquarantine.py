@@ -0,0 +1,418 @@
+# filename:     libquarantine.py
+# description:  Quarantine moving files into a trash directory on the same
+#               drive so they can be restored instantly or purged later.
+
+import errno
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+import engine.libclean as libclean
+import engine.librules as librules
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libquarantine')
+
+TRASHNAME = '.steamclean-quarantine'    # trash directory on each drive
+INDEXNAME = 'index.ndjson'              # record of every file moved
+FILESNAME = 'files'                     # directory holding the files moved
+BATCHSIZE = 256     # files handled between each flush and check
+
+
+def trash_dir(path):
+    """ Return the trash directory for the drive holding path. It is kept
+        in the highest writable directory above path on the same device,
+        as the top of the drive usually is, so files are only renamed and
+        never copied. Returns None if no such directory exists. """
+
+    try:
+        device = os.stat(path).st_dev
+    except OSError:
+        return None
+
+    top = None
+    current = os.path.abspath(path)
+    while True:
+        if os.access(current, os.W_OK):
+            top = current
+        parent = os.path.dirname(current)
+        try:
+            if parent == current or os.stat(parent).st_dev != device:
+                break
+        except OSError:
+            break
+        current = parent
+
+    return os.path.join(top, TRASHNAME) if top is not None else None
+
+
+class Quarantine(object):
+    """ Trash directory on a single drive. Files are renamed into it under
+        a unique id and every move, restore and purge is appended to its
+        index as one JSON object per line so the quarantine survives an
+        interrupted run. Each move is written and flushed before the file
+        is renamed and marked done or failed afterwards. """
+
+    def __init__(self, root):
+        self.root = root
+        self.filesdir = os.path.join(root, FILESNAME)
+        self.indexpath = os.path.join(root, INDEXNAME)
+        self.device = None
+        self.index = None
+
+    def open(self):
+        """ Create the trash directory if needed and open its index for
+            appending. Returns the device the trash directory is on. """
+
+        if self.index is None:
+            os.makedirs(self.filesdir, exist_ok=True)
+            self.index = open(self.indexpath, 'a', encoding='utf-8')
+            self.device = os.stat(self.filesdir).st_dev
+        return self.device
+
+    def write(self, op, key, **data):
+        data['op'] = op
+        data['id'] = key
+        self.index.write(json.dumps(data) + '\n')
+
+    def flush(self):
+        if self.index is not None:
+            self.index.flush()
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    def entries(self):
+        """ Return a dictionary of the files held in the quarantine keyed
+            by the id given to each, oldest first. Each entry holds the
+            original path, the size in bytes and the time it was moved.
+            A move interrupted before it was marked done is only included
+            if the file did reach the quarantine. """
+
+        held = {}
+        moving = set()      # moves not yet marked done
+        try:
+            with open(self.indexpath, encoding='utf-8') as index:
+                for line in index:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be incomplete after an
+                        # interruption
+                        liblogger.warning('Ignoring invalid index line in %s',
+                                          self.indexpath)
+                        continue
+
+                    op = entry.get('op')
+                    if op == 'moving':
+                        held[entry['id']] = entry
+                        moving.add(entry['id'])
+                    elif op == 'quarantined' and 'path' not in entry:
+                        moving.discard(entry['id'])
+                    elif op == 'quarantined':
+                        # entries written back by compact
+                        held[entry['id']] = entry
+                    else:
+                        held.pop(entry.get('id'), None)
+                        moving.discard(entry.get('id'))
+        except FileNotFoundError:
+            pass
+
+        for key in moving:
+            if key in held and not os.path.lexists(self.held_path(key)):
+                del held[key]
+
+        return held
+
+    def held_path(self, key):
+        """ Return the path a quarantined file is held at. """
+
+        return os.path.join(self.filesdir, key)
+
+    def move(self, path, size):
+        """ Rename path into the quarantine. Returns a (moved, detail,
+            retry) tuple where detail is the id given to the file or the
+            reason it could not be moved and retry is whether trying again
+            later might succeed. """
+
+        key = uuid.uuid4().hex
+        # the original path is recorded before the file is renamed so it
+        # can always be restored, even if the run is killed in between
+        self.write('moving', key, path=path, size=size, time=time.time())
+        self.flush()
+        try:
+            os.rename(path, self.held_path(key))
+        except OSError as e:
+            self.write('failed', key)
+            if e.errno == errno.EXDEV:
+                # a mount point lies between the file and the trash
+                # directory, the file is never copied instead
+                return False, 'Quarantine is on another device', False
+            return False, e.strerror or str(e), True
+
+        self.write('quarantined', key)
+        return True, key, True
+
+    def compact(self):
+        """ Rewrite the index with only the files still held so it does not
+            grow without limit. """
+
+        held = self.entries()
+        self.close()
+        temp = self.indexpath + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as index:
+            for entry in held.values():
+                entry['op'] = 'quarantined'
+                index.write(json.dumps(entry) + '\n')
+        os.replace(temp, self.indexpath)
+
+
+def _matches(entry, game):
+    """ Return whether a quarantined file belongs to game, given as the
+        path of a game directory or just its name, or to any game if game
+        is None. """
+
+    if game is None:
+        return True
+    path = os.path.normcase(entry['path'])
+    game = os.path.normcase(game)
+    if os.path.isabs(game):
+        return path.startswith(game.rstrip(os.sep) + os.sep)
+    return game in path.split(os.sep)[:-1]
+
+
+def find_quarantines(dirs):
+    """ Return a Quarantine for every trash directory which exists on the
+        drives holding dirs, each only once. """
+
+    found = {}
+    for path in dirs:
+        root = trash_dir(path)
+        if root is not None and root not in found and os.path.isdir(root):
+            found[root] = Quarantine(root)
+    return list(found.values())
+
+
+def quarantine_files(paths, jobs=1, journal=None, prune=True, progress=None,
+                     cancel=None, plan=True, matcher=None, keep=True,
+                     games=()):
+    """ Move all files in paths into the quarantine of their drive instead
+        of removing them, taking the same arguments and returning the same
+        dictionary as libclean.remove_files so either can be called. Each
+        file is moved with a single rename so no data is copied, and moves
+        are made one at a time whatever jobs is as a rename costs no more
+        than handing it to a worker. Files whose drive has no writable
+        directory for a quarantine, or which would have to cross a mount
+        point to reach it, fail with the reason instead of being copied.
+        Such failures are journaled as permanent so resuming never retries
+        them. Directories left empty are pruned as when removing. """
+
+    if matcher is None:
+        matcher = librules.get_matcher()
+
+    result = {'removed': 0, 'failed': 0, 'bytes': 0, 'pruned': 0,
+              'files': []}
+    quarantines = {}    # quarantine for each device, None if unavailable
+    unavailable = {}    # (reason, retry) for each device without one
+    moved = []          # files moved, to prune their directories
+
+    def fail(path, reason, retry=True):
+        result['failed'] += 1
+        liblogger.error('Unable to quarantine %s: %s', path, reason,
+                        extra={'detail': {'op': 'failed', 'path': path,
+                                          'error': reason}})
+        print('Unable to quarantine %s: %s' % (path, reason))
+        if journal is not None:
+            journal.write('failed', path, error=reason, retry=retry)
+
+    def record():
+        # every move is already in the index so a file recorded as moved
+        # in the journal can always be found again
+        for quarantine in quarantines.values():
+            if quarantine is not None:
+                quarantine.flush()
+        if journal is not None:
+            journal.flush()
+        liblogger.info('%s file(s) quarantined, %s failed',
+                       result['removed'], result['failed'])
+        if progress is not None:
+            progress(result['removed'] + result['failed'],
+                     len(paths) if isinstance(paths, list) else None)
+
+    try:
+        for number, path in enumerate(paths, 1):
+            if journal is not None and plan:
+                journal.write('planned', path, mode='quarantine')
+            try:
+                st = os.lstat(path)
+            except OSError as e:
+                fail(path, e.strerror or str(e))
+                continue
+
+            if st.st_dev not in quarantines:
+                root = trash_dir(os.path.dirname(path))
+                quarantine = Quarantine(root) if root else None
+                unavailable[st.st_dev] = (
+                    'No quarantine available on the same device', False)
+                try:
+                    # the trash directory itself may be on another mount
+                    if quarantine is not None and \
+                            quarantine.open() != st.st_dev:
+                        quarantine.close()
+                        quarantine = None
+                except OSError as e:
+                    liblogger.error('Unable to open quarantine %s: %s', root,
+                                    e.strerror or str(e))
+                    unavailable[st.st_dev] = (
+                        'Unable to open quarantine %s: %s' %
+                        (root, e.strerror or str(e)), True)
+                    quarantine.close()
+                    quarantine = None
+                quarantines[st.st_dev] = quarantine
+
+            quarantine = quarantines[st.st_dev]
+            if quarantine is None:
+                fail(path, *unavailable[st.st_dev])
+            else:
+                done, detail, retry = quarantine.move(path, st.st_size)
+                if done:
+                    result['removed'] += 1
+                    result['bytes'] += st.st_size
+                    if keep:
+                        result['files'].append(path)
+                    if prune:
+                        moved.append(path)
+                    liblogger.debug('File %s quarantined as %s', path,
+                                    detail)
+                    if journal is not None:
+                        journal.write('quarantined', path, bytes=st.st_size,
+                                      quarantine=quarantine.root, id=detail)
+                else:
+                    fail(path, detail, retry)
+
+            if number % BATCHSIZE == 0:
+                record()
+                if cancel is not None and cancel.is_set():
+                    liblogger.warning('Quarantine cancelled')
+                    break
+        record()
+    finally:
+        for quarantine in quarantines.values():
+            if quarantine is not None:
+                quarantine.close()
+
+    if prune:
+        result['pruned'] = libclean.prune_dirs(moved, journal, matcher,
+                                               games)
+        if journal is not None:
+            journal.flush()
+
+    return result
+
+
+def restore_files(dirs, game=None):
+    """ Move the files held in the quarantines of the drives holding dirs
+        back to where they were found, recreating their directories. Only
+        the files of game, a game directory or its name, are restored if
+        given. Files are never restored over an existing file. Returns a
+        dictionary with the restored and failed file counts and bytes
+        restored. """
+
+    result = {'restored': 0, 'failed': 0, 'bytes': 0}
+    for quarantine in find_quarantines(dirs):
+        quarantine.open()
+        try:
+            for key, entry in quarantine.entries().items():
+                if not _matches(entry, game):
+                    continue
+
+                path = entry['path']
+                try:
+                    if os.path.lexists(path):
+                        raise FileExistsError(errno.EEXIST, 'File exists')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.rename(quarantine.held_path(key), path)
+                except OSError as e:
+                    result['failed'] += 1
+                    liblogger.error('Unable to restore %s: %s', path,
+                                    e.strerror or str(e))
+                    print('Unable to restore %s: %s' %
+                          (path, e.strerror or str(e)))
+                    continue
+
+                quarantine.write('restored', key)
+                result['restored'] += 1
+                result['bytes'] += entry['size']
+                liblogger.debug('File %s restored', path)
+        finally:
+            quarantine.close()
+        quarantine.compact()
+
+    return result
+
+
+def purge_files(dirs, game=None, older=None, target=None, jobs=1,
+                cancel=None, progress=None):
+    """ Permanently remove the files held in the quarantines of the drives
+        holding dirs, oldest first, in batches over jobs worker threads.
+        Only the files of game are purged if given, and only those held
+        for more than older seconds. When target is given purging stops on
+        each drive once target bytes are free, as needed by a free space
+        budget. Returns a dictionary with the purged and failed file counts
+        and the exact bytes freed. """
+
+    result = {'removed': 0, 'failed': 0, 'bytes': 0, 'pruned': 0}
+    limit = time.time() - older if older is not None else None
+
+    for quarantine in find_quarantines(dirs):
+        ids = {quarantine.held_path(key): key
+               for key, entry in quarantine.entries().items()
+               if _matches(entry, game) and
+               (limit is None or entry['time'] <= limit)}
+        paths = list(ids)
+
+        quarantine.open()
+        try:
+            for start in range(0, len(paths), BATCHSIZE):
+                batch = paths[start:start + BATCHSIZE]
+                if target is not None and \
+                        shutil.disk_usage(quarantine.root).free >= target:
+                    break
+                if cancel is not None and cancel.is_set():
+                    liblogger.warning('Purge cancelled')
+                    break
+
+                removal = libclean.remove_files(batch, jobs, prune=False)
+                for path in removal['files']:
+                    quarantine.write('purged', ids[path])
+                quarantine.flush()
+
+                for key in ('removed', 'failed', 'bytes'):
+                    result[key] += removal[key]
+                liblogger.info('%s quarantined file(s) purged from %s',
+                               result['removed'], quarantine.root)
+                if progress is not None:
+                    progress(result['removed'] + result['failed'], len(ids))
+        finally:
+            quarantine.close()
+        quarantine.compact()
+
+    return result
+
+
+def held(dirs, game=None):
+    """ Return the number of files and bytes held in the quarantines of the
+        drives holding dirs, only counting the files of game if given. """
+
+    count, size = 0, 0
+    for quarantine in find_quarantines(dirs):
+        for entry in quarantine.entries().values():
+            if _matches(entry, game):
+                count += 1
+                size += entry['size']
+    return count, size
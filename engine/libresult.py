@@ -0,0 +1,222 @@
+# filename:     libresult.py
+# description:  Compact column store of the files found by a scan, passed
+#               from scanning to cleaning in place of per-file dictionaries.
+
+from array import array
+from collections import namedtuple
+import os
+import re
+
+import engine.libscan as libscan
+
+# files found within a single game directory and their size in bytes
+GameTotal = namedtuple('GameTotal', ['game', 'provider', 'appid', 'count',
+                                     'size'])
+
+# characters directory paths are split on
+SEPARATORS = os.sep + (os.altsep or '')
+# each component of a directory path along with its trailing separator
+COMPONENT = re.compile('[^%s]*[%s]' % (re.escape(SEPARATORS),
+                                       re.escape(SEPARATORS)))
+
+
+def _split(path):
+    """ Split path after its last separator, returning the directory with
+        its trailing separator and the name, either of which may be empty.
+        Unlike os.path.split the parts always join back to path. """
+
+    cut = path.rfind(os.sep)
+    if os.altsep:
+        cut = max(cut, path.rfind(os.altsep))
+    return path[:cut + 1], path[cut + 1:]
+
+
+def _intern(table, ids, value):
+    """ Return the id of value in table, appending it if not yet present. """
+
+    number = ids.get(value)
+    if number is None:
+        number = ids[value] = len(table)
+        table.append(value)
+    return number
+
+
+class ScanResult(object):
+    """ Files found by a scan stored as parallel columns rather than one
+        object per file. Directories are kept as a tree of prefixes, each
+        recorded once as its parent and the id of its name, so the library
+        and game directories shared by many files are stored a single time
+        and names such as DirectX or DXSETUP.exe repeated between games
+        share one string. Sizes are kept as exact byte counts. Every file
+        is attributed to its game directory, whose provider and appid are
+        stored once, and the totals for the result, each game and each
+        provider are kept current as files are added. """
+
+    __slots__ = ('_names', '_nameids', '_dirparents', '_dirnames', '_dirids',
+                 '_lastdir', '_lastgame', '_dircolumn', '_namecolumn',
+                 '_sizes', '_games', '_gameids', '_gamecolumn', '_rules',
+                 '_ruleids', '_rulecolumn', '_gamecounts', '_gamebytes',
+                 'total')
+
+    def __init__(self, candidates=()):
+        self._names = []            # directory and file names
+        self._nameids = {}
+        self._dirparents = array('i')   # parent of each directory, or -1
+        self._dirnames = array('I')     # name of each directory
+        self._dirids = {}           # directory for each parent and name
+        self._lastdir = (None, -1)  # directory of the previous file added
+        self._lastgame = (None, -1)     # game of the previous file added
+        self._dircolumn = array('i')    # directory of each file, or -1
+        self._namecolumn = array('I')
+        self._sizes = array('Q')
+        self._games = []            # (game, provider, appid) of each game
+        self._gameids = {}
+        self._gamecolumn = array('I')
+        self._rules = []
+        self._ruleids = {}
+        self._rulecolumn = array('H')
+        self._gamecounts = array('Q')
+        self._gamebytes = array('Q')
+        self.total = 0              # bytes used by every file
+
+        self.extend(candidates)
+
+    def add(self, candidate):
+        """ Append a single Candidate record. """
+
+        path, size, game, rule, appid, provider = candidate
+        directory, name = _split(path)
+
+        # files are usually added a game at a time
+        key = (game, provider, appid)
+        if key == self._lastgame[0]:
+            game = self._lastgame[1]
+        else:
+            game = _intern(self._games, self._gameids, key)
+            if game == len(self._gamecounts):
+                self._gamecounts.append(0)
+                self._gamebytes.append(0)
+            self._lastgame = (key, game)
+
+        self._dircolumn.append(self._directory(directory))
+        self._namecolumn.append(_intern(self._names, self._nameids, name))
+        self._sizes.append(size)
+        self._gamecolumn.append(game)
+        self._rulecolumn.append(_intern(self._rules, self._ruleids, rule))
+
+        self._gamecounts[game] += 1
+        self._gamebytes[game] += size
+        self.total += size
+
+    def _directory(self, directory):
+        """ Return the id of directory, adding it and any of its parents
+            not yet stored. The directory of the previous file is checked
+            first as files are usually added a directory at a time. """
+
+        if directory == self._lastdir[0]:
+            return self._lastdir[1]
+
+        parent = -1
+        for component in COMPONENT.findall(directory):
+            name = _intern(self._names, self._nameids, component)
+            # a single integer key is much smaller than a tuple
+            key = (parent + 1) << 32 | name
+            number = self._dirids.get(key)
+            if number is None:
+                number = self._dirids[key] = len(self._dirparents)
+                self._dirparents.append(parent)
+                self._dirnames.append(name)
+            parent = number
+
+        self._lastdir = (directory, parent)
+        return parent
+
+    def _dirpath(self, number):
+        """ Return the path of the directory number, ending with a separator
+            or empty for files given without one. """
+
+        parts = []
+        while number >= 0:
+            parts.append(self._names[self._dirnames[number]])
+            number = self._dirparents[number]
+        return ''.join(reversed(parts))
+
+    def extend(self, candidates):
+        """ Append every Candidate record in candidates, which may be a
+            stream such as that from iter_redist. Returns the result so
+            it can be built in a single expression. """
+
+        for candidate in candidates:
+            self.add(candidate)
+        return self
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __getitem__(self, number):
+        game, provider, appid = self._games[self._gamecolumn[number]]
+        return libscan.Candidate(self.path(number), self._sizes[number], game,
+                                 self._rules[self._rulecolumn[number]], appid,
+                                 provider)
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self[number]
+
+    def path(self, number):
+        """ Return the full path of the file at position number. """
+
+        return self._dirpath(self._dircolumn[number]) + \
+            self._names[self._namecolumn[number]]
+
+    def paths(self):
+        """ Yield the full path of every file in the order they were added.
+            Each path is only built when needed, reusing the directory of
+            the previous file when it is the same. """
+
+        names = self._names
+        lastdir, dirpath = None, ''
+        for dirid, name in zip(self._dircolumn, self._namecolumn):
+            if dirid != lastdir:
+                lastdir, dirpath = dirid, self._dirpath(dirid)
+            yield dirpath + names[name]
+
+    def _rows(self, games):
+        """ Yield the position of every file within the game directories in
+            games, in the order the files were added. """
+
+        wanted = {number for number, (game, provider, appid) in
+                  enumerate(self._games) if game in games}
+        for number, game in enumerate(self._gamecolumn):
+            if game in wanted:
+                yield number
+
+    def files(self, game):
+        """ Return a Candidate record for every file found within the game
+            directory game, such as for display once the game is chosen. """
+
+        return [self[number] for number in self._rows({game})]
+
+    def select(self, games):
+        """ Return a new ScanResult holding only the files found within the
+            game directories in games. """
+
+        return ScanResult(self[number] for number in self._rows(set(games)))
+
+    def games(self):
+        """ Return a GameTotal for every game with files in the result, in
+            the order the games were first seen. """
+
+        return [GameTotal(game, provider, appid, count, size)
+                for (game, provider, appid), count, size in
+                zip(self._games, self._gamecounts, self._gamebytes)]
+
+    def providers(self):
+        """ Return a dictionary of the number of files and bytes found for
+            each provider. """
+
+        totals = {}
+        for game in self.games():
+            count, size = totals.get(game.provider, (0, 0))
+            totals[game.provider] = (count + game.count, size + game.size)
+        return totals
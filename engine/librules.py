@@ -0,0 +1,134 @@
+# filename:     librules.py
+# description:  Declarative rules deciding which directories and files are
+#               redistributables, compiled once into a single matcher.
+
+from fnmatch import translate
+import hashlib
+import json
+import logging
+import os
+import re
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.librules')
+
+# rules shipped with steamclean, see rules.json for the format
+RULESFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'rules.json')
+
+_matchers = {}  # default matchers for each provider, built when first used
+
+
+def load_rules(path=RULESFILE):
+    """ Read a rules file. The file holds "directories" and "files", each a
+        mapping of rule names to lists of case insensitive glob patterns
+        matched against a single directory or file name, "extensions", the
+        list of file extensions which may be removed, and "providers", a
+        mapping of provider names to any of the former which override or
+        extend the rules for that provider's games. """
+
+    with open(path, encoding='utf-8') as rulesfile:
+        return json.load(rulesfile)
+
+
+def _compile(patterns):
+    """ Combine named lists of glob patterns into one anchored regex with a
+        named group for each rule, so a single match reports the rule. """
+
+    names = {}      # regex group name for each rule name
+    groups = []
+    for index, (name, globs) in enumerate(sorted(patterns.items())):
+        if not globs:
+            continue
+        names['r%d' % index] = name
+        groups.append('(?P<r%d>%s)' % (index, '|'.join(translate(glob)
+                                                         for glob in globs)))
+
+    if not groups:
+        return None, names
+    return re.compile('|'.join(groups), re.IGNORECASE), names
+
+
+class RuleMatcher(object):
+    """ Compiled form of a set of rules for a single provider. Extensions
+        are checked with a set lookup and names with one combined regex. """
+
+    def __init__(self, rules, provider=None):
+        directories = dict(rules.get('directories', {}))
+        files = dict(rules.get('files', {}))
+        extensions = rules.get('extensions', [])
+
+        override = rules.get('providers', {}).get(provider, {})
+        directories.update(override.get('directories', {}))
+        files.update(override.get('files', {}))
+        extensions = override.get('extensions', extensions)
+
+        self.provider = provider
+        self.extensions = frozenset(ext.lower() for ext in extensions)
+        self.dirregex, self.dirnames = _compile(directories)
+        self.fileregex, self.filenames = _compile(files)
+
+        # identifies the rules so cached scan results can be invalidated
+        self.signature = hashlib.sha1(json.dumps(
+            [sorted(directories.items()), sorted(files.items()),
+             sorted(self.extensions)]).encode('utf-8')).hexdigest()
+
+    def match_dir(self, name):
+        """ Return the rule matching a directory name, or None. """
+
+        if self.dirregex is None:
+            return None
+        match = self.dirregex.match(name)
+        return self.dirnames[match.lastgroup] if match else None
+
+    def match_ext(self, name):
+        """ Return True if the extension of a file name may be removed. """
+
+        return os.path.splitext(name)[1].lower() in self.extensions
+
+    def match_file(self, name):
+        """ Return the rule matching a file name, or None. """
+
+        if self.fileregex is None:
+            return None
+        match = self.fileregex.match(name)
+        return self.filenames[match.lastgroup] if match else None
+
+    def match_path(self, relpath):
+        """ Return the rule matching the first directory in a path relative
+            to the game directory which matches any rule, or None. """
+
+        for part in relpath.replace('\\', '/').split('/'):
+            rule = self.match_dir(part)
+            if rule is not None:
+                return rule
+
+        return None
+
+    def match_target(self, relpath):
+        """ Return the rule matching a file named by an installation script,
+            relative to the game directory, or None. The extension must be
+            removable and either the file name or one of its directories
+            must match a rule. """
+
+        dirname, name = os.path.split(relpath.replace('\\', '/'))
+        if not self.match_ext(name):
+            return None
+
+        rule = self.match_file(name)
+        if rule is not None:
+            return rule
+        return self.match_path(dirname)
+
+
+def get_matcher(provider=None, path=None):
+    """ Return the matcher for a provider using the rules file at path, or
+        the shipped rules if no path is given. Matchers for the shipped
+        rules are built once and reused. """
+
+    if path is not None:
+        return RuleMatcher(load_rules(path), provider)
+
+    if provider not in _matchers:
+        _matchers[provider] = RuleMatcher(load_rules(), provider)
+    return _matchers[provider]
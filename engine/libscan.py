@@ -0,0 +1,242 @@
+# filename:     libscan.py
+# description:  Directory traversal used to locate redistributable files
+#               within game installation directories.
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+
+import engine.libquarantine as libquarantine
+import engine.librules as librules
+import engine.libstats as libstats
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libscan')
+
+# single cleanable file with its size in bytes, the game directory it was
+# found in, the name of the rule which matched it and the Steam appid and
+# provider of the game when known
+Candidate = namedtuple('Candidate', ['path', 'size', 'game', 'rule', 'appid',
+                                     'provider'], defaults=[None, None])
+
+
+def list_gamedirs(libdir):
+    """ Return the path of every directory directly within libdir, other
+        than a quarantine kept there. Entry types are read from the
+        directory listing itself so no additional stat call is made for
+        each child. """
+
+    with os.scandir(libdir) as entries:
+        return [entry.path for entry in entries if entry.is_dir() and
+                entry.name != libquarantine.TRASHNAME]
+
+
+def scan_gamedir(gamedir, index=None, matcher=None, excludes=None):
+    """ Find all redistributable files within a single game directory.
+        Subdirectories whose name matches a directory rule are walked and
+        files with a removable extension are reported under that rule, the
+        shipped rules are used unless a RuleMatcher is given. Every
+        directory is listed exactly once with os.scandir and only matching
+        files are stat'ed, using the data cached on each DirEntry where the
+        platform provides it. Returns a list of Candidate records in the
+        same order os.walk would produce.
+
+        Directories matching an ExcludeSet are never descended into and
+        excluded files are skipped before they are stat'ed. When a
+        ScanIndex is given the recorded results are returned without
+        walking if the directory is unchanged, otherwise the directories
+        walked are recorded along with the files found. """
+
+    if matcher is None:
+        matcher = librules.get_matcher()
+
+    library = os.path.dirname(gamedir)
+    if index is not None:
+        with libstats.phase('index', library):
+            cached = index.lookup(gamedir)
+        if cached is not None:
+            return cached
+
+    found = []
+    dirs = {}           # stat of each directory walked for the index
+    complete = True     # only store results when every directory was read
+
+    # time spent reading file sizes is only measured when profiling as it
+    # is interleaved with the walk itself
+    profiling = libstats.enabled()
+    started = time.perf_counter()
+    sizetime = 0
+    listed = 1
+
+    try:
+        # stat before listing so a change made during the scan is detected
+        if index is not None:
+            dirs[gamedir] = os.stat(gamedir)
+        with os.scandir(gamedir) as entries:
+            roots = [(os.path.abspath(entry.path), entry.name)
+                     for entry in entries if entry.is_dir()]
+    except OSError:
+        liblogger.warning('Unable to read directory %s, skipping', gamedir)
+        return found
+
+    for root, name in roots:
+        # only walk subdirectories with common redist names
+        rule = matcher.match_dir(name)
+        if rule is None or (excludes and excludes.excluded(root)):
+            continue
+
+        # walk top down matching os.walk ordering, symlinked directories
+        # are reported but not followed
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            subdirs = []
+            try:
+                if index is not None:
+                    dirs[current] = os.stat(current)
+                listed += 1
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if excludes and excludes.excluded(entry.path):
+                            continue
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                subdirs.append(entry.path)
+                        elif matcher.match_ext(entry.name) and \
+                                entry.is_file():
+                            try:
+                                if profiling:
+                                    start = time.perf_counter()
+                                    size = entry.stat().st_size
+                                    sizetime += time.perf_counter() - start
+                                else:
+                                    size = entry.stat().st_size
+                                found.append(Candidate(entry.path, size,
+                                                       gamedir, rule))
+                            except OSError:
+                                complete = False
+                                liblogger.warning('Unable to read %s',
+                                                  entry.path)
+            except OSError:
+                complete = False
+                liblogger.warning('Unable to read directory %s, skipping',
+                                  current)
+                continue
+
+            stack.extend(reversed(subdirs))
+
+    if profiling:
+        libstats.add('walk', time.perf_counter() - started - sizetime,
+                     library)
+        libstats.add('sizes', sizetime, library)
+        libstats.count('dirs', listed, library)
+        libstats.count('scandir', listed, library)
+        libstats.count('stat', len(found) + len(dirs), library)
+
+    if index is not None and complete:
+        with libstats.phase('index', library):
+            index.store(gamedir, dirs, found)
+
+    return found
+
+
+def scan_targets(gamedir, targets, appid=None, matcher=None,
+                 excludes=None):
+    """ Build Candidate records from the exact files named by a game's
+        installation script, given as a {path: (size, rule)} dictionary,
+        without walking the game directory. The directory holding each
+        named file is listed, without descending further, when it matches a
+        directory rule so accompanying files such as DirectX .cab archives
+        are found along with the installer itself. Files matching an
+        ExcludeSet are skipped. """
+
+    if matcher is None:
+        matcher = librules.get_matcher()
+
+    found = []
+    seen = set()    # normalized paths already reported
+    listed = set()  # redist directories already listed
+    started = time.perf_counter()
+
+    for path, (size, target_rule) in targets.items():
+        parent = os.path.dirname(path)
+        rule = matcher.match_path(os.path.relpath(parent, gamedir))
+
+        if rule is not None and parent not in listed and \
+                not (excludes and excludes.excluded(parent)):
+            listed.add(parent)
+            try:
+                with os.scandir(parent) as entries:
+                    for entry in entries:
+                        if excludes and excludes.excluded(entry.path):
+                            continue
+                        if matcher.match_ext(entry.name) and \
+                                entry.is_file():
+                            seen.add(os.path.normcase(entry.path))
+                            found.append(Candidate(entry.path,
+                                                   entry.stat().st_size,
+                                                   gamedir, rule, appid))
+            except OSError:
+                liblogger.warning('Unable to read directory %s, skipping',
+                                  parent)
+
+        if os.path.normcase(path) not in seen and \
+                not (excludes and excludes.excluded(path)):
+            seen.add(os.path.normcase(path))
+            found.append(Candidate(path, size, gamedir, target_rule, appid))
+
+    library = os.path.dirname(gamedir)
+    libstats.add('walk', time.perf_counter() - started, library)
+    libstats.count('dirs', len(listed), library)
+    libstats.count('scandir', len(listed), library)
+    libstats.count('stat', len(found), library)
+
+    return found
+
+
+def get_device(path):
+    """ Return the device id of path, or None if it cannot be read. """
+
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def map_by_device(func, paths, jobs=1):
+    """ Apply func to every path and yield the results in the order the
+        paths were given. When jobs is greater than one the paths are
+        grouped by device and each device receives its own worker pool so
+        a slow disk cannot hold up work queued for a faster one. The jobs
+        are shared evenly between devices with at least one per device. """
+
+    paths = list(paths)
+
+    if jobs <= 1 or len(paths) < 2:
+        for path in paths:
+            yield func(path)
+        return
+
+    devices = {}    # device id for each path
+    groups = {}     # count of paths found on each device
+    for path in paths:
+        devices[path] = get_device(path)
+        groups[devices[path]] = groups.get(devices[path], 0) + 1
+
+    limit = max(1, jobs // len(groups))
+    pools = {dev: ThreadPoolExecutor(max_workers=min(limit, count))
+             for dev, count in groups.items()}
+    liblogger.info('Scanning %s directories on %s device(s) with up to %s '
+                   'worker(s) per device', len(paths), len(groups), limit)
+
+    try:
+        futures = [pools[devices[path]].submit(func, path) for path in paths]
+        # results are collected in submission order so output matches the
+        # serial path regardless of which worker finishes first
+        for future in futures:
+            yield future.result()
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
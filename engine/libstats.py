@@ -0,0 +1,210 @@
+# filename:     libstats.py
+# description:  Optional instrumentation recording the time spent in each
+#               phase of a scan or clean along with file system counters.
+
+import functools
+import json
+import logging
+import threading
+import time
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libstats')
+
+# order and description of the phases shown in reports
+PHASES = [
+    ('registry', 'Registry reads'),
+    ('libraries', 'Library discovery'),
+    ('manifests', 'App manifests'),
+    ('vdf', 'VDF parsing'),
+    ('index', 'Index lookups'),
+    ('walk', 'Directory walks'),
+    ('sizes', 'Size collection'),
+    ('logging', 'Logging'),
+    ('scan', 'Total scan'),
+    ('clean', 'Removal'),
+]
+# order and description of the counters shown in reports
+COUNTERS = [
+    ('dirs', 'Directories visited'),
+    ('scandir', 'Directory listings'),
+    ('stat', 'Files stat\'ed'),
+    ('open', 'Files opened'),
+    ('remove', 'Files removed'),
+    ('syscalls', 'File system calls'),
+    ('files', 'Files matched'),
+    ('bytes', 'Bytes matched'),
+]
+# counters which are file system calls and included in the syscalls total
+SYSCALLS = ('scandir', 'stat', 'open', 'remove')
+
+# statistics currently being recorded, None when instrumentation is off
+_current = None
+
+
+class Stats(object):
+    """ Wall time of each phase and counters, in total and for each library
+        directory. Phases running on several worker threads at once are
+        summed, so their total may exceed the elapsed time. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.phases = {}
+        self.calls = {}
+        self.counters = {}
+        self.libraries = {}
+
+    def add(self, phase, seconds, library=None):
+        """ Add seconds to the time recorded for phase. """
+
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0) + seconds
+            self.calls[phase] = self.calls.get(phase, 0) + 1
+            if library is not None:
+                lib = self.libraries.setdefault(library, {})
+                lib[phase] = lib.get(phase, 0) + seconds
+
+    def count(self, name, number=1, library=None):
+        """ Add number to the counter name. """
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + number
+            if name in SYSCALLS:
+                self.counters['syscalls'] = \
+                    self.counters.get('syscalls', 0) + number
+            if library is not None:
+                lib = self.libraries.setdefault(library, {})
+                lib[name] = lib.get(name, 0) + number
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def to_dict(self):
+        """ Return every statistic recorded as a JSON compatible
+            dictionary. """
+
+        with self.lock:
+            elapsed = self.elapsed
+            if elapsed is None:
+                elapsed = time.perf_counter() - self.started
+            return {'elapsed': elapsed,
+                    'phases': {name: {'seconds': seconds,
+                                      'calls': self.calls[name]}
+                               for name, seconds in self.phases.items()},
+                    'counters': dict(self.counters),
+                    'libraries': {path: dict(values) for path, values in
+                                  self.libraries.items()}}
+
+    def report(self):
+        """ Return the statistics as lines of a summary table. """
+
+        data = self.to_dict()
+        lines = ['%-22s %12s %10s' % ('Phase', 'Seconds', 'Calls')]
+        for name, title in PHASES:
+            if name in data['phases']:
+                lines.append('%-22s %12.3f %10s' % (
+                    title, data['phases'][name]['seconds'],
+                    data['phases'][name]['calls']))
+        lines.append('%-22s %12.3f' % ('Elapsed', data['elapsed']))
+
+        lines.append('')
+        lines.append('%-22s %12s' % ('Counter', 'Total'))
+        for name, title in COUNTERS:
+            if name in data['counters']:
+                lines.append('%-22s %12s' % (title, data['counters'][name]))
+
+        for path, values in sorted(data['libraries'].items()):
+            lines.append('')
+            lines.append(path)
+            for name, title in PHASES + COUNTERS:
+                if name not in values:
+                    continue
+                if isinstance(values[name], float):
+                    lines.append('  %-20s %12.3f' % (title, values[name]))
+                else:
+                    lines.append('  %-20s %12s' % (title, values[name]))
+
+        return lines
+
+    def write_json(self, path):
+        """ Write the statistics to the file at path as JSON. """
+
+        with open(path, 'w') as statsfile:
+            json.dump(self.to_dict(), statsfile, indent=2)
+        liblogger.info('Statistics written to %s', path)
+
+
+def enable():
+    """ Start recording statistics, replacing any recorded so far, and
+        return the new Stats object. """
+
+    global _current
+    _current = Stats()
+    return _current
+
+
+def disable():
+    """ Stop recording statistics and return those recorded, if any. """
+
+    global _current
+    stats, _current = _current, None
+    if stats is not None:
+        stats.stop()
+    return stats
+
+
+def enabled():
+    return _current is not None
+
+
+def add(phase, seconds, library=None):
+    """ Add seconds to phase if statistics are being recorded. """
+
+    stats = _current
+    if stats is not None:
+        stats.add(phase, seconds, library)
+
+
+def count(name, number=1, library=None):
+    """ Add number to the counter name if statistics are being recorded. """
+
+    stats = _current
+    if stats is not None:
+        stats.count(name, number, library)
+
+
+class phase(object):
+    """ Context manager adding the time spent within it to a phase, doing
+        nothing when statistics are not being recorded. """
+
+    __slots__ = ('name', 'library', 'start')
+
+    def __init__(self, name, library=None):
+        self.name = name
+        self.library = library
+
+    def __enter__(self):
+        self.start = time.perf_counter() if _current is not None else None
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            add(self.name, time.perf_counter() - self.start, self.library)
+        return False
+
+
+def timed(name):
+    """ Decorator adding the time spent in each call of a function to the
+        phase name. """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
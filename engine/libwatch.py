@@ -0,0 +1,438 @@
+# filename:     libwatch.py
+# description:  Live tracking of cleanable files within game libraries using
+#               Linux inotify, optionally removing new files after a delay.
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import engine.libclean as libclean
+import engine.librules as librules
+import engine.libscan as libscan
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libwatch')
+
+# inotify event masks and flags from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# libraries and game directories are only watched for directories being
+# added or removed, redist directories also for files being written
+DIRMASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+           IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+REDISTMASK = DIRMASK | IN_MODIFY | IN_CLOSE_WRITE
+
+EVENT = struct.Struct('iIII')   # wd, mask, cookie and name length
+READSIZE = 64 * 1024
+
+
+def available():
+    """ Return whether inotify can be used on this system. """
+
+    return sys.platform.startswith('linux') and _libc() is not None
+
+
+_libcache = []
+
+
+def _libc():
+    if not _libcache:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                               use_errno=True)
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                               ctypes.c_uint32]
+            _libcache.append(libc)
+        except (OSError, AttributeError):
+            _libcache.append(None)
+    return _libcache[0]
+
+
+class Inotify(object):
+    """ Minimal wrapper around an inotify file descriptor. """
+
+    def __init__(self):
+        self.libc = _libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add(self, path, mask):
+        """ Watch path for the events in mask and return the watch
+            descriptor. """
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def remove(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """ Wait up to timeout seconds, or forever if None, for events and
+            return them as (wd, mask, cookie, name) tuples. """
+
+        ready = select.select([self.fd], [], [], timeout)[0]
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, READSIZE)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """ Cleanable files within a set of library directories kept current by
+        inotify. The libraries are scanned once to seed the state, then
+        every library, game directory and directory below a redist
+        directory is watched so new, removed and moved files and
+        directories are reflected immediately. Files named only by
+        installation scripts are not tracked.
+
+        When delay is given files added after the initial scan are removed
+        once delay seconds have passed since they were last written. """
+
+    def __init__(self, libraries, rules=None, excludes=None, delay=None,
+                 journal=None, jobs=1):
+        self.libraries = dict(libraries)    # library directory: provider
+        self.matchers = {provider: librules.get_matcher(provider, rules)
+                         for provider in set(self.libraries.values())}
+        self.excludes = excludes
+        self.delay = delay
+        self.journal = journal
+        self.jobs = jobs
+
+        self.lock = threading.Lock()
+        self.inotify = Inotify()
+        self.watches = {}   # wd: (kind, path, game, provider, rule)
+        self.paths = {}     # watched path: wd
+        self.cleanable = {}     # path: Candidate
+        self.total = 0          # bytes used by every cleanable file
+        self.pending = {}       # path: time it is due for removal
+        self.removed = 0
+        self.failed = 0
+        self.freed = 0
+
+    def seed(self):
+        """ Scan every library, watching each directory of interest, to
+            build the initial set of cleanable files. """
+
+        for libdir, provider in self.libraries.items():
+            self._watch(libdir, 'library', None, provider, None, DIRMASK)
+            for gamedir in libscan.list_gamedirs(libdir):
+                self._add_game(gamedir, provider, new=False)
+
+        liblogger.info('Watching %s directories, %s cleanable file(s) of %s '
+                       'bytes', len(self.paths), len(self.cleanable),
+                       self.total)
+
+    def _excluded(self, path):
+        return self.excludes and self.excludes.excluded(path)
+
+    def _watch(self, path, kind, game, provider, rule, mask):
+        try:
+            wd = self.inotify.add(path, mask)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                liblogger.error('inotify watch limit reached, raise '
+                                'fs.inotify.max_user_watches to watch %s',
+                                path)
+            elif e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                liblogger.warning('Unable to watch %s: %s', path, e)
+            return False
+        self.watches[wd] = (kind, path, game, provider, rule)
+        self.paths[path] = wd
+        return True
+
+    def _add_game(self, gamedir, provider, new):
+        """ Watch a game directory and every redist directory within it. """
+
+        if self._excluded(gamedir) or not self._watch(
+                gamedir, 'game', gamedir, provider, None, DIRMASK):
+            return
+
+        # the directory is listed after the watch is added so nothing
+        # created in between is missed
+        try:
+            with os.scandir(gamedir) as entries:
+                names = [entry.name for entry in entries
+                         if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return
+
+        for name in names:
+            self._add_redist(os.path.join(gamedir, name), gamedir, provider,
+                             new)
+
+    def _add_redist(self, root, gamedir, provider, new):
+        rule = self.matchers[provider].match_dir(os.path.basename(root))
+        if rule is not None:
+            self._add_tree(root, gamedir, provider, rule, new)
+
+    def _add_tree(self, root, gamedir, provider, rule, new):
+        """ Watch root and every directory below it, adding each file with a
+            removable extension. """
+
+        matcher = self.matchers[provider]
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            if self._excluded(current) or not self._watch(
+                    current, 'redist', gamedir, provider, rule, REDISTMASK):
+                continue
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif matcher.match_ext(entry.name) and \
+                                entry.is_file(follow_symlinks=False):
+                            self._add_file(entry.path, gamedir, rule, new)
+            except OSError:
+                liblogger.warning('Unable to read directory %s', current)
+
+    def _add_file(self, path, gamedir, rule, new):
+        if self._excluded(path):
+            return
+        try:
+            size = os.lstat(path).st_size
+        except OSError:
+            return
+
+        with self.lock:
+            old = self.cleanable.get(path)
+            self.total += size - (old.size if old else 0)
+            self.cleanable[path] = libscan.Candidate(path, size, gamedir,
+                                                     rule)
+            if new and self.delay is not None:
+                # the grace period restarts whenever the file is written
+                self.pending[path] = time.monotonic() + self.delay
+
+        if old is None:
+            liblogger.info('File %s found with size %s bytes', path, size)
+
+    def _touch(self, path, gamedir, rule):
+        """ Restart the grace period of a file being written. Its size is
+            only read again once it is closed. """
+
+        with self.lock:
+            known = path in self.cleanable
+            if known and self.delay is not None:
+                self.pending[path] = time.monotonic() + self.delay
+        if not known:
+            self._add_file(path, gamedir, rule, new=True)
+
+    def _settled(self, paths):
+        """ Return the files in paths which have not been written to for
+            the grace period, as a write may have been missed. The grace
+            period of the others restarts from their last write. """
+
+        settled = []
+        now = time.time()
+        for path in paths:
+            try:
+                age = now - os.lstat(path).st_mtime
+            except OSError:
+                # already gone, its deletion event is still to be read
+                self._remove_file(path)
+                continue
+            if age >= self.delay:
+                settled.append(path)
+            else:
+                with self.lock:
+                    if path in self.pending:
+                        self.pending[path] = time.monotonic() + \
+                            self.delay - age
+        return settled
+
+    def _remove_file(self, path):
+        with self.lock:
+            old = self.cleanable.pop(path, None)
+            self.pending.pop(path, None)
+            if old is not None:
+                self.total -= old.size
+        if old is not None:
+            liblogger.info('File %s no longer present', path)
+
+    def _remove_tree(self, path):
+        """ Forget every file and stop watching every directory at or below
+            path. """
+
+        prefix = path + os.sep
+        with self.lock:
+            for fpath in [p for p in self.cleanable
+                          if p.startswith(prefix)]:
+                self.total -= self.cleanable.pop(fpath).size
+                self.pending.pop(fpath, None)
+
+        for wpath in [p for p in self.paths
+                      if p == path or p.startswith(prefix)]:
+            wd = self.paths.pop(wpath)
+            self.watches.pop(wd, None)
+            # watches on deleted directories are already gone
+            self.inotify.remove(wd)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            liblogger.warning('inotify queue overflowed, rescanning')
+            self.rescan()
+            return
+
+        watch = self.watches.get(wd)
+        if watch is None:
+            return
+        kind, path, gamedir, provider, rule = watch
+
+        if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+            if self.paths.get(path) == wd:
+                self._remove_tree(path)
+            return
+
+        child = os.path.join(path, name)
+        isdir = mask & IN_ISDIR
+
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            if isdir:
+                self._remove_tree(child)
+            else:
+                self._remove_file(child)
+        elif mask & (IN_CREATE | IN_MOVED_TO) and isdir:
+            if kind == 'library':
+                self._add_game(child, provider, new=True)
+            elif kind == 'game':
+                self._add_redist(child, gamedir, provider, new=True)
+            else:
+                self._add_tree(child, gamedir, provider, rule, new=True)
+        elif mask & IN_MODIFY and kind == 'redist':
+            if self.matchers[provider].match_ext(name):
+                self._touch(child, gamedir, rule)
+        elif mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE) and \
+                kind == 'redist':
+            if self.matchers[provider].match_ext(name):
+                self._add_file(child, gamedir, rule, new=True)
+
+    def rescan(self):
+        """ Drop all state and scan every library again. """
+
+        for wd in list(self.watches):
+            self.inotify.remove(wd)
+        self.watches.clear()
+        self.paths.clear()
+        with self.lock:
+            self.cleanable.clear()
+            self.pending.clear()
+            self.total = 0
+        self.seed()
+
+    def poll(self, timeout=None):
+        """ Wait up to timeout seconds for changes, apply them and remove
+            any files due for removal. Returns whether anything changed. """
+
+        if self.pending:
+            due = min(self.pending.values()) - time.monotonic()
+            timeout = max(0, due if timeout is None else min(timeout, due))
+
+        events = self.inotify.read(timeout)
+        for wd, mask, cookie, name in events:
+            self._handle(wd, mask, name)
+
+        now = time.monotonic()
+        with self.lock:
+            due = [path for path, deadline in self.pending.items()
+                   if deadline <= now]
+        if due:
+            due = self._settled(due)
+        if due:
+            self.clean(due)
+
+        return bool(events or due)
+
+    def run(self, cancel=None, changed=None, interval=1):
+        """ Apply changes until the cancel event is set, checking it at
+            least every interval seconds. changed is called with the
+            number of cleanable files and their total size in bytes each
+            time either changes. """
+
+        last = self.status()
+        while cancel is None or not cancel.is_set():
+            if self.poll(interval) and changed is not None and \
+                    self.status() != last:
+                last = self.status()
+                changed(*last)
+
+    def status(self):
+        """ Return the number of cleanable files and their size in bytes. """
+
+        with self.lock:
+            return len(self.cleanable), self.total
+
+    def files(self):
+        """ Return a list of every cleanable Candidate. """
+
+        with self.lock:
+            return list(self.cleanable.values())
+
+    def clean(self, paths=None):
+        """ Remove the cleanable files in paths, or all of them, using
+            libclean and return its result. """
+
+        with self.lock:
+            if paths is None:
+                paths = list(self.cleanable)
+            for path in paths:
+                self.pending.pop(path, None)
+            games = {self.cleanable[path].game for path in paths
+                     if path in self.cleanable}
+
+        if self.journal is not None:
+            for game in games:
+                self.journal.write('game', game)
+        result = libclean.remove_files(list(paths), self.jobs, self.journal,
+                                       games=games)
+        for path in result['files']:
+            self._remove_file(path)
+        self.removed += result['removed']
+        self.failed += result['failed']
+        self.freed += result['bytes']
+        liblogger.info('%s file(s) removed, %s bytes freed',
+                       result['removed'], result['bytes'])
+        return result
+
+    def close(self):
+        self.inotify.close()
@@ -3,12 +3,15 @@
 # Filename:         gsteamclean.pyw
 # Description:      tkinter frontend for steamclean.py
 
+import providers.libproviders as libproviders
 import providers.libsteam as libsteam
-import providers.libgalaxy as libgalaxy
-import providers.liborigin as liborigin
+import engine.libresult as libresult
+import engine.libstats as libstats
 
 from os import path as ospath
 from sys import path as syspath
+import queue
+import threading
 
 from tkinter import *
 from tkinter import filedialog
@@ -20,6 +23,15 @@ import steamclean as sc
 """ The GUI is composed of 2 frames: the top shall list the directories
             and the bottom shall list the relevant files within them. """
 
+POLLDELAY = 50      # milliseconds between checks for worker results
+BATCHSIZE = 500     # maximum worker results handled on each check
+
+# glyphs shown in the Clean column for groups which are fully, partly or
+# not at all included in the clean step
+INCLUDED = '[x]'
+PARTIAL = '[-]'
+EXCLUDED = '[ ]'
+
 class DirectoryFrame(ttk.Frame):
     """ Top UI frame containing the list of directories to be scanned. """
 
@@ -104,17 +116,36 @@ class FileDataFrame(ttk.Frame):
         self.vscroll = ttk.Scrollbar(self.listframe)
         self.vscroll.pack(side=RIGHT, fill=Y)
 
-        # treeview containing details on filenames and sizes of all detected
-        # files from specified directories
+        # treeview grouping the detected files under each library and game
+        # with the number of files and their size, the files of a game are
+        # only inserted once it is expanded
         self.fdata_tree = ttk.Treeview(self.listframe)
-        self.fdata_tree['columns'] = ('Filesize')
+        self.fdata_tree['columns'] = ('Files', 'Filesize', 'Clean')
         self.fdata_tree.config(xscrollcommand=self.hscroll.set,
                                yscrollcommand=self.vscroll.set)
-        self.fdata_tree.column('Filesize', stretch=0, width=128)
-
-        # use first column for the path instead of default icon
-        self.fdata_tree.heading('#0', text='Path', anchor=W)
-        self.fdata_tree.heading('0', text='Filesize (MB)', anchor=W)
+        self.fdata_tree.column('#0', width=448)
+        self.fdata_tree.column('Files', stretch=0, width=64, anchor=E)
+        self.fdata_tree.column('Filesize', stretch=0, width=128, anchor=E)
+        self.fdata_tree.column('Clean', stretch=0, width=48, anchor=CENTER)
+
+        # use first column for the path instead of default icon, clicking a
+        # heading sorts the libraries and games by that column
+        self.fdata_tree.heading('#0', text='Path', anchor=W, command=lambda:
+                                gSteamclean.sort_groups(parent, 'name'))
+        self.fdata_tree.heading('Files', text='Files', anchor=W,
+                                command=lambda:
+                                gSteamclean.sort_groups(parent, 'count'))
+        self.fdata_tree.heading('Filesize', text='Filesize (MB)', anchor=W,
+                                command=lambda:
+                                gSteamclean.sort_groups(parent, 'size'))
+        self.fdata_tree.heading('Clean', text='Clean', anchor=W)
+        self.fdata_tree.bind('<<TreeviewOpen>>', lambda event:
+                             gSteamclean.load_files(parent))
+        self.fdata_tree.bind('<Button-1>', lambda event:
+                             gSteamclean.on_click(parent, event))
+        self.fdata_tree.bind('<space>', lambda event:
+                             gSteamclean.toggle_group(
+                                 parent, self.fdata_tree.focus()))
         self.fdata_tree.pack(side=TOP, fill=BOTH)
 
         self.hscroll.configure(orient=HORIZONTAL,
@@ -122,6 +153,13 @@ class FileDataFrame(ttk.Frame):
         self.vscroll.configure(orient=VERTICAL,
                                command=self.fdata_tree.yview)
 
+        # button showing the statistics recorded during the last scan
+        self.stats_button = ttk.Button(parent, text='Stats',
+                                       state=DISABLED, command=lambda:
+                                       gSteamclean.show_stats(parent))
+        self.stats_button.grid(column=col, row=row+2, padx=10, pady=2,
+                               sticky=W)
+
         # label to show total files found and their size
         # this label is blank to hide it until required to be shown
         self.total_label = ttk.Label(parent)
@@ -135,6 +173,17 @@ class FileDataFrame(ttk.Frame):
         self.remove_button.grid(column=col+2, row=row+2, padx=10,
                                 pady=2, sticky=E)
 
+        # progress of the running scan or clean and the button to stop it
+        self.progress = ttk.Progressbar(parent, orient=HORIZONTAL,
+                                        mode='determinate')
+        self.progress.grid(column=col, columnspan=2, row=row+3, padx=10,
+                           pady=2, sticky=EW)
+        self.cancel_button = ttk.Button(parent, text='Cancel',
+                                        state=DISABLED, command=lambda:
+                                        gSteamclean.cancel_task(parent))
+        self.cancel_button.grid(column=col+2, row=row+3, padx=10, pady=2,
+                                sticky=E)
+
 
 class gSteamclean(Tk):
     """ Main application class to hold all internal frames for the UI. """
@@ -143,10 +192,19 @@ class gSteamclean(Tk):
         Tk.__init__(self)
 
         #uses windows registry to attempt to automatically detect directories
-        steamdir = libsteam.winreg_read()
-        galaxydir = libgalaxy.winreg_read()
-        origindir = liborigin.winreg_read()
-        self.providers = [steamdir, galaxydir, origindir]
+        self.installs = dict(libproviders.find_installs())
+        steamdir = self.installs.get('steam')
+        self.providers = list(self.installs.values())
+
+        # results from background scan and clean tasks are passed back to
+        # the main thread through this queue and read by poll_task
+        self.tasks = queue.Queue()
+        self.cancel = threading.Event()
+        self.task = None    # name of the running task, scan or clean
+        self.stats = None   # statistics recorded during the last scan
+        self.result = libresult.ScanResult()    # files found by the scan
+        self.scanned = 0    # game directories scanned so far
+        self.reset_groups()
 
         #window properties
         self.title('steamclean v' + sc.VERSION)
@@ -182,75 +240,424 @@ class gSteamclean(Tk):
             return seldir
 
     def scan_dirs(self):
-        """ Method to scan the directories """
+        """ Method to scan the directories on a background thread. Results
+            are added to the list in batches as they are found. """
         
         self.fdata_frame.total_label['text'] = ''
-
-        totals = {'count': 0, 'size': 0}
+        self.result = libresult.ScanResult()
+        self.scanned = 0
 
         # entry all previous results from gui
         treeview = self.fdata_frame.fdata_tree
-        for item in treeview.get_children():
-            treeview.delete(item)
-
-        # build list of detected files from selected paths
-        files = sc.find_redist(provider_dirs=self.providers,
-                               customdirs=self.dirframe.dirlist.get(0, END))
-
-        totals['count'] = str(len(files))
-
-        if len(files) > 0:
-            # add into gui all file paths and sizes formatted to MB
-            for k, v in files.items():
-                fsize = format(v, '.2f')
-                totals['size'] = totals['size'] + v
-                # insert data into root element at the end of the list
-                # text is the file path, value is filesize
-                self.fdata_frame.fdata_tree.insert('', 'end', text=k,
-                                                   value=fsize)
-
-            # total files found and modify hidden label with this data
-            totals['size'] = str(format(totals['size'], '.2f'))
-            totaltext = 'Total: %s files (%s MB)' % (totals['count'],
-                                                     totals['size'])
-            self.fdata_frame.total_label['text'] = totaltext
-
-            # enable clean button only if items are found for removal
-            self.fdata_frame.remove_button['state'] = 'enabled'
-        else:
-            messagebox.showinfo(title='Congratulations',
-                                message='No files found for removal.')
+        treeview.delete(*treeview.get_children())
+        self.reset_groups()
+
+        # only the directories left in the list are scanned, provider
+        # installations are passed as such rather than looked up again and
+        # Steam libraries are only those still listed
+        listed = self.dirframe.dirlist.get(0, END)
+        if not listed:
+            messagebox.showinfo('Nothing to scan',
+                                'Add at least one directory to scan.')
+            return
+        provider_dirs = [(name, path) for name, path in self.installs.items()
+                         if path in listed]
+        customdirs = [path for path in listed if path not in self.providers]
+        self.start_task('scan', self.scan_worker, provider_dirs, customdirs)
+
+    def scan_worker(self, provider_dirs, customdirs):
+        """ Build list of detected files from selected paths. This runs on
+            a worker thread and must only communicate through the queue. """
+
+        def progress(done, total):
+            self.tasks.put(('progress', done, total))
+
+        libstats.enable()
+        try:
+            for candidate in sc.iter_redist(provider_dirs=provider_dirs,
+                                            customdirs=customdirs,
+                                            expand_libraries=False,
+                                            progress=progress,
+                                            cancel=self.cancel):
+                self.tasks.put(('found', candidate))
+        finally:
+            stats = libstats.disable()
+
+        self.tasks.put(('scanned', stats))
 
     def clean_all(self):
-        """ Method to clean the directory of scanned files to be deleted. """
-        
-        flist = {}  # dictionary of all file data read from gui
-
-        # loop through treeview items to get the path and filesize
-        treeview = self.fdata_frame.fdata_tree
-        for i in treeview.get_children():
-            # need to use text here as the first column was repurposed
-            flist[treeview.item(i, 'text')] = treeview.item(i, 'value')[0]
+        """ Method to clean the directory of scanned files to be deleted.
+            The files are taken from the result of the scan, leaving out
+            any game excluded in the list, rather than read back from the
+            list itself. """
+
+        result = self.result
+        if self.excluded:
+            result = result.select(game for game in self.games
+                                   if game not in self.excluded)
+        if len(result) == 0:
+            messagebox.showinfo('Nothing selected',
+                                'Include at least one game to clean.')
+            return
 
         # prompt user to confirm the permanent deletion of detected files
         confirm_prompt = 'Do you wish to permanently delete all items?'
         confirm = messagebox.askyesno('Confirm removal', confirm_prompt)
 
         # convert response into expected values for clean_data function
-        #prints a message to a message box with amount of space user has saved
         if confirm is True:
-            fcount, tsize = sc.clean_data(flist, confirm='y')
+            self.start_task('clean', self.clean_worker, result)
+        else:
+            sc.clean_data(result, confirm='n')
+
+    def clean_worker(self, result):
+        """ Remove all files on a worker thread and report the result. """
+
+        def progress(done, total):
+            self.tasks.put(('progress', done, total))
+
+        journal = 'steamclean_' + sc.timenow + '.journal'
+        fcount, tsize = sc.clean_data(result, confirm='y', progress=progress,
+                                      cancel=self.cancel, journal=journal)
+        self.tasks.put(('cleaned', fcount, tsize))
+
+    def start_task(self, task, target, *args):
+        """ Run target on a worker thread, disabling the scan and clean
+            buttons until it completes or is cancelled. """
+
+        self.task = task
+        self.cancel.clear()
+        self.fdata_frame.scan_btn['state'] = 'disabled'
+        self.fdata_frame.remove_button['state'] = 'disabled'
+        self.fdata_frame.stats_button['state'] = 'disabled'
+        self.fdata_frame.cancel_button['state'] = 'enabled'
+        self.fdata_frame.progress['value'] = 0
+
+        def run():
+            try:
+                target(*args)
+            except Exception as exc:
+                sc.sclogger.exception('Unknown exception raised')
+                self.tasks.put(('error', exc))
+
+        threading.Thread(target=run, daemon=True).start()
+        self.after(POLLDELAY, self.poll_task)
+
+    def cancel_task(self):
+        """ Ask the running worker to stop at the next opportunity. """
+
+        self.cancel.set()
+        self.fdata_frame.cancel_button['state'] = 'disabled'
+
+    def poll_task(self):
+        """ Handle a batch of results from the running worker then schedule
+            the next check unless the worker has finished. """
+
+        rows = []       # rows inserted into the treeview in a single batch
+        latest = None   # only the most recent progress update is shown
+        finished = None
+
+        try:
+            for i in range(BATCHSIZE):
+                message = self.tasks.get_nowait()
+                if message[0] == 'found':
+                    rows.append(message[1])
+                elif message[0] == 'progress':
+                    latest = message[1:]
+                else:
+                    finished = message
+                    break
+        except queue.Empty:
+            pass
+
+        # add the files to the totals of their game and library, only the
+        # groups changed are redrawn once the whole batch is counted
+        changed = set()
+        for candidate in rows:
+            self.result.add(candidate)
+            changed.update(self.add_file(candidate))
+        for iid in changed:
+            self.draw_group(iid)
+
+        if latest is not None:
+            self.update_progress(*latest)
+        elif rows:
+            self.update_progress()
+
+        if finished is None:
+            self.after(POLLDELAY, self.poll_task)
+        else:
+            self.finish_task(*finished)
+
+    def update_progress(self, done=None, total=None):
+        """ Show the current totals and move the progress bar if the number
+            of completed items is known. """
+
+        if total:
+            self.fdata_frame.progress['maximum'] = total
+            self.fdata_frame.progress['value'] = done
+
+        if self.task == 'clean':
+            totaltext = 'Removed %s of %s files' % (done, total)
+        else:
+            if done is not None:
+                self.scanned = done
+            totaltext = 'Scanned %s dirs, found %s files (%s MB)' % (
+                self.scanned, len(self.result),
+                format((self.result.total / 1024) / 1024, '.2f'))
+        self.fdata_frame.total_label['text'] = totaltext
+
+    def finish_task(self, kind, *result):
+        """ Restore the buttons and report the result of a worker. """
+
+        treeview = self.fdata_frame.fdata_tree
+        self.task = None
+        self.fdata_frame.scan_btn['state'] = 'enabled'
+        self.fdata_frame.cancel_button['state'] = 'disabled'
+
+        if self.stats is not None:
+            self.fdata_frame.stats_button['state'] = 'enabled'
+
+        if kind == 'scanned':
+            self.stats = result[0]
+            self.fdata_frame.stats_button['state'] = 'enabled'
+
+            if len(self.result) > 0:
+                # games found after the list was sorted are put in place
+                if self.sortkey is not None:
+                    self.apply_sort()
+                # show the files to be cleaned and enable the clean button
+                self.update_totals()
+            elif not self.cancel.is_set():
+                messagebox.showinfo(title='Congratulations',
+                                    message='No files found for removal.')
+
+        elif kind == 'cleaned' and self.cancel.is_set():
+            # keep the list as only some files may have been removed
+            self.fdata_frame.remove_button['state'] = 'enabled'
+            messagebox.showinfo('Cancelled', 'Removal cancelled, scan again '
+                                'to refresh the list of remaining files.')
+
+        elif kind == 'cleaned':
+            #prints a message to a message box with amount of space saved
+            fcount, tsize = result
             filemsg = str(fcount) + ' files removed successfully.\n'
             sizemsg = str(format(tsize, '.2f')) + ' MB saved.'
             messagebox.showinfo('Success!', filemsg + sizemsg)
 
             # get list of all filenames and then remove them after cleaning
-            treeitems = self.fdata_frame.fdata_tree.get_children()
-            for item in treeitems:
-                self.fdata_frame.fdata_tree.delete(item)
+            treeview.delete(*treeview.get_children())
+            self.result = libresult.ScanResult()
+            self.reset_groups()
+            self.fdata_frame.total_label['text'] = ''
+
+        else:
+            messagebox.showerror('Error', 'Unexpected error: %s' % result[0])
+
+    def reset_groups(self):
+        """ Forget the library and game groups shown in the list. """
+
+        self.libraries = {}     # tree item of each library directory
+        self.games = {}         # tree item of each game directory
+        self.gamedirs = {}      # game directory of each game tree item
+        self.nodes = {}         # [name, files, bytes] of each tree item
+        self.loaded = set()     # game tree items whose files are inserted
+        self.excluded = set()   # game directories left out of the clean
+        self.sortkey = None     # (column, reverse) the list is sorted by
+
+    def add_file(self, candidate):
+        """ Count a file found by the scan in its game and library groups,
+            creating them as needed, and return their tree items. The file
+            itself is only inserted if its game has been expanded. """
+
+        treeview = self.fdata_frame.fdata_tree
+
+        game = self.games.get(candidate.game)
+        if game is None:
+            libdir = ospath.dirname(candidate.game)
+            library = self.libraries.get(libdir)
+            if library is None:
+                library = treeview.insert('', 'end', text=libdir, open=True)
+                self.libraries[libdir] = library
+                self.nodes[library] = [libdir, 0, 0]
+
+            name = ospath.basename(candidate.game)
+            game = treeview.insert(library, 'end', text=name)
+            # placeholder so the game can be expanded before its files are
+            # inserted
+            treeview.insert(game, 'end', text='Loading...')
+            self.games[candidate.game] = game
+            self.gamedirs[game] = candidate.game
+            self.nodes[game] = [name, 0, 0]
+
+        library = treeview.parent(game)
+        for iid in (game, library):
+            self.nodes[iid][1] += 1
+            self.nodes[iid][2] += candidate.size
+
+        if game in self.loaded:
+            self.insert_file(game, candidate)
+        return game, library
+
+    def insert_file(self, game, candidate):
+        """ Insert a single file row below its game. """
+
+        iid = self.fdata_frame.fdata_tree.insert(
+            game, 'end', text=candidate.path,
+            values=('', format((candidate.size / 1024) / 1024, '.2f'), ''))
+        self.nodes[iid] = [candidate.path, 1, candidate.size]
+
+    def load_files(self):
+        """ Insert the files of a game when it is first expanded, in the
+            order the list is sorted by. """
+
+        game = self.fdata_frame.fdata_tree.focus()
+        if game not in self.gamedirs or game in self.loaded:
+            return
+
+        treeview = self.fdata_frame.fdata_tree
+        treeview.delete(*treeview.get_children(game))
+        for candidate in self.result.files(self.gamedirs[game]):
+            self.insert_file(game, candidate)
+        self.loaded.add(game)
+        if self.sortkey is not None:
+            self.sort_children(game)
+
+    def glyph(self, iid):
+        """ Return the Clean column glyph of a library or game item. """
+
+        if iid in self.gamedirs:
+            return EXCLUDED if self.gamedirs[iid] in self.excluded \
+                else INCLUDED
+
+        games = self.fdata_frame.fdata_tree.get_children(iid)
+        excluded = sum(1 for game in games
+                       if self.gamedirs[game] in self.excluded)
+        if excluded == 0:
+            return INCLUDED
+        return EXCLUDED if excluded == len(games) else PARTIAL
+
+    def draw_group(self, iid):
+        """ Show the current totals and glyph of a library or game. """
+
+        name, count, size = self.nodes[iid]
+        self.fdata_frame.fdata_tree.item(
+            iid, values=(count, format((size / 1024) / 1024, '.2f'),
+                         self.glyph(iid)))
+
+    def on_click(self, event):
+        """ Toggle a group when its Clean column is clicked. """
+
+        treeview = self.fdata_frame.fdata_tree
+        if treeview.identify_region(event.x, event.y) == 'cell' and \
+                treeview.identify_column(event.x) == '#3':
+            self.toggle_group(treeview.identify_row(event.y))
+            return 'break'
+
+    def toggle_group(self, iid):
+        """ Include or exclude a game, or every game of a library, from the
+            clean step. A library with any game included is excluded as a
+            whole, otherwise all of its games are included. """
+
+        treeview = self.fdata_frame.fdata_tree
+        if iid in self.gamedirs:
+            games = [iid]
+            library = treeview.parent(iid)
+            exclude = self.gamedirs[iid] not in self.excluded
+        elif iid in self.nodes and treeview.parent(iid) == '':
+            games = treeview.get_children(iid)
+            library = iid
+            exclude = self.glyph(iid) != EXCLUDED
         else:
-            sc.clean_data(flist, confirm='n')
+            # files can only be left out along with their game
+            return
+
+        for game in games:
+            if exclude:
+                self.excluded.add(self.gamedirs[game])
+            else:
+                self.excluded.discard(self.gamedirs[game])
+            self.draw_group(game)
+        self.draw_group(library)
+        self.update_totals()
+
+    def update_totals(self):
+        """ Show the files and size included in the clean step, enabling
+            the clean button when there is anything to remove and no task
+            is running. The scan progress is shown instead while scanning. """
+
+        if self.task is not None:
+            return
+
+        count, size = 0, 0
+        for gamedir, game in self.games.items():
+            if gamedir not in self.excluded:
+                count += self.nodes[game][1]
+                size += self.nodes[game][2]
+
+        self.fdata_frame.total_label['text'] = \
+            'Selected: %s of %s files (%s MB)' % (
+                count, len(self.result), format((size / 1024) / 1024, '.2f'))
+        self.fdata_frame.remove_button['state'] = \
+            'enabled' if count > 0 else 'disabled'
+
+    def sort_groups(self, column):
+        """ Sort the list by column, name, count or size, reversing the
+            order when sorted by the same column again. Sizes and counts
+            are sorted largest first. """
+
+        if self.sortkey is not None and self.sortkey[0] == column:
+            self.sortkey = (column, not self.sortkey[1])
+        else:
+            self.sortkey = (column, column != 'name')
+        self.apply_sort()
+
+    def apply_sort(self):
+        """ Move the libraries, games and any expanded files into the order
+            given by sortkey. """
+
+        for parent in [''] + list(self.libraries.values()) + \
+                list(self.loaded):
+            self.sort_children(parent)
+
+    def sort_children(self, parent):
+        """ Move the children of a tree item into the order given by
+            sortkey. Items are moved in place rather than inserted again
+            and are ordered by the totals kept for them rather than values
+            read back from the list. """
+
+        treeview = self.fdata_frame.fdata_tree
+        column, reverse = self.sortkey
+        field = ('name', 'count', 'size').index(column)
+
+        def key(iid):
+            value = self.nodes[iid][field]
+            return value.lower() if field == 0 else value
+
+        children = sorted(treeview.get_children(parent), key=key,
+                          reverse=reverse)
+        for index, iid in enumerate(children):
+            treeview.move(iid, parent, index)
+
+    def show_stats(self):
+        """ Open a window with the time spent in each phase of the last
+            scan and the file system counters for every library. """
+
+        window = Toplevel(self)
+        window.title('Scan statistics')
+
+        lines = self.stats.report()
+        text = Text(window, width=64, height=min(len(lines), 30) + 1,
+                    font='TkFixedFont')
+        vscroll = ttk.Scrollbar(window, orient=VERTICAL, command=text.yview)
+        text.config(yscrollcommand=vscroll.set)
+        text.insert(END, '\n'.join(lines))
+        text.config(state=DISABLED)
+
+        vscroll.pack(side=RIGHT, fill=Y)
+        text.pack(side=LEFT, fill=BOTH, expand=True)
 
 if __name__ == '__main__':
+    sc.setup_logging()
     sc.print_header(filename=ospath.basename(__file__))
     gSteamclean().mainloop()
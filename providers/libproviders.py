@@ -1,17 +1,60 @@
 # filename:     libproviders.py
-# description:  Common functions for provider library usage.
+# description:  Common functions for provider library usage and the
+#               registry of supported providers.
+
+import engine.libstats as libstats
 
 from platform import machine as pm
+import functools
+import importlib
 import logging
 import os
-import winreg
 
 liblogger = logging.getLogger('steamclean.libproviders')
 
+# module implementing each provider, imported only when first used
+PROVIDERS = {
+    'steam': 'providers.libsteam',
+    'galaxy': 'providers.libgalaxy',
+    'origin': 'providers.liborigin',
+}
+
+
+def get_provider(name):
+    """ Return the module implementing the provider name, importing it on
+        first use. """
+
+    return importlib.import_module(PROVIDERS[name])
+
+
+def find_installs(names=None):
+    """ Look up the installation directory of each provider in names, or
+        of every provider if None, in the registry. Returns a list of
+        (name, path) pairs for the installations found, which is always
+        empty outside of Windows where no provider module is loaded. """
 
+    if os.name != 'nt':
+        return []
+
+    installs = []
+    for name in names if names is not None else PROVIDERS:
+        path = get_provider(name).winreg_read()
+        if path is not None:
+            installs.append((name, path))
+    return installs
+
+
+@functools.lru_cache(maxsize=None)
+@libstats.timed('registry')
 def winreg_read(keypath, subkeyname):
     """ Get provider installation path from reading registry data.
-    If unable to read registry information prompt user for input. """
+    If unable to read registry information prompt user for input. The
+    result of each lookup is cached for the life of the process. """
+
+    # Windows registry is only available, and only needed, on Windows
+    if os.name != 'nt':
+        return None
+    import winreg
 
     system_type = pm()
     regbase = 'HKEY_LOCAL_MACHINE\\'
@@ -2,15 +2,36 @@
 # description:  Collection of functions directly related to the Steam client
 #               handling within steamclean.py
 
+import engine.librules as librules
+import engine.libscan as libscan
+import engine.libstats as libstats
 import providers.libproviders as libproviders
+import providers.libvdf as libvdf
 
+import engine.libclean as libclean
+
+import heapq
 import logging
 import os
 import re
+import shutil
+import stat
+import time
 
 # module specific sublogger to avoid duplicate log entries
 liblogger = logging.getLogger('steamclean.libsteam')
 
+# installation script values naming a file relative to the game directory
+INSTALLDIRREGEX = re.compile(r'^\s*%INSTALLDIR%(.+?)\s*$', re.IGNORECASE)
+# application manifests stored within each library steamapps directory
+MANIFESTREGEX = re.compile(r'^appmanifest_\d+\.acf$', re.IGNORECASE)
+# directories within steamapps holding data Steam recreates as needed
+CACHEDIRS = ['shadercache', 'downloading', 'temp']
+# downloaded workshop items, only removed when asked for
+WORKSHOPDIR = os.path.join('workshop', 'content')
+# files changed more recently than this are assumed to be in use
+CACHEMINAGE = 60 * 60
+
 
 def winreg_read():
     """ Get Steam installation path from reading registry data.
@@ -25,95 +46,333 @@ def winreg_read():
     return install_path
 
 
+@libstats.timed('libraries')
 def get_libraries(steamdir):
     """ Attempt to automatically read extra Steam library directories by
-        checking the libraryfolders.vdf file. """
+        checking the libraryfolders.vdf file. Both the original format, with
+        each numbered key set to a path, and the newer format, with a nested
+        section holding a "path" key, are supported. """
 
     libfiledir = os.path.join(steamdir, 'steamapps')
     # Build the path to libraryfolders.vdf which stores configured libraries.
     libfile = os.path.abspath(os.path.join(libfiledir, 'libraryfolders.vdf'))
-    # This regex checks for lines starting with the number and grabs the
-    # path specified in that line by matching anything within quotes.
-    libregex = re.compile('(^\t"[1-8]").*(".*")')
 
-    try:
-        libdirs = []
+    libdirs = []
 
+    try:
         liblogger.info('Attempting to read libraries from %s', libfile)
-        with open(libfile) as file:
-            for line in file:
-                dir = libregex.search(line)
-                if dir:
-                    # Normalize directory path which is the second match group
-                    ndir = os.path.normpath(dir.group(2))
-                    liblogger.info('Library found at %s', ndir)
-                    libdirs.append(ndir.strip('"'))
-
-        # Return list of any directories found, directories are checked
-        # outside of this function for validity and are ignored if invalid.
-        return libdirs
+        tree = libvdf.load(libfile)
     except FileNotFoundError:
-        liblogger.error('Unable to find file %s', libfile, steamdir)
-        print('Unable to find file %s' % (libfile, steamdir))
+        liblogger.error('Unable to find file %s', libfile)
+        print('Unable to find file %s' % (libfile))
+        return libdirs
     except PermissionError:
         liblogger.error('Permission denied to %s', libfile)
         print('Permission denied to %s' % (libfile))
+        return libdirs
+    except libvdf.VDFError as e:
+        liblogger.error('Invalid data in file %s: %s', libfile, e)
+        return libdirs
+
+    folders = libvdf.find(tree, 'libraryfolders') or {}
+    for key, value in folders.items():
+        # only numbered keys are libraries, others hold client settings
+        if not key.isdigit():
+            continue
+
+        path = value if isinstance(value, str) else libvdf.find(value, 'path')
+        if not path:
+            continue
+
+        # the Steam directory itself is listed first in the newer format
+        ndir = os.path.normpath(path)
+        if os.path.normcase(ndir) == os.path.normcase(
+                os.path.normpath(steamdir)):
+            continue
+
+        liblogger.info('Library found at %s', ndir)
+        libdirs.append(ndir)
+
+    # Return list of any directories found, directories are checked
+    # outside of this function for validity and are ignored if invalid.
+    return libdirs
 
 
 def fix_game_path(dir):
-    """ Fix path to include proper directory structure if needed. """
+    """ Fix path to include proper directory structure if needed. The
+        steamapps directory is found without regard to case so a library
+        given in either form resolves to the same common directory. """
 
-    if 'SteamApps' not in dir:
+    appsdir = get_appsdir(dir)
+    if appsdir is not None:
+        dir = os.path.join(appsdir, 'common')
+    elif 'steamapps' not in dir.lower():
         dir = os.path.join(dir, 'SteamApps', 'common')
     # normalize path before returning
     return os.path.abspath(dir)
 
 
-def check_vdf(gamedirs):
-    """ Read .vdf files for additional content for removal. """
+@libstats.timed('manifests')
+def read_manifests(libdir):
+    """ Read the appmanifest_*.acf files of the library holding libdir, a
+        steamapps/common directory, and return a dictionary mapping the
+        normalized path of each installed game directory to its appid. """
+
+    manifests = {}
+    appsdir = os.path.dirname(libdir)
+
+    libstats.count('scandir')
+    try:
+        with os.scandir(appsdir) as entries:
+            acffiles = [entry.path for entry in entries
+                        if MANIFESTREGEX.match(entry.name)]
+    except OSError:
+        liblogger.warning('Unable to read manifests from %s', appsdir)
+        return manifests
+
+    for acffile in acffiles:
+        try:
+            appstate = libvdf.find(libvdf.load(acffile), 'AppState')
+        except (OSError, libvdf.VDFError):
+            liblogger.error('Invalid data in file %s', acffile)
+            continue
+
+        appid = libvdf.find(appstate, 'appid')
+        installdir = libvdf.find(appstate, 'installdir')
+        if appid and installdir:
+            gamedir = os.path.normcase(os.path.join(libdir, installdir))
+            manifests[gamedir] = appid
+
+    liblogger.info('%s app manifests found in %s', len(manifests), appsdir)
+    return manifests
+
+
+@libstats.timed('vdf')
+def read_vdf(game, matcher=None):
+    """ Read the .vdf files within a single game directory for additional
+        content for removal. Returns the path to the last .vdf file that
+        named at least one cleanable file, or an empty string if none did,
+        and a dictionary of cleanable files with their size in bytes and the
+        name of the matching rule. The shipped rules are used unless a
+        RuleMatcher is given. """
+
+    if matcher is None:
+        matcher = librules.get_matcher('steam')
 
     vdfcleanable = {}
+    vpath = ''
 
-    # get all vdf files from game directories for review
-    for game in gamedirs:
-        files = os.listdir(game)
-        for file in files:
-            if '.vdf' in file:
-                gamedirs[game] = os.path.abspath(os.path.join(game, file))
+    libstats.count('scandir')
+    # get the vdf files from the game directory for review
+    try:
+        with os.scandir(game) as entries:
+            vdffiles = [entry.path for entry in entries
+                        if entry.name.lower().endswith('.vdf')]
+    except OSError:
+        liblogger.error('Unable to read directory %s', game)
+        return vpath, vdfcleanable
 
-    # Remove any directories that do not have a valid .vdf file.
-    # Get the key (game) and remove those with empty vpath (.vdf not present)
-    cleangamedirs = {game: vpath for game, vpath in gamedirs.items() if vpath}
+    for vdffile in vdffiles:
+        try:
+            tree = libvdf.load(vdffile)
+        except libvdf.VDFError as e:
+            liblogger.error('Invalid data in file %s: %s', vdffile, e)
+            continue
+        except OSError:
+            liblogger.error('Unable to read file %s', vdffile)
+            continue
 
-    # Substitute game path for %INSTALLDIR% within .vdf file.
-    for game in cleangamedirs:
-        with open(cleangamedirs[game]) as vdffile:
+        # Substitute game path for %INSTALLDIR% in every value within the
+        # .vdf file which references an installation path.
+        for value in libvdf.iter_values(tree):
+            match = INSTALLDIRREGEX.match(value)
+            if not match:
+                continue
+
+            # Build list of existing and valid files, .vdf paths always use
+            # Windows separators.
+            relpath = match.group(1).replace('\\', os.sep).strip(os.sep)
+            fpath = os.path.abspath(os.path.join(game, relpath))
+            # Check filename to determine if it is a redistributable before
+            # adding to cleanable to ensure a required file is not removed.
+            rule = matcher.match_target(relpath)
+            if rule is None:
+                continue
+
+            libstats.count('stat')
             try:
-                for line in vdffile:
-                    # Only read lines with an installation specified.
-                    if 'INSTALLDIR' in line:
-                        # Replace %INSTALLDIR% with path and make it valid.
-                        splitline = line.split('%')
-                        newline = splitline[1].replace('INSTALLDIR', game) + \
-                            splitline[2][0: splitline[2].find('.') + 4]
-
-                        # Build list of existing and valid files
-                        fpath = os.path.abspath(newline).lower()
-                        if os.path.isfile(fpath) and os.path.exists(fpath):
-                            # Check filename to determine if it is a
-                            # redistributable before adding to cleanable to
-                            # ensure a required file is not removed.
-                            for rc in ['setup', 'redist']:
-                                if rc in fpath:
-                                    vdfcleanable[fpath] = (
-                                        (os.path.getsize(fpath) / 1024) / 1024)
-            except UnicodeDecodeError:
-                sclogger.error('Invalid characters found in file %s',
-                               vdffile)
-            except IndexError:
-                sclogger.error('Invalid data in file %s', vdffile)
-
-            except:
-                liblogger.exception('Unknown exception raised')
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                vdfcleanable[fpath] = (st.st_size, rule)
+                vpath = vdffile
+
+    return vpath, vdfcleanable
+
+
+def check_vdf(gamedirs, jobs=1):
+    """ Read .vdf files for additional content for removal. Game directories
+        are read in parallel when jobs is greater than one. """
+
+    vdfcleanable = {}
+
+    # record the .vdf file found for each game and merge results in order
+    results = libscan.map_by_device(read_vdf, list(gamedirs), jobs)
+    for game, (vpath, cleanable) in zip(list(gamedirs), results):
+        gamedirs[game] = vpath
+        for fpath, (fsize, rule) in cleanable.items():
+            vdfcleanable[fpath] = ((fsize / 1024) / 1024)
 
     return vdfcleanable
+
+
+def get_appsdir(libdir):
+    """ Return the steamapps directory of the library at libdir, which may
+        be the library itself, its steamapps directory or the common
+        directory within it. The name is matched without regard to case as
+        Steam does. Returns None if there is no steamapps directory. """
+
+    path = os.path.abspath(libdir)
+    for candidate in (path, os.path.dirname(path)):
+        if os.path.basename(candidate).lower() == 'steamapps':
+            return candidate
+
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.lower() == 'steamapps' and entry.is_dir():
+                    return entry.path
+    except OSError:
+        pass
+    return None
+
+
+def get_cachedirs(libdirs, workshop=False):
+    """ Return every shader cache, download and temporary directory within
+        the libraries in libdirs, including downloaded workshop content if
+        workshop is set. """
+
+    names = CACHEDIRS + ([WORKSHOPDIR] if workshop else [])
+    cachedirs = []
+    for libdir in libdirs:
+        appsdir = get_appsdir(libdir)
+        if appsdir is None:
+            continue
+        for name in names:
+            cachedir = os.path.join(appsdir, name)
+            if os.path.isdir(cachedir) and cachedir not in cachedirs:
+                cachedirs.append(cachedir)
+    return cachedirs
+
+
+def free_space(path):
+    """ Return the bytes available to unprivileged users on the file system
+        holding path. """
+
+    try:
+        st = os.statvfs(path)
+        return st.f_bavail * st.f_frsize
+    except AttributeError:
+        # statvfs is not available on Windows
+        return shutil.disk_usage(path).free
+
+
+def _cache_heaps(cachedirs, minage):
+    """ Walk every cache directory once and return a heap of files for each
+        device, ordered so the least recently used and then largest files
+        come first. Files changed within minage seconds are left out. """
+
+    heaps = {}
+    limit = time.time() - minage
+    for cachedir in cachedirs:
+        stack = [cachedir]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        if st.st_mtime > limit:
+                            continue
+                        lastused = max(st.st_atime, st.st_mtime)
+                        heaps.setdefault(st.st_dev, []).append(
+                            (lastused, -st.st_size, entry.path))
+            except OSError:
+                liblogger.warning('Unable to read directory %s', current)
+
+    for heap in heaps.values():
+        heapq.heapify(heap)
+    return heaps
+
+
+def clean_caches(libdirs, target, workshop=False, minage=CACHEMINAGE,
+                 jobs=1, journal=None, dryrun=False, batchsize=256):
+    """ Remove shader caches, leftover downloads and temporary files, and
+        workshop content if workshop is set, from the libraries in libdirs
+        until at least target bytes are free on each file system holding
+        them. The caches are walked once and the least recently used, then
+        largest, files removed first in batches with libclean, checking
+        the free space after each batch rather than scanning again. When
+        dryrun is set nothing is removed and the free space is estimated
+        from the file sizes.
+
+        Returns a dictionary as from libclean.remove_files, along with the
+        free space on each file system before and after and whether the
+        target was met on all of them. """
+
+    result = {'removed': 0, 'failed': 0, 'bytes': 0, 'pruned': 0,
+              'files': [], 'devices': {}, 'met': True}
+
+    cachedirs = get_cachedirs(libdirs, workshop)
+    heaps = _cache_heaps(cachedirs, minage)
+    devices = {}    # a directory on each device to check free space with
+    for cachedir in cachedirs:
+        devices.setdefault(os.stat(cachedir).st_dev, cachedir)
+
+    for dev, path in devices.items():
+        heap = heaps.get(dev, [])
+        free = before = free_space(path)
+        liblogger.info('%s bytes free on the file system holding %s, %s '
+                       'cache file(s) eligible for removal', free, path,
+                       len(heap))
+
+        while free < target and heap:
+            # take enough of the best candidates to cover the shortfall
+            batch = []
+            needed = target - free
+            while heap and needed > 0 and len(batch) < batchsize:
+                lastused, negsize, fpath = heapq.heappop(heap)
+                batch.append(fpath)
+                needed += negsize
+
+            if dryrun:
+                for fpath in batch:
+                    liblogger.info('File %s would be removed', fpath)
+                    result['files'].append(fpath)
+                result['removed'] += len(batch)
+                freed = target - free - needed
+                result['bytes'] += freed
+                free += freed
+                continue
+
+            removal = libclean.remove_files(batch, jobs, journal,
+                                            prune=False)
+            for key in ('removed', 'failed', 'bytes', 'files'):
+                result[key] += removal[key]
+            # the file system reports the space actually released
+            free = free_space(path)
+
+        result['devices'][path] = {'before': before, 'after': free}
+        if free < target:
+            result['met'] = False
+            liblogger.warning('Only %s bytes free on the file system holding '
+                              '%s after removing every eligible file', free,
+                              path)
+
+    return result
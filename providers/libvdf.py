@@ -0,0 +1,141 @@
+# filename:     libvdf.py
+# description:  Parser for the Valve KeyValues text format used by .vdf and
+#               appmanifest_*.acf files.
+
+import engine.libstats as libstats
+
+import logging
+import os
+import re
+import threading
+
+# module specific sublogger to avoid duplicate log entries
+liblogger = logging.getLogger('steamclean.libvdf')
+
+# Each match is a single token: a quoted string including its quotes, an
+# opening or closing brace, a bare unquoted string or any other character
+# which is invalid. Comments and platform conditionals such as [$WIN32]
+# match with every group empty and are skipped.
+TOKENREGEX = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*")|([{}])|//[^\n]*|'
+                        r'\[[^\]\n]*\]|([^\s"{}]+)|(\S)', re.DOTALL)
+ESCAPEREGEX = re.compile(r'\\(.)', re.DOTALL)
+ESCAPES = {'\\': '\\', '"': '"', 'n': '\n', 't': '\t'}
+
+# parsed files keyed by path and validated against their mtime and size
+_cache = {}
+_cachelock = threading.Lock()
+
+
+class VDFError(ValueError):
+    """ Raised when a file does not contain valid KeyValues data. """
+
+
+def _unescape(match):
+    # unknown escapes are kept as written so unescaped windows paths survive
+    return ESCAPES.get(match.group(1), match.group(0))
+
+
+def parse(text):
+    """ Parse KeyValues text into a tree of dictionaries where every value
+        is either a string or a nested dictionary section. Sections which
+        are repeated are merged and repeated values keep the last one. """
+
+    root = {}
+    stack = [root]  # sections currently open, innermost last
+    current = root  # innermost open section
+    key = None      # key waiting for its value
+
+    # tokenizing the whole text at once is considerably faster than
+    # matching one token at a time, strings are checked first as they are
+    # by far the most common token
+    for quoted, brace, bare, invalid in TOKENREGEX.findall(text):
+        if quoted or bare:
+            if quoted:
+                string = quoted[1:-1]
+                if '\\' in string:
+                    string = ESCAPEREGEX.sub(_unescape, string)
+            else:
+                string = bare
+
+            if key is None:
+                key = string
+            else:
+                # values never replace a section of the same name
+                if not isinstance(current.get(key), dict):
+                    current[key] = string
+                key = None
+        elif brace == '{':
+            if key is None:
+                raise VDFError('Section without a name')
+            # sections appearing more than once are merged into the first
+            section = current.get(key)
+            if not isinstance(section, dict):
+                section = current[key] = {}
+            stack.append(section)
+            current = section
+            key = None
+        elif brace == '}':
+            if key is not None or len(stack) == 1:
+                raise VDFError('Unexpected closing brace')
+            stack.pop()
+            current = stack[-1]
+        elif invalid:
+            raise VDFError('Unexpected character %r' % invalid)
+
+    if key is not None or len(stack) != 1:
+        raise VDFError('Unexpected end of data')
+
+    return root
+
+
+def load(path):
+    """ Read and parse the file at path. Results are cached by path, mtime
+        and size so repeated reads of an unchanged file are free. The tree
+        returned is shared and must not be modified. """
+
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size)
+    libstats.count('stat')
+
+    with _cachelock:
+        cached = _cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    libstats.count('open')
+    with open(path, encoding='utf-8-sig', errors='replace') as vdffile:
+        tree = parse(vdffile.read())
+
+    with _cachelock:
+        _cache[path] = (signature, tree)
+
+    return tree
+
+
+def find(node, key):
+    """ Return the value of key within node ignoring case, as Steam does, or
+        None if it is not present. """
+
+    if not isinstance(node, dict):
+        return None
+    if key in node:
+        return node[key]
+
+    key = key.lower()
+    for name, value in node.items():
+        if name.lower() == key:
+            return value
+
+    return None
+
+
+def iter_values(node):
+    """ Yield every string value within node and all of its sections. """
+
+    stack = [node]
+    while stack:
+        for value in stack.pop().values():
+            if isinstance(value, dict):
+                stack.append(value)
+            else:
+                yield value
@@ -5,49 +5,82 @@
 # Description:      Script to find and remove extraneous files from
 #                   Steam game installation directories.
 
+import providers.libproviders as libproviders
 import providers.libsteam as libsteam
-import providers.libgalaxy as libgalaxy
-import providers.liborigin as liborigin
+import engine.libclean as libclean
+import engine.libdedup as libdedup
+import engine.libexclude as libexclude
+import engine.libindex as libindex
+import engine.liblog as liblog
+import engine.libquarantine as libquarantine
+import engine.libresult as libresult
+import engine.librules as librules
+import engine.libscan as libscan
+import engine.libstats as libstats
+import engine.libwatch as libwatch
 
-from codecs import StreamReader
 from datetime import datetime
 from platform import machine as pm
 from platform import platform as pp
 import argparse
+import contextlib
+import cProfile
+import csv
+import json
 import logging
 import os
-import re
-
-#nt = Windows
-#Windows registry needed to find installation directories
-if (os.name == 'nt'):
-    import winreg
+import sys
+import time
 
 VERSION = '0.8.1'   # Global version number as string
 
-# build sclogger and its configuration to write script data to specified log
+# exit status of the commandline script
+EXITOK = 0          # finished, every file handled successfully
+EXITFAILED = 1      # finished, some files could not be removed or the
+                    # free space target was not met
+EXITUSAGE = 2       # invalid arguments or nothing to scan
+EXITCANCELLED = 130 # interrupted by the user
+
+# formats results can be written in with --output
+OUTPUTFORMATS = ('ndjson', 'csv', 'json')
+# multipliers for the size suffixes accepted by --free-space
+SIZEUNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3,
+             't': 1024 ** 4}
+
+# sclogger writes script data to the log configured by setup_logging, until
+# then nothing is written so importing this module has no side effects
 sclogger = logging.getLogger('steamclean')
-sclogger.setLevel(logging.INFO)
 logformatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s',
                                  datefmt='%Y-%m-%d %H:%M:%S')
 # # use current date and time for log file name for clarity
 timenow = datetime.now().strftime('%Y%m%d-%H%M')
-fh = logging.FileHandler('steamclean_' + timenow + '.log')
-fh.setFormatter(logformatter)
-sclogger.addHandler(fh)
 
 
-def print_header(filename=None):
+def setup_logging(filename=None, level=logging.INFO, aggregate=False,
+                  detail=None):
+    """ Write script data to the log file at filename, or a file named by
+        the current date and time, at level. Records are written on a
+        background thread, see liblog.setup for the aggregate and detail
+        options. Called by the entry points only and does nothing if
+        logging has already been set up. """
+
+    return liblog.setup(sclogger,
+                        filename or 'steamclean_' + timenow + '.log',
+                        level, logformatter, aggregate, detail)
+
+
+def print_header(filename=None, clear=True):
     """ Clear terminal window and print script name and release date.
         This is only run if running the script file directly, built
-        binaries will fail this step. """
+        binaries will fail this step. The window is left alone if clear is
+        not set. """
 
     if not filename:
         filename = os.path.basename(__file__)
 
     header = filename + ' v' + VERSION
 
-    if __name__ == '__main__':
+    if __name__ == '__main__' and clear:
         if os.name == 'nt':
             os.system('cls')
         elif os.name == 'posix':
@@ -66,172 +99,467 @@ def print_header(filename=None):
     print('Current operating system: %s %s\n' % (pp(), pm()))
 
 
-def find_redist(provider_dirs=None, customdirs=None):
-    """ Create list and scan all directories for removable data. """
+def _dirkey(path):
+    """ Return a key identifying the physical directory at path however it
+        is reached, through symlinks, bind mounts or a differently cased
+        path. File systems without inode numbers fall back to the resolved
+        path. Raises OSError if path cannot be read. """
 
-    #providerdirs is a list of the default directories, given by windows registry
-    providerdirs = []
-    if os.name == 'nt':
-        providerdirs.append(libsteam.winreg_read())
-        providerdirs.append(libgalaxy.winreg_read())
-        providerdirs.append(liborigin.winreg_read())
+    st = os.stat(path)
+    if st.st_ino:
+        return (st.st_dev, st.st_ino)
+    return os.path.normcase(os.path.realpath(path))
 
-    # Remove all invalid provider directories if not found via registry check
-    providerdirs = [p for p in providerdirs if p is not None]
 
-    gamedirs = {}       # list of all valid game directories
-    cleanable = {}      # list of all files to be removed
+def _walked_by(libdir, outer, matcher):
+    """ Return whether the library directory libdir lies within a directory
+        already scanned from the library directory outer, that is whether
+        it is one of the game directories of outer or inside one of their
+        redistributable subdirectories. """
+
+    inner = os.path.normcase(libdir)
+    outer = os.path.normcase(outer)
+    try:
+        if os.path.commonpath([inner, outer]) != outer or inner == outer:
+            return False
+    except ValueError:
+        # paths on different drives
+        return False
+
+    parts = os.path.relpath(inner, outer).split(os.sep)
+    return len(parts) == 1 or matcher.match_dir(parts[1]) is not None
+
+
+def _find_libraries(provider_dirs=None, customdirs=None, providers=None,
+                    rules=None, expand_libraries=True):
+    """ Return a dictionary of every library directory to scan, each
+        physical directory only once and mapped to the name of its provider,
+        along with the number of duplicate libraries skipped. See
+        get_gamedirs for the arguments. """
+
+    #providerdirs is a list of the default directories, given by windows registry
+    #along with the name of each provider, providers not found are left out
+    if provider_dirs is None:
+        providerdirs = libproviders.find_installs(providers)
+    else:
+        providerdirs = list(provider_dirs)
+
     customlist = []     # list to hold any provided custom directories
+    libdirs = []        # (provider, path) of each library given
+    libkeys = set()     # physical library directories already added
+    duplicates = 0      # libraries skipped as already added
 
     if customdirs:
         # split list is provided via cli application as a string
         if type(customdirs) is str:
-            for subdir in customdirs.lower().split(','):
+            for subdir in customdirs.split(','):
                 customlist.append(subdir)
         else:
             for subdir in customdirs:
                 customlist.append(subdir)
 
     inputdir = ''
-    if len(providerdirs) == 0:
-        # For non-Windows OS prompt for directory input if needed
+    if len(providerdirs) == 0 and len(customlist) == 0:
+        # For non-Windows OS prompt for directory input if no directories
+        # were given
         while not os.path.isdir(inputdir) or not os.path.exists(inputdir):
             sclogger.warning('Invalid or missing directory at %s', inputdir)
             inputdir = os.path.abspath(
                 input('Invalid or missing directory, ' +
                       'please re-enter the directory: '))
-            providerdirs.append(inputdir)
+            providerdirs.append((None, inputdir))
 
-    for pdir in providerdirs:
+    for provider, pdir in providerdirs:
         # Validate provider installation path.
-        if os.path.isdir(pdir) and 'Steam' in pdir:
-            for subdir in libsteam.get_libraries(pdir):
-                customlist.append(subdir)
+        if os.path.isdir(pdir) and (provider == 'steam' or 'Steam' in pdir):
+            if expand_libraries:
+                for subdir in libsteam.get_libraries(pdir):
+                    customlist.append(subdir)
             pdir = libsteam.fix_game_path(pdir)
             sclogger.info('Game installations located at %s', pdir)
 
-        # Gather game directories from default path.
-        sclogger.info('Checking %s', pdir)
-        print('Checking %s' % (pdir))
-
-        # ensure the path provided exists and is a valid directory
-        try:
-            if os.path.exists(pdir) and os.path.isdir(pdir):
-                for subdir in os.listdir(pdir):
-                    # if path is a directory and not already in list add it
-                    if os.path.isdir(os.path.join(pdir, subdir)):
-                        if subdir not in gamedirs:
-                            # add new key matching game directories found
-                            gamedirs[os.path.join(pdir, subdir)] = ''
         # print directory to log if it is not found or invalid
-        except FileNotFoundError:
+        if not os.path.isdir(pdir):
             sclogger.error('Directory %s is missing or invalid, skipping',
                            pdir)
             print('Directory %s is missing or invalid, skipping' % (pdir))
-        except:
-            sclogger.exception('Unknown exception raised')
+            continue
+        libdirs.append((provider, pdir))
 
-    else:
-        sclogger.info('No additional directories will be scanned.')
-
-    if len(customlist) > 0:
-        # Check all provided libraries.
-        for subdir in customlist:
-            # correct path issues and validate path
-            subdir = libsteam.fix_game_path(subdir)
-            # Verify customdir path exists and is a directory
-            if not os.path.exists(subdir) or not os.path.isdir(subdir):
-                sclogger.warning('Ignoring invalid directory at %s', subdir)
-                continue
+    for subdir in customlist:
+        # correct path issues and validate path
+        subdir = libsteam.fix_game_path(subdir)
+        # Verify customdir path exists and is a directory
+        if not os.path.isdir(subdir):
+            sclogger.warning('Ignoring invalid directory at %s', subdir)
+            continue
+        libdirs.append(('steam', subdir))
+
+    # identify each library physically so the same one given twice, such
+    # as the Steam directory which also lists itself as a library, is only
+    # kept once, the path first given is kept so absolute exclusions
+    # written through a symlink or junction still match
+    resolved = []       # (provider, path, resolved path) of each library
+    for provider, libdir in libdirs:
+        try:
+            key = _dirkey(libdir)
+        except OSError:
+            sclogger.warning('Ignoring invalid directory at %s', libdir)
+            continue
+        if key in libkeys:
+            duplicates += 1
+            sclogger.info('Directory %s already added, skipping', libdir)
+            continue
+        libkeys.add(key)
+        resolved.append((provider, libdir, os.path.realpath(libdir)))
 
-            sclogger.info('Checking additional directory at %s', subdir)
-            print('Checking additional directory at %s' % (subdir))
-
-            # build list of all valid game directories in each customdir
-            if os.path.exists(subdir) and os.path.isdir(subdir):
-                for dir in os.listdir(subdir):
-                    libsubdir = os.path.join(subdir, dir)
-                    if os.path.exists(libsubdir) and os.path.isdir(libsubdir):
-                        if libsubdir not in gamedirs:
-                            # add key for each located directory
-                            gamedirs[libsubdir] = ''
-
-    # build list of redist files from subdirectories when applicable
-    redistfiles = []
-    # check each subdirectory for matching values to determine valid files
-    for gamedir in gamedirs:
-        for subdir in os.listdir(gamedir):
-            sdpath = os.path.abspath(os.path.join(gamedir, subdir))
-            # regex for common redist subdirectory names
-            dirregex = re.compile(r'(.*)(directx|redist|miles)(.*)',
-                                  re.IGNORECASE)
-            if dirregex.match(sdpath):
-                # build list of all subdirectories and files from
-                # root (game subdirectory) that are valid for removal
-                for (root, dirs, files) in os.walk(sdpath):
-                    for file in files:
-                        # build path to each found file and verify
-                        # extension is a valid installation file
-                        filepath = os.path.join(root, file)
-                        extregex = re.compile(r'(cab|exe|msi)',
-                                              re.IGNORECASE)
-                        if extregex.search(filepath):
-                            if os.path.exists(filepath) and \
-                               os.path.isfile(filepath):
-                                redistfiles.append(filepath)
-
-    # Add filename and size to cleanable list.
-    for rfile in redistfiles:
-        cleanable[rfile] = ((os.path.getsize(rfile) / 1024) / 1024)
-
-    # Check all game directories for valid .vdf files and check for additional
-    # files for removal.
-    cleanable.update(libsteam.check_vdf(gamedirs))
-
-    # log all detected files and their size
-    for file in cleanable:
-        sclogger.info('File %s found with size %s MB',
-                      file, format(cleanable[file], '.2f'))
-
-    # Return the list of cleanable files and their approximate size.
-    return cleanable
+    # rules are only needed to collapse nested libraries
+    matchers = {provider: librules.get_matcher(provider, rules)
+                for provider in {provider for provider, _, _ in resolved}}
 
+    libraries = {}
+    for provider, libdir, real in resolved:
+        # nesting is decided on the resolved paths
+        outer = next((o for p, o, r in resolved
+                      if _walked_by(real, r, matchers[p])), None)
+        if outer is not None:
+            duplicates += 1
+            sclogger.info('Directory %s is already scanned within %s, '
+                          'skipping', libdir, outer)
+            continue
+        libraries[libdir] = provider
 
-def get_excludes():
-    """ Read lines from excludes.txt to build a list of files to ignore. """
+    return libraries, duplicates
 
-    if os.path.exists('excludes.txt'):
-        excludes = []       # list of data to exclude from excludes.txt
-        excluderegex = ''   # pattern to use for regex matching
 
-        # use StreamReader to automatically create excludes list
-        with open('excludes.txt', 'r') as excludesfile:
-            excludes = StreamReader.readlines(excludesfile)
+def get_libdirs(customdirs=None, providers=None):
+    """ Return a dictionary of every library directory, mapped to the name
+        of its provider, whether or not it holds any games yet. Libraries
+        are found and resolved as by get_gamedirs. """
 
-        if excludes:
-            # if items are excluded for the regex pattern with
-            # case insensitive matches for all items
-            return re.compile('|'.join(excludes), re.IGNORECASE)
-    else:
-        return None
+    libraries, duplicates = _find_libraries(None, customdirs, providers)
+    if duplicates:
+        sclogger.info('%s duplicate directories skipped', duplicates)
+    return libraries
+
+
+def get_gamedirs(provider_dirs=None, customdirs=None, providers=None,
+                 rules=None, expand_libraries=True):
+    """ Build the dictionary of all game directories within the provider and
+        custom library directories, mapped to the name of the provider they
+        belong to. Custom directories are treated as Steam libraries.
+        provider_dirs is a list of (provider, path) pairs of installations,
+        when None the installations of the named providers, or all if None,
+        are looked up in the registry. The libraries configured within each
+        Steam installation are added unless expand_libraries is False, as
+        when the caller already lists every library to scan.
+
+        Library and game directories are identified by their physical
+        directory, so one reached through a symlink, a bind mount or a
+        differently cased path is only scanned once, under the path first
+        given for it, as is a library
+        nested within a directory another library already scans with the
+        rules file at rules. The number of duplicates skipped is
+        reported. """
+
+    libraries, duplicates = _find_libraries(provider_dirs, customdirs,
+                                            providers, rules,
+                                            expand_libraries)
+
+    gamedirs = {}       # list of all valid game directories
+    gamekeys = set()    # physical game directories already added
+
+    for libdir, provider in libraries.items():
+        # Gather game directories from each library.
+        sclogger.info('Checking %s', libdir)
+        print('Checking %s' % (libdir))
+
+        try:
+            for subdir in libscan.list_gamedirs(libdir):
+                try:
+                    key = _dirkey(subdir)
+                except OSError:
+                    continue
+                # a game linked into several libraries is only added once
+                if key in gamekeys:
+                    duplicates += 1
+                    sclogger.info('Directory %s already added, skipping',
+                                  subdir)
+                    continue
+                gamekeys.add(key)
+                gamedirs[subdir] = provider
+        except OSError:
+            sclogger.error('Directory %s is missing or invalid, skipping',
+                           libdir)
+            print('Directory %s is missing or invalid, skipping' % (libdir))
+
+    if duplicates:
+        sclogger.info('%s duplicate directories skipped', duplicates)
+        print('%s duplicate directories skipped' % (duplicates))
+
+    return gamedirs
+
+
+def scan_game(gamedir, index=None, appid=None, targeted=False,
+              matcher=None, excludes=None, provider=None):
+    """ Scan a single game directory for redistributable subdirectories and
+        installation script entries using the rules of a RuleMatcher,
+        returning a list of Candidate records attributed to provider. Files
+        named by both are only reported once and nothing matching the
+        ExcludeSet is visited.
+
+        In targeted mode games with an app manifest, given by appid, and an
+        installation script only have the paths named in the script checked
+        while all other games are walked as usual. """
+
+    if excludes and excludes.excluded(gamedir):
+        sclogger.info('Directory %s excluded, skipping...', gamedir)
+        return []
+
+    # Check the game directory for a valid .vdf file and check for
+    # additional files for removal.
+    vpath, vdffiles = libsteam.read_vdf(gamedir, matcher)
+
+    if targeted and appid is not None and vpath:
+        return [c._replace(provider=provider)
+                for c in libscan.scan_targets(gamedir, vdffiles, appid,
+                                              matcher, excludes)]
+
+    # Walk the redist subdirectories once, filtering files and recording
+    # their size in the same pass.
+    candidates = [c._replace(appid=appid, provider=provider)
+                  for c in libscan.scan_gamedir(gamedir, index, matcher,
+                                                excludes)]
+    seen = {os.path.normcase(c.path) for c in candidates}
+
+    for vfile, (vsize, rule) in vdffiles.items():
+        if excludes and excludes.excluded(vfile):
+            continue
+        if os.path.normcase(vfile) not in seen:
+            candidates.append(libscan.Candidate(vfile, vsize, gamedir, rule,
+                                                appid, provider))
+
+    return candidates
+
+
+def iter_redist(provider_dirs=None, customdirs=None, jobs=1, index=None,
+                progress=None, cancel=None, targeted=False, rules=None,
+                providers=None, expand_libraries=True):
+    """ Scan all directories for removable data and yield a Candidate record
+        for each file as soon as its game directory has been scanned. When
+        jobs is greater than one game directories are scanned in parallel
+        with concurrency capped per physical device, results are still
+        yielded in the same order as the serial scan. If a ScanIndex is
+        provided only game directories changed since the previous scan are
+        walked.
+
+        progress is called with the number of game directories scanned and
+        the total after each one, and the scan stops early once the cancel
+        event is set. In targeted mode Steam app manifests and installation
+        scripts decide which paths are checked, see scan_game. Files are
+        matched with the rules file at rules, or the shipped rules if None,
+        with the overrides for the provider of each game applied. Anything
+        listed in excludes.txt is skipped during the scan. providers names
+        the providers looked up in the registry and expand_libraries
+        whether Steam libraries are added, see get_gamedirs.
+
+        When statistics are being recorded with libstats the time spent in
+        each phase of the scan is added to them along with the files and
+        bytes matched in each library. """
 
+    started = time.perf_counter()
+    gamedirs = get_gamedirs(provider_dirs, customdirs, providers, rules,
+                            expand_libraries)
 
-def clean_data(filelist, confirm=''):
+    # rules are compiled once for each provider found
+    matchers = {provider: librules.get_matcher(provider, rules)
+                for provider in set(gamedirs.values())}
+    excludes = get_excludes()
+
+    if index is not None:
+        # results stored under different rules or exclusions can no longer
+        # be trusted
+        index.validate(sorted(m.signature for m in matchers.values()) +
+                       [excludes.signature if excludes else None])
+        index.prune_missing()
+
+    # map each game directory to its appid using the library app manifests
+    appids = {}
+    for libdir in {os.path.dirname(gamedir) for gamedir in gamedirs}:
+        appids.update(libsteam.read_manifests(libdir))
+
+    def scan(gamedir):
+        return scan_game(gamedir, index,
+                         appids.get(os.path.normcase(gamedir)), targeted,
+                         matchers[gamedirs[gamedir]], excludes,
+                         gamedirs[gamedir])
+
+    results = libscan.map_by_device(scan, gamedirs, jobs)
+    for done, candidates in enumerate(results, 1):
+        if candidates and libstats.enabled():
+            library = os.path.dirname(candidates[0].game)
+            libstats.count('files', len(candidates), library)
+            libstats.count('bytes', sum(c.size for c in candidates), library)
+
+        logtime = time.perf_counter()
+        if liblog.per_file():
+            for candidate in candidates:
+                # log each detected file and its size as it is found
+                sclogger.info('File %s found with size %s MB',
+                              candidate.path,
+                              format((candidate.size / 1024) / 1024, '.2f'),
+                              extra={'detail': {
+                                  'op': 'found', 'path': candidate.path,
+                                  'size': candidate.size,
+                                  'game': candidate.game,
+                                  'rule': candidate.rule,
+                                  'appid': candidate.appid}})
+        if liblog.aggregated() and candidates:
+            sclogger.info('Game %s: %s file(s) found with size %s MB',
+                          candidates[0].game, len(candidates),
+                          format((sum(c.size for c in candidates) / 1024) /
+                                 1024, '.2f'))
+        libstats.add('logging', time.perf_counter() - logtime)
+
+        for candidate in candidates:
+            yield candidate
+
+        if progress is not None:
+            progress(done, len(gamedirs))
+        if cancel is not None and cancel.is_set():
+            sclogger.warning('Scan cancelled after %s of %s directories',
+                             done, len(gamedirs))
+            # stop any pending parallel work before returning
+            results.close()
+            break
+
+    if index is not None:
+        sclogger.info('%s game directories unchanged since last scan, '
+                      '%s walked', index.hits, index.misses)
+
+    libstats.add('scan', time.perf_counter() - started)
+
+
+def find_redist(provider_dirs=None, customdirs=None, jobs=1, index=None,
+                rules=None, providers=None):
+    """ Create list and scan all directories for removable data. Returns a
+        ScanResult of every file found with its exact size and game, see
+        iter_redist for the available options. """
+
+    return libresult.ScanResult(iter_redist(provider_dirs, customdirs, jobs,
+                                            index, rules=rules,
+                                            providers=providers))
+
+
+def write_candidates(candidates, fmt, outfile):
+    """ Write each Candidate record to outfile as soon as it is received
+        and pass it on. fmt is one of OUTPUTFORMATS: ndjson writes one JSON
+        object per line, csv a header and one row per file and json a
+        single array written one element at a time, so no format holds the
+        results in memory. Output is flushed after each game so results
+        can be read while the scan continues. """
+
+    fields = libscan.Candidate._fields
+    if fmt == 'csv':
+        writer = csv.writer(outfile, lineterminator='\n')
+        writer.writerow(fields)
+    elif fmt == 'json':
+        outfile.write('[')
+
+    game = None
+    separator = '\n'
+    try:
+        for candidate in candidates:
+            if candidate.game != game:
+                outfile.flush()
+                game = candidate.game
+
+            if fmt == 'csv':
+                writer.writerow(candidate)
+            elif fmt == 'json':
+                outfile.write(separator + json.dumps(candidate._asdict()))
+                separator = ',\n'
+            else:
+                outfile.write(json.dumps(candidate._asdict()) + '\n')
+
+            yield candidate
+    finally:
+        # the array is closed even if the scan stops early
+        if fmt == 'json':
+            outfile.write('\n]\n')
+        outfile.flush()
+
+
+def print_candidates(candidates):
+    """ Print each Candidate record as it is received and pass it on. """
+
+    for candidate in candidates:
+        appid = ' [%s]' % candidate.appid if candidate.appid else ''
+        print('%s (%s MB)%s' % (candidate.path,
+                                format((candidate.size / 1024) / 1024, '.2f'),
+                                appid))
+        yield candidate
+
+
+def get_excludes():
+    """ Read lines from excludes.txt to build the set of paths to ignore.
+        Returns a compiled ExcludeSet, or None if nothing is excluded. """
+
+    return libexclude.load_excludes()
+
+
+def clean_data(filelist, confirm='', index=None, progress=None,
+               cancel=None, jobs=1, journal=None, rules=None, result=None,
+               quarantine=False):
     """ Function to remove found data from installed game directories.
         Will prompt user for a list of files to exclude with the proper
-        options otherwise all will be deleted."""
+        options otherwise all will be deleted. Removed files are dropped
+        from the ScanIndex when one is provided.
 
-    filecount, totalsize = print_stats(filelist)
+        filelist is a ScanResult, such as that from find_redist, or a
+        dictionary of paths and their size in MB. It may also be a stream
+        of Candidate records, such as those from iter_redist, in which case
+        confirmation is requested up front and each batch of files is
+        removed as soon as it is received.
 
-    excludes = get_excludes()   # compiled regex pattern
+        Files are removed in batches over jobs worker threads and every
+        action is appended to the journal file when a path is given so an
+        interrupted run can be audited or resumed with resume_data. Empty
+        redist directories, as given by the rules file at rules or the
+        shipped rules, are pruned afterwards within each game directory,
+        which is not known for a dictionary. progress is called with
+        the number of files handled and the total, or None when streaming,
+        after each batch and removal stops early once the cancel event is
+        set. Returns the number of files and MB removed, or the number
+        found and their estimated size if nothing was removed. When a
+        dictionary is given as result it is updated with the full outcome
+        from libclean.remove_files, including the number of failures.
+
+        When quarantine is set files are moved into a quarantine on their
+        own drive instead of being deleted, see libquarantine, so they can
+        be brought back with restore_data until purged with purge_data."""
+
+    # a complete result is reported before removal while a stream of
+    # Candidate records is counted as it is consumed
+    streaming = not isinstance(filelist, (libresult.ScanResult, dict))
+    if streaming:
+        filecount, totalsize = 0, 0
+    else:
+        filecount, totalsize = print_stats(filelist)
+
+    excludes = get_excludes()   # compiled exclusions
 
     # check if confirm is empty to determine if running from gui or cli
     # only prompt if running from cli, cannot respond when running from gui
     if confirm == '':
         # Print a warning that files will be permanently deleted and
         # inform user they can exclude files with the -p option.
-        print('\nWARNING: All files will be permanently deleted!\n'
-              'Please see the log file for specific file information.\n')
+        if quarantine:
+            print('\nAll files will be moved to a quarantine on their drive.\n'
+                  'Please see the log file for specific file information.\n')
+        else:
+            print('\nWARNING: All files will be permanently deleted!\n'
+                  'Please see the log file for specific file information.\n')
         while True:
             confirm = input('Do you wish to remove extra files [y/N]: ')
             confirm.lower()
@@ -245,52 +573,489 @@ def clean_data(filelist, confirm=''):
     # Confirm removal of all found files. Print list of files not removed and
     # count of removed items.
     if confirm == 'y':
-        removed = 0
         excluded = 0
+        games = set()   # game directories to prune within
+        checked = {}    # directories still as the index recorded them
+        jfile = libclean.Journal(journal) if journal else None
+
+        def add_game(game):
+            # the journal records each game so a resumed run can prune too
+            games.add(game)
+            if jfile is not None:
+                jfile.write('game', game)
 
-        for index, file in enumerate(filelist):
-            try:
-                if os.path.isfile(file) and os.path.exists(file):
-                    if excludes and excludes.search(file):
-                        # skip removal for excluded files
-                        excluded += 1
-                        sclogger.info('%s excluded, skipping...', file)
-                    else:
-                        # only remove files which are not excluded
-                        os.remove(file)
-                        removed += 1
-                        sclogger.info('File %s removed successfully', file)
-
-            except FileNotFoundError:
-                sclogger.error('File %s not found, skipping...', file)
-                print('File %s not found, skipping.' % (file))
-
-            except PermissionError:
-                sclogger.error('Permission denied to file %s skipping...',
-                               file)
-                print('Permission denied to file %s skipping...' % (file))
-            except:
-                sclogger.exception('Unknown exception raised')
-
-        sclogger.info('%s file(s) removed successfully', removed)
-        sclogger.info('%s file(s) excluded and not removed', excluded)
-        sclogger.info('%s MB saved', format(totalsize, '.2f'))
-        print('\n%s file(s) removed successfully' % (removed))
-        print('%s file(s) excluded and not removed' % (excluded))
-        print('%s MB saved' % (format(totalsize, '.2f')))
+        def included():
+            """ Yield each file to be removed, skipping excluded files. """
+
+            nonlocal excluded, filecount, totalsize
+            files = filelist
+            if isinstance(filelist, libresult.ScanResult):
+                files = filelist.paths()
+                for game in filelist.games():
+                    add_game(game.game)
+            for file in files:
+                if streaming:
+                    filecount += 1
+                    totalsize += (file.size / 1024) / 1024
+                    if file.game not in games:
+                        add_game(file.game)
+                    file = file.path
+
+                if excludes and excludes.excluded(file):
+                    # skip removal for excluded files
+                    excluded += 1
+                    if liblog.per_file():
+                        sclogger.info('%s excluded, skipping...', file,
+                                      extra={'detail': {'op': 'excluded',
+                                                        'path': file}})
+                else:
+                    if index is not None:
+                        index.check(file, checked)
+                    yield file
+
+        remove = libquarantine.quarantine_files if quarantine \
+            else libclean.remove_files
+        try:
+            # a full list lets the journal record the plan before removal
+            paths = included() if streaming else list(included())
+            with libstats.phase('clean'):
+                removal = remove(
+                    paths, jobs, jfile, progress=progress, cancel=cancel,
+                    matcher=librules.get_matcher(None, rules),
+                    keep=index is not None, games=games)
+        finally:
+            if jfile is not None:
+                jfile.close()
+
+        if index is not None:
+            index.forget(removal['files'], checked)
+        if result is not None:
+            result.update(removal)
+
+        report_removal(removal, excluded, quarantine)
+        return removal['removed'], (removal['bytes'] / 1024) / 1024
 
     return filecount, totalsize
 
 
+def resume_data(journal, jobs=1, index=None, rules=None, result=None,
+                confirm=''):
+    """ Remove the files planned in an interrupted run's journal which were
+        not removed, appending the outcome to the same journal, after
+        confirmation when running from the cli. Files planned for
+        quarantine are moved into quarantine again rather than removed.
+        result is updated with the outcome as for clean_data. """
+
+    pending = libclean.read_journal(journal)
+    total = len(pending.paths) + len(pending.quarantine)
+    sclogger.info('%s file(s) left to remove and %s to quarantine in %s',
+                  len(pending.paths), len(pending.quarantine), journal)
+    print('\n%s file(s) left to remove and %s to quarantine in %s' %
+          (len(pending.paths), len(pending.quarantine), journal))
+    if total == 0:
+        return 0, 0
+
+    if confirm == '':
+        while True:
+            confirm = input('Do you wish to finish the interrupted run '
+                            '[y/N]: ').lower()
+            if confirm in ('', 'y', 'n'):
+                break
+
+    if confirm != 'y':
+        return 0, 0
+
+    sclogger.info('Resuming removal of %s file(s) from %s', total, journal)
+
+    matcher = librules.get_matcher(None, rules)
+    games = set(pending.games)
+    removals = []
+    jfile = libclean.Journal(journal)
+    try:
+        # files are already planned so they are not recorded again
+        if pending.paths or not pending.quarantine:
+            removals.append((libclean.remove_files(
+                pending.paths, jobs, jfile, plan=False, matcher=matcher,
+                keep=index is not None, games=games), False))
+        if pending.quarantine:
+            removals.append((libquarantine.quarantine_files(
+                pending.quarantine, jobs, jfile, plan=False, matcher=matcher,
+                keep=index is not None, games=games), True))
+    finally:
+        jfile.close()
+
+    removed, freed = 0, 0
+    for removal, quarantined in removals:
+        if index is not None:
+            index.forget(removal['files'])
+        if result is not None:
+            # counts of a removal and a quarantine are added together
+            for key, value in removal.items():
+                result[key] = result[key] + value if key in result else value
+        report_removal(removal, quarantined=quarantined)
+        removed += removal['removed']
+        freed += removal['bytes']
+
+    return removed, (freed / 1024) / 1024
+
+
+def restore_data(game=None, customdirs=None, providers=None, result=None):
+    """ Move the files quarantined on the drives holding every library back
+        to where they were found, or only those of game, a game directory
+        or its name. result is updated with the number of failures as for
+        clean_data. Returns the number of files and MB restored. """
+
+    restored = libquarantine.restore_files(get_libdirs(customdirs, providers),
+                                           game)
+    if result is not None:
+        result.update(restored)
+
+    restoredsize = format((restored['bytes'] / 1024) / 1024, '.2f')
+    sclogger.info('%s file(s) restored from quarantine', restored['restored'])
+    sclogger.info('%s file(s) could not be restored', restored['failed'])
+    sclogger.info('%s MB restored', restoredsize)
+    print('\n%s file(s) restored from quarantine' % (restored['restored']))
+    print('%s file(s) could not be restored' % (restored['failed']))
+    print('%s MB restored' % (restoredsize))
+
+    return restored['restored'], (restored['bytes'] / 1024) / 1024
+
+
+def purge_data(days=None, game=None, customdirs=None, providers=None,
+               confirm='', jobs=1, result=None):
+    """ Permanently remove the files quarantined on the drives holding
+        every library, only those held for more than days days or of game
+        if given, after confirmation when running from the cli. result is
+        updated as for clean_data. Returns the number of files and MB
+        removed. """
+
+    libdirs = get_libdirs(customdirs, providers)
+    older = days * 86400 if days else None
+
+    count, size = libquarantine.held(libdirs, game)
+    sclogger.info('%s file(s) of %s MB held in quarantine', count,
+                  format((size / 1024) / 1024, '.2f'))
+    print('\n%s file(s) of %s MB held in quarantine' %
+          (count, format((size / 1024) / 1024, '.2f')))
+    if count == 0:
+        return 0, 0
+
+    if confirm == '':
+        while True:
+            confirm = input('Do you wish to permanently remove quarantined '
+                            'files [y/N]: ').lower()
+            if confirm in ('', 'y', 'n'):
+                break
+
+    if confirm != 'y':
+        return 0, 0
+
+    purged = libquarantine.purge_files(libdirs, game, older, jobs=jobs)
+    if result is not None:
+        result.update(purged)
+
+    report_removal(purged)
+    return purged['removed'], (purged['bytes'] / 1024) / 1024
+
+
+def dedup_data(candidates, link=False, confirm='', jobs=1, journal=None,
+               result=None):
+    """ Report the sets of identical files among the Candidate records
+        found and the space used by all but one copy of each on every
+        device, as only those can be linked. When link is set the extra
+        copies are replaced with hardlinks to a single copy, after
+        confirmation when running from the cli, instead of being removed so
+        game verification still finds every file. Excluded files are never
+        replaced. result is updated with the number of failures as for
+        clean_data. Returns the number of duplicate files and the
+        reclaimable, or reclaimed, MB. """
+
+    excludes = get_excludes()
+    files = {c.path: c.size for c in candidates
+             if not (excludes and excludes.excluded(c.path))}
+
+    duplicates = libdedup.find_duplicates(files, jobs)
+    dupcount = sum(len(d.paths) - 1 for d in duplicates)
+    reclaimable = (sum(d.reclaimable for d in duplicates) / 1024) / 1024
+
+    for duplicate in duplicates:
+        sclogger.info('%s identical files of %s bytes: %s',
+                      len(duplicate.paths), duplicate.size,
+                      ', '.join(duplicate.paths))
+        print('\n%s identical files of %s MB' %
+              (len(duplicate.paths),
+               format((duplicate.size / 1024) / 1024, '.2f')))
+        for path in duplicate.paths:
+            print('  %s' % (path))
+
+    sclogger.info('Duplicate files found: %s in %s set(s)', dupcount,
+                  len(duplicates))
+    sclogger.info('Disk space reclaimable by hardlinks: %s MB',
+                  format(reclaimable, '.2f'))
+    print('\nDuplicate files found: %s in %s set(s)' %
+          (dupcount, len(duplicates)))
+    print('Disk space reclaimable by hardlinks: %s MB' %
+          format(reclaimable, '.2f'))
+
+    if not link or not duplicates:
+        return dupcount, reclaimable
+
+    if confirm == '':
+        while True:
+            confirm = input('Do you wish to replace duplicate files with '
+                            'hardlinks [y/N]: ').lower()
+            if confirm in ('', 'y', 'n'):
+                break
+
+    if confirm != 'y':
+        return dupcount, reclaimable
+
+    jfile = libclean.Journal(journal) if journal else None
+    try:
+        linked, reclaimed, failed = libdedup.link_duplicates(duplicates,
+                                                             jfile)
+    finally:
+        if jfile is not None:
+            jfile.close()
+    if result is not None:
+        result['failed'] = result.get('failed', 0) + failed
+
+    savedsize = format((reclaimed / 1024) / 1024, '.2f')
+    sclogger.info('%s file(s) replaced by hardlinks', linked)
+    sclogger.info('%s file(s) could not be replaced', failed)
+    sclogger.info('%s MB saved', savedsize)
+    print('\n%s file(s) replaced by hardlinks' % (linked))
+    print('%s file(s) could not be replaced' % (failed))
+    print('%s MB saved' % (savedsize))
+
+    return linked, (reclaimed / 1024) / 1024
+
+
+def watch_data(customdirs=None, providers=None, delay=None, jobs=1,
+               journal=None, rules=None, cancel=None, confirm='',
+               result=None):
+    """ Scan every library once and then keep the set of cleanable files
+        current with inotify until interrupted or the cancel event is set,
+        printing the number of files and their size as they change. When
+        delay is given new files are removed once they have not been
+        written to for delay seconds, after confirmation when running from
+        the cli, otherwise they are only reported. result is updated with
+        the number of failures as for clean_data. Only available on Linux.
+        Returns the number of files and MB removed. """
+
+    if not libwatch.available():
+        sclogger.error('Watching libraries requires Linux inotify')
+        print('Watching libraries requires Linux inotify')
+        return 0, 0
+
+    if delay is not None and confirm == '':
+        while True:
+            confirm = input('Do you wish to remove new files once unchanged '
+                            'for %s seconds [y/N]: ' % (delay)).lower()
+            if confirm in ('', 'y', 'n'):
+                break
+    if delay is not None and confirm != 'y':
+        sclogger.info('New files will only be reported')
+        print('New files will only be reported')
+        delay = None
+
+    # every library is watched, including those without any games yet
+    libraries = get_libdirs(customdirs, providers)
+
+    jfile = libclean.Journal(journal) if journal and delay is not None \
+        else None
+    watcher = libwatch.Watcher(libraries, rules, get_excludes(), delay,
+                               jfile, jobs)
+
+    def changed(count, total):
+        print('Cleanable: %s file(s) (%s MB)' %
+              (count, format((total / 1024) / 1024, '.2f')))
+
+    try:
+        watcher.seed()
+        changed(*watcher.status())
+        print('Watching %s libraries, press Ctrl+C to stop' %
+              (len(libraries)))
+        watcher.run(cancel, changed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if jfile is not None:
+            jfile.close()
+
+    if result is not None:
+        result['failed'] = result.get('failed', 0) + watcher.failed
+
+    sclogger.info('Watch stopped, %s file(s) removed, %s could not be '
+                  'removed, %s bytes freed', watcher.removed, watcher.failed,
+                  watcher.freed)
+    print('\nWatch stopped, %s file(s) removed' % (watcher.removed))
+    if watcher.failed:
+        print('%s file(s) could not be removed' % (watcher.failed))
+    return watcher.removed, (watcher.freed / 1024) / 1024
+
+
+def budget_data(target, customdirs=None, providers=None, workshop=False,
+                confirm='', jobs=1, journal=None, result=None):
+    """ Remove Steam shader caches, leftover downloads and temporary
+        files, and workshop content if workshop is set, until target bytes
+        are free on every drive holding a Steam library, see
+        libsteam.clean_caches. Files held in quarantine on those drives are
+        purged, oldest first, if that is not enough. Confirmation is
+        requested first when running from the cli. result is updated with
+        the number of failures as for clean_data and whether the target was
+        met. Returns the number of files and MB removed, or that would be
+        removed if not confirmed. """
+
+    # caches are kept within the steamapps directory of each library
+    libdirs = [libdir for libdir, provider in
+               get_libdirs(customdirs, providers).items()
+               if provider in ('steam', None)]
+
+    targetsize = format((target / 1024) / 1024, '.2f')
+
+    def short(removal):
+        # drives without any cache directory are not checked by
+        # clean_caches, their free space is read directly
+        checked = {os.stat(path).st_dev for path in removal['devices']}
+        return not removal['met'] or any(
+            libsteam.free_space(libdir) < target for libdir in libdirs
+            if os.stat(libdir).st_dev not in checked)
+
+    # the caches are only walked an extra time to show what would be removed
+    if confirm != 'y':
+        plan = libsteam.clean_caches(libdirs, target, workshop, jobs=jobs,
+                                     dryrun=True)
+        plansize = format((plan['bytes'] / 1024) / 1024, '.2f')
+        sclogger.info('%s cache file(s) of %s MB to remove for %s MB free',
+                      plan['removed'], plansize, targetsize)
+        print('\n%s cache file(s) of %s MB to remove for %s MB free' %
+              (plan['removed'], plansize, targetsize))
+        heldcount = 0
+        if short(plan):
+            # quarantined files are purged next when caches are not enough
+            heldcount, heldsize = libquarantine.held(libdirs)
+            if heldcount:
+                print('%s quarantined file(s) of %s MB will be purged as '
+                      'needed' % (heldcount,
+                                  format((heldsize / 1024) / 1024, '.2f')))
+            print('Not enough cache files to free %s MB on every drive' %
+                  (targetsize))
+
+        if plan['removed'] == 0 and heldcount == 0:
+            return 0, 0
+
+        if confirm == '':
+            while True:
+                confirm = input('Do you wish to remove cache and '
+                                'quarantined files [y/N]: ').lower()
+                if confirm in ('', 'y', 'n'):
+                    break
+
+        if confirm != 'y':
+            return plan['removed'], (plan['bytes'] / 1024) / 1024
+
+    jfile = libclean.Journal(journal) if journal else None
+    try:
+        removal = libsteam.clean_caches(libdirs, target, workshop, jobs=jobs,
+                                        journal=jfile)
+    finally:
+        if jfile is not None:
+            jfile.close()
+
+    # quarantined files go next, oldest first, on drives still short
+    if short(removal):
+        purged = libquarantine.purge_files(libdirs, target=target, jobs=jobs)
+        sclogger.info('%s quarantined file(s) purged to free space',
+                      purged['removed'])
+        for key in ('removed', 'failed', 'bytes'):
+            removal[key] += purged[key]
+        for path, free in removal['devices'].items():
+            free['after'] = libsteam.free_space(path)
+
+    met = not short(removal)
+    if result is not None:
+        result['failed'] = result.get('failed', 0) + removal['failed']
+        result['met'] = met
+
+    for path, free in removal['devices'].items():
+        sclogger.info('Free space on drive holding %s: %s MB before, %s MB '
+                      'after', path,
+                      format((free['before'] / 1024) / 1024, '.2f'),
+                      format((free['after'] / 1024) / 1024, '.2f'))
+
+    report_removal(removal)
+    if not met:
+        sclogger.warning('Unable to free %s MB on every drive', targetsize)
+        print('Unable to free %s MB on every drive' % (targetsize))
+    return removal['removed'], (removal['bytes'] / 1024) / 1024
+
+
+def parse_size(text):
+    """ Convert a size such as 500M or 20G, in bytes if no unit is given,
+        to a number of bytes. """
+
+    text = text.strip().lower().rstrip('b')
+    unit = text[-1:] if text[-1:] in SIZEUNITS else ''
+    try:
+        return int(float(text[:len(text) - len(unit)]) * SIZEUNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: %r' % (text))
+
+
+def report_removal(result, excluded=0, quarantined=False):
+    """ Log and print the outcome of a removal from libclean, or of moving
+        files into quarantine if quarantined is set. """
+
+    if quarantined:
+        action, saved = 'moved to quarantine', 'quarantined'
+    else:
+        action, saved = 'removed successfully', 'saved'
+
+    savedsize = format((result['bytes'] / 1024) / 1024, '.2f')
+    sclogger.info('%s file(s) %s', result['removed'], action)
+    sclogger.info('%s file(s) could not be removed', result['failed'])
+    sclogger.info('%s file(s) excluded and not removed', excluded)
+    sclogger.info('%s empty directories removed', result['pruned'])
+    sclogger.info('%s MB %s', savedsize, saved)
+    print('\n%s file(s) %s' % (result['removed'], action))
+    print('%s file(s) could not be removed' % (result['failed']))
+    print('%s file(s) excluded and not removed' % (excluded))
+    print('%s empty directories removed' % (result['pruned']))
+    print('%s MB %s' % (savedsize, saved))
+
+
+def print_profile(stats):
+    """ Log and print the summary table of the statistics recorded by
+        libstats. """
+
+    lines = stats.report()
+    for line in lines:
+        sclogger.info(line)
+    print('\n' + '\n'.join(lines))
+
+
 def print_stats(cleanable):
     """ Print a report of removable files and their estimated size.
         For every file that is marked for deletion, record the total size
-        and convert to MB."""
-    
-    filecount = len(cleanable)
-    totalsize = 0
-    for cfile in cleanable:
-        totalsize += float(cleanable[cfile])
+        and convert to MB. cleanable may be a ScanResult, whose totals are
+        already known, a dictionary of paths and their size in MB or a
+        stream of Candidate records which is counted as it is consumed."""
+
+    if isinstance(cleanable, libresult.ScanResult):
+        filecount = len(cleanable)
+        totalsize = (cleanable.total / 1024) / 1024
+    elif isinstance(cleanable, dict):
+        filecount = len(cleanable)
+        totalsize = 0
+        for cfile in cleanable:
+            totalsize += float(cleanable[cfile])
+    else:
+        filecount, totalsize = 0, 0
+        for candidate in cleanable:
+            filecount += 1
+            totalsize += (candidate.size / 1024) / 1024
 
     sclogger.info('Total number of files marked for removal: %s', filecount)
     sclogger.info('Estimated disk space saved after removal: %s MB',
@@ -303,35 +1068,254 @@ def print_stats(cleanable):
     return filecount, totalsize
 
 
+def run(args, outfile=None):
+    """ Scan and clean as requested by the commandline arguments, writing
+        results to outfile in the --output format as they are found when
+        one is given. Returns the exit status. """
+
+    batch = args.yes or args.output is not None
+    providers = None
+    if args.providers is not None:
+        providers = [name for name in args.providers.lower().split(',')
+                     if name in libproviders.PROVIDERS]
+
+    # directories cannot be prompted for when running unattended
+    if batch and not args.dir and not args.resume and \
+            not libproviders.find_installs(providers):
+        sclogger.error('No directories to scan')
+        print('No directories to scan, pass them with --dir')
+        return EXITUSAGE
+
+    # removal is only done unattended when explicitly confirmed
+    confirm = 'y' if args.yes else ('n' if batch else '')
+    result = {}
+
+    stats = None
+    if args.profile or args.stats_json:
+        stats = libstats.enable()
+    profiler = None
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    index = libindex.ScanIndex() if args.index else None
+    candidates = iter_redist(customdirs=args.dir, jobs=args.jobs,
+                             index=index, targeted=args.targeted,
+                             rules=args.rules, providers=providers)
+    if args.list:
+        candidates = print_candidates(candidates)
+    if outfile is not None:
+        candidates = write_candidates(candidates, args.output, outfile)
+
+    try:
+        if args.watch:
+            watch_data(customdirs=args.dir, providers=providers,
+                       delay=args.watch_clean, jobs=args.jobs,
+                       journal=args.journal, rules=args.rules,
+                       confirm='n' if args.dryrun else confirm,
+                       result=result)
+        elif args.free_space is not None:
+            budget_data(args.free_space, customdirs=args.dir,
+                        providers=providers, workshop=args.workshop,
+                        confirm='n' if args.dryrun else confirm,
+                        jobs=args.jobs, journal=args.journal, result=result)
+        elif args.resume:
+            resume_data(args.resume, jobs=args.jobs, index=index,
+                        rules=args.rules, result=result,
+                        confirm='n' if args.dryrun else confirm)
+        elif args.restore is not None:
+            restore_data(args.restore or None, customdirs=args.dir,
+                         providers=providers, result=result)
+        elif args.purge is not None:
+            purge_data(args.purge, customdirs=args.dir, providers=providers,
+                       confirm='n' if args.dryrun else confirm,
+                       jobs=args.jobs, result=result)
+        elif args.dedup or args.hardlink:
+            dedup_data(candidates, link=args.hardlink and not args.dryrun,
+                       confirm=confirm, jobs=args.jobs, journal=args.journal,
+                       result=result)
+        elif args.dryrun or confirm == 'n':
+            # only report, streaming the results in constant memory
+            if print_stats(candidates)[0] == 0:
+                print('\nCongratulations! No files were found for removal. ')
+        elif args.pipeline or batch:
+            clean_data(candidates, confirm=confirm, index=index,
+                       jobs=args.jobs, journal=args.journal,
+                       rules=args.rules, result=result,
+                       quarantine=args.quarantine)
+        else:
+            cleanable = libresult.ScanResult(candidates)
+
+            if len(cleanable) > 0:
+                clean_data(cleanable, index=index, jobs=args.jobs,
+                           journal=args.journal, rules=args.rules,
+                           result=result, quarantine=args.quarantine)
+            else:
+                print('\nCongratulations! No files were found for removal. ')
+    finally:
+        # stop a scan interrupted part way through
+        candidates.close()
+        if index is not None:
+            index.close()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+        sclogger.info('Profile data written to %s', args.cprofile)
+    if stats is not None:
+        libstats.disable()
+        if args.profile:
+            print_profile(stats)
+        if args.stats_json:
+            stats.write_json(args.stats_json)
+
+    if result.get('failed') or result.get('met') is False:
+        return EXITFAILED
+    return EXITOK
+
+
 if __name__ == "__main__":
     """ Use argparse to add description and commandline arguments. """
     parser = argparse.ArgumentParser(
         description='Find and clean extraneous files from game directories '
                     'including various Windows redistributables.')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='Log more detail, repeat for more')
+    parser.add_argument('-q', '--quiet', action='count', default=0,
+                        help='Log less detail, repeat for less')
+    parser.add_argument('--aggregate', action='store_true',
+                        help='Log a summary for each game instead of a '
+                        'line for each file')
+    parser.add_argument('--detail-log', metavar='FILE',
+                        help='Write every file found, excluded, removed or '
+                        'failed to FILE as gzip compressed NDJSON')
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help='Remove files without asking for confirmation '
+                        'or waiting for input')
+    parser.add_argument('--output', choices=OUTPUTFORMATS,
+                        help='Write every file to stdout, or --output-file, '
+                        'as it is found without waiting for input, files '
+                        'are only removed with --yes')
+    parser.add_argument('--output-file', metavar='FILE',
+                        help='File to write --output results to instead of '
+                        'stdout')
     parser.add_argument('--dryrun',
                         help='Run script without allowing any file removal',
                         action='store_true')
     parser.add_argument('-d', '--dir',
                         help='Additional directories to scan '
                         '(comma separated)')
+    parser.add_argument('--providers', metavar='NAMES',
+                        help='Providers whose installations are looked up '
+                        'in the registry (comma separated, default %s), '
+                        'none to only scan --dir' %
+                        ','.join(libproviders.PROVIDERS))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of directories to scan and batches of '
+                        'files to remove in parallel, scans are shared '
+                        'between physical drives (default 1)')
+    parser.add_argument('--index', action='store_true',
+                        help='Keep a scan index in %s so unchanged game '
+                        'directories are skipped on later runs' %
+                        libindex.INDEXFILE)
+    parser.add_argument('--list', action='store_true',
+                        help='Print each file as soon as it is found')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Confirm removal before scanning and remove '
+                        'each file as soon as it is found')
+    parser.add_argument('--targeted', action='store_true',
+                        help='Only check the paths named by Steam app '
+                        'manifests and installation scripts where present')
+    parser.add_argument('--rules',
+                        help='Rules file deciding which directories and files '
+                        'are redistributables (default %s)' %
+                        os.path.basename(librules.RULESFILE))
+    parser.add_argument('--journal',
+                        default='steamclean_' + timenow + '.journal',
+                        help='File recording every planned, removed and '
+                        'failed file (default steamclean_<time>.journal)')
+    parser.add_argument('--resume', metavar='JOURNAL',
+                        help='Finish removing, or quarantining, the files '
+                        'planned in the journal of an interrupted run '
+                        'without scanning')
+    parser.add_argument('--quarantine', action='store_true',
+                        help='Move files to a quarantine on their own drive '
+                        'instead of removing them, see --restore and '
+                        '--purge')
+    parser.add_argument('--restore', nargs='?', const='', metavar='GAME',
+                        help='Move quarantined files back to where they '
+                        'were found, only those of GAME, a game directory '
+                        'or its name, if given')
+    parser.add_argument('--purge', nargs='?', type=float, const=0,
+                        metavar='DAYS',
+                        help='Permanently remove quarantined files, only '
+                        'those held for more than DAYS days if given')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time spent in each phase and file '
+                        'system counters for every library')
+    parser.add_argument('--stats-json', metavar='FILE',
+                        help='Write the statistics shown by --profile to '
+                        'FILE as JSON')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='Write cProfile data for the scan and removal '
+                        'to FILE, worker threads are only included with '
+                        '-j 1')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep watching the libraries after the scan and '
+                        'report cleanable files as they change (Linux '
+                        'only)')
+    parser.add_argument('--watch-clean', type=float, metavar='SECONDS',
+                        help='With --watch, remove new files once they have '
+                        'not changed for SECONDS, after confirmation or '
+                        'with --yes')
+    parser.add_argument('--free-space', type=parse_size, metavar='SIZE',
+                        help='Remove Steam shader caches, leftover downloads '
+                        'and temporary files, then quarantined files, until '
+                        'SIZE is free on each library drive, such as 20G')
+    parser.add_argument('--workshop', action='store_true',
+                        help='With --free-space, also remove downloaded '
+                        'workshop content')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Report identical files and the space used by '
+                        'the extra copies instead of removing files')
+    parser.add_argument('--hardlink', action='store_true',
+                        help='Replace identical files with hardlinks to a '
+                        'single copy instead of removing files')
     args = parser.parse_args()
 
-    print_header()
-
-    #only Windows is supported at the moment
-    #list of cleanable files is found from custom directories, which are taken
-    #from the arguments
-    if os.name == 'nt':
-        cleanable = find_redist(customdirs=args.dir)
-        
-        if len(cleanable) > 0:
-            if args.dryrun:
-                print_stats(cleanable)
-            else:
-                clean_data(cleanable)
-        else:
-            print('\nCongratulations! No files were found for removal. ')
-    else:
-        print('Invalid operating system detected, or not currently supported')
+    # each -v or -q moves the log level one step from INFO
+    level = logging.INFO + 10 * (args.quiet - args.verbose)
+    setup_logging(level=min(max(level, logging.DEBUG), logging.CRITICAL),
+                  aggregate=args.aggregate, detail=args.detail_log)
+
+    # batch runs never wait for input
+    batch = args.yes or args.output is not None
+    outfile = None
+    if args.output is not None:
+        outfile = sys.stdout
+        if args.output_file:
+            outfile = open(args.output_file, 'w', encoding='utf-8',
+                           newline='')
+
+    try:
+        # messages go to stderr when results are written to stdout so the
+        # output can be read by another program
+        with contextlib.redirect_stdout(
+                sys.stderr if outfile is sys.stdout else sys.stdout):
+            print_header(clear=not batch)
+            status = run(args, outfile)
+    except KeyboardInterrupt:
+        sclogger.warning('Interrupted by user')
+        status = EXITCANCELLED
+    except BrokenPipeError:
+        # the program reading the output exited early, further writes to
+        # stdout would fail again when the interpreter exits
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        status = EXITFAILED
+    finally:
+        if outfile is not None and outfile is not sys.stdout:
+            outfile.close()
 
-    input('\nPress Enter to exit...')
+    if not batch:
+        input('\nPress Enter to exit...')
+    sys.exit(status)
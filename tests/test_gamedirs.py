@@ -0,0 +1,209 @@
+# filename:     test_gamedirs.py
+# description:  Tests of finding each physical library and game directory
+#               once however the libraries overlap.
+#
+# usage:        python -m unittest tests.test_gamedirs
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import steamclean as sc
+
+
+def library(root, *games):
+    """ Create a Steam library at root holding the named game directories
+        and return its common directory. """
+
+    common = os.path.join(root, 'steamapps', 'common')
+    for game in games:
+        os.makedirs(os.path.join(common, game))
+    os.makedirs(common, exist_ok=True)
+    return common
+
+
+class GetGamedirsTest(unittest.TestCase):
+    """ get_gamedirs resolves libraries and games to their physical
+        directory before adding them. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        # a cleanup so anything mounted within is unmounted first
+        self.addCleanup(self.tempdir.cleanup)
+        # resolved so results compare equal on systems with a linked /tmp
+        self.root = os.path.realpath(self.tempdir.name)
+        self.libdir = os.path.join(self.root, 'Library')
+        self.common = library(self.libdir, 'Alpha', 'Beta')
+
+    def gamedirs(self, customdirs, provider_dirs=(), **options):
+        """ Return the game directories found and the output printed. """
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            gamedirs = sc.get_gamedirs(list(provider_dirs), customdirs,
+                                       **options)
+        return gamedirs, output.getvalue()
+
+    def games(self, *names):
+        return {os.path.join(self.common, name): 'steam' for name in names}
+
+    def symlink(self, target, path):
+        try:
+            os.symlink(target, path, target_is_directory=True)
+        except (OSError, NotImplementedError):
+            self.skipTest('symlinks are not available')
+
+    def test_same_library_spelled_differently(self):
+        gamedirs, output = self.gamedirs([
+            self.libdir, os.path.join(self.libdir, 'steamapps'),
+            self.common, self.common + os.sep])
+
+        self.assertEqual(gamedirs, self.games('Alpha', 'Beta'))
+        self.assertIn('3 duplicate directories skipped', output)
+
+    def test_steamapps_case(self):
+        # Steam matches the steamapps directory without regard to case
+        other = os.path.join(self.root, 'Other')
+        os.makedirs(os.path.join(other, 'SteamApps', 'common', 'Gamma'))
+
+        gamedirs, output = self.gamedirs([other, self.libdir])
+
+        expected = self.games('Alpha', 'Beta')
+        expected[os.path.join(other, 'SteamApps', 'common', 'Gamma')] = \
+            'steam'
+        self.assertEqual(gamedirs, expected)
+
+    def test_symlinked_library(self):
+        link = os.path.join(self.root, 'Link')
+        self.symlink(self.libdir, link)
+
+        gamedirs, output = self.gamedirs([link, self.libdir])
+
+        # the library is scanned under the path first given
+        common = os.path.join(link, 'steamapps', 'common')
+        self.assertEqual(gamedirs, {os.path.join(common, 'Alpha'): 'steam',
+                                    os.path.join(common, 'Beta'): 'steam'})
+        self.assertIn('1 duplicate directories skipped', output)
+
+    def test_symlinked_library_exclusion(self):
+        link = os.path.join(self.root, 'Link')
+        self.symlink(self.libdir, link)
+        for game in ('Alpha', 'Beta'):
+            path = os.path.join(self.common, game, 'redist', 'setup.exe')
+            os.makedirs(os.path.dirname(path))
+            open(path, 'wb').close()
+
+        # excludes.txt is read from the working directory
+        workdir = os.path.join(self.root, 'work')
+        os.makedirs(workdir)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(workdir)
+        with open('excludes.txt', 'w') as excludefile:
+            excludefile.write(os.path.join(link, 'steamapps', 'common',
+                                           'Alpha') + '\n')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = list(sc.iter_redist([], [link, self.libdir]))
+
+        self.assertEqual([c.path for c in found], [os.path.join(
+            link, 'steamapps', 'common', 'Beta', 'redist', 'setup.exe')])
+
+    def test_symlinked_game(self):
+        other = library(os.path.join(self.root, 'Other'), 'Gamma')
+        self.symlink(os.path.join(self.common, 'Alpha'),
+                     os.path.join(other, 'AlphaLink'))
+
+        gamedirs, output = self.gamedirs([self.libdir,
+                                          os.path.dirname(other)])
+
+        expected = self.games('Alpha', 'Beta')
+        expected[os.path.join(other, 'Gamma')] = 'steam'
+        self.assertEqual(gamedirs, expected)
+        self.assertIn('1 duplicate directories skipped', output)
+
+    @unittest.skipUnless(sys.platform.startswith('linux') and
+                         hasattr(os, 'geteuid') and os.geteuid() == 0,
+                         'bind mounts need root on Linux')
+    def test_bind_mounted_library(self):
+        mountpoint = os.path.join(self.root, 'Mounted')
+        os.makedirs(mountpoint)
+        if subprocess.call(['mount', '--bind', self.libdir, mountpoint],
+                           stderr=subprocess.DEVNULL) != 0:
+            self.skipTest('bind mounts are not available')
+        self.addCleanup(subprocess.call, ['umount', mountpoint])
+
+        gamedirs, output = self.gamedirs([self.libdir, mountpoint])
+
+        self.assertEqual(gamedirs, self.games('Alpha', 'Beta'))
+        self.assertIn('1 duplicate directories skipped', output)
+
+    def test_nested_library_within_game(self):
+        # a game directory given as a library is already scanned
+        gamedirs, output = self.gamedirs(
+            [self.libdir, os.path.join(self.common, 'Alpha')])
+
+        self.assertEqual(gamedirs, self.games('Alpha', 'Beta'))
+        self.assertIn('1 duplicate directories skipped', output)
+
+    def test_nested_library_within_redist(self):
+        nested = os.path.join(self.common, 'Alpha', '_CommonRedist')
+        library(nested, 'Delta')
+
+        gamedirs, output = self.gamedirs([self.libdir, nested])
+
+        self.assertEqual(gamedirs, self.games('Alpha', 'Beta'))
+        self.assertIn('1 duplicate directories skipped', output)
+
+    def test_nested_library_elsewhere_is_scanned(self):
+        # nothing else reaches a library outside the redist directories
+        nested = os.path.join(self.common, 'Alpha', 'Mods')
+        inner = library(nested, 'Delta')
+
+        gamedirs, output = self.gamedirs([self.libdir, nested])
+
+        expected = self.games('Alpha', 'Beta')
+        expected[os.path.join(inner, 'Delta')] = 'steam'
+        self.assertEqual(gamedirs, expected)
+        self.assertNotIn('duplicate', output)
+
+    def test_expand_libraries(self):
+        steamdir = os.path.join(self.root, 'Steam')
+        library(steamdir, 'Omega')
+        vdfpath = os.path.join(steamdir, 'steamapps', 'libraryfolders.vdf')
+        with open(vdfpath, 'w', encoding='utf-8') as vdffile:
+            vdffile.write('"libraryfolders"\n{\n'
+                          '\t"0"\n\t{\n\t\t"path"\t\t"%s"\n\t}\n'
+                          '\t"1"\n\t{\n\t\t"path"\t\t"%s"\n\t}\n}\n' %
+                          (steamdir.replace('\\', '\\\\'),
+                           self.libdir.replace('\\', '\\\\')))
+        omega = os.path.join(steamdir, 'steamapps', 'common', 'Omega')
+
+        gamedirs, output = self.gamedirs([], [('steam', steamdir)])
+        expected = self.games('Alpha', 'Beta')
+        expected[omega] = 'steam'
+        self.assertEqual(gamedirs, expected)
+
+        # only the directories given are scanned when libraries are listed
+        # by the caller, such as those left in the gui
+        gamedirs, output = self.gamedirs([], [('steam', steamdir)],
+                                         expand_libraries=False)
+        self.assertEqual(gamedirs, {omega: 'steam'})
+        self.assertNotIn('duplicate', output)
+
+    def test_libdirs_include_empty_libraries(self):
+        # a library is watched and budgeted before any game is installed
+        empty = library(os.path.join(self.root, 'Empty'))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            libdirs = sc.get_libdirs([self.libdir, os.path.dirname(
+                os.path.dirname(empty))], providers=[])
+
+        self.assertEqual(libdirs, {self.common: 'steam', empty: 'steam'})
+
+
+if __name__ == '__main__':
+    unittest.main()
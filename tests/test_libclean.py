@@ -0,0 +1,113 @@
+# filename:     test_libclean.py
+# description:  Tests of file removal, directory pruning and the journal.
+#
+# usage:        python -m unittest tests.test_libclean
+
+import json
+import os
+import tempfile
+import unittest
+
+import engine.libclean as libclean
+
+
+def touch(path):
+    """ Create an empty file at path along with its parent directories. """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+class PruneTest(unittest.TestCase):
+    """ Pruning removes emptied redist directories within a game directory
+        and never the game directory or anything above it. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        # a library root named like a redist directory
+        self.common = os.path.join(self.tempdir.name, 'redistlib',
+                                   'SteamApps', 'common')
+
+    def test_file_in_game_directory(self):
+        gamedir = os.path.join(self.common, 'Solo')
+        path = os.path.join(gamedir, 'vcredist_x86.exe')
+        touch(path)
+
+        result = libclean.remove_files([path], games={gamedir})
+
+        self.assertEqual((result['removed'], result['pruned']), (1, 0))
+        self.assertTrue(os.path.isdir(gamedir))
+
+    def test_redist_directories(self):
+        gamedir = os.path.join(self.common, 'Game')
+        directx = os.path.join(gamedir, '_CommonRedist', 'DirectX')
+        path = os.path.join(directx, 'Jun2010', 'a.cab')
+        touch(path)
+
+        result = libclean.remove_files([path], games={gamedir})
+
+        # up to the deepest directory matching a rule
+        self.assertEqual(result['pruned'], 2)
+        self.assertFalse(os.path.exists(directx))
+        self.assertTrue(os.path.isdir(os.path.join(gamedir,
+                                                   '_CommonRedist')))
+
+    def test_unknown_game(self):
+        path = os.path.join(self.common, 'Game', 'redist', 'a.exe')
+        touch(path)
+
+        result = libclean.remove_files([path])
+
+        self.assertEqual(result['pruned'], 0)
+        self.assertTrue(os.path.isdir(os.path.dirname(path)))
+
+
+class ReadJournalTest(unittest.TestCase):
+    """ read_journal returns what an interrupted run left to do. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, 'run.journal')
+
+    def write(self, *entries):
+        with open(self.path, 'w', encoding='utf-8') as journal:
+            for entry in entries:
+                journal.write(json.dumps(entry) + '\n')
+            # an interrupted write
+            journal.write('{"op": "pla')
+
+    def test_pending(self):
+        self.write(
+            {'op': 'game', 'path': '/lib/Game'},
+            {'op': 'planned', 'path': '/lib/Game/redist/a.exe'},
+            {'op': 'planned', 'path': '/lib/Game/redist/b.exe'},
+            {'op': 'planned', 'path': '/lib/Game/redist/c.exe'},
+            {'op': 'removed', 'path': '/lib/Game/redist/a.exe', 'bytes': 1},
+            {'op': 'failed', 'path': '/lib/Game/redist/b.exe',
+             'error': 'Permission denied'})
+
+        self.assertEqual(libclean.read_journal(self.path), libclean.Pending(
+            ['/lib/Game/redist/b.exe', '/lib/Game/redist/c.exe'], [],
+            ['/lib/Game']))
+
+    def test_quarantine(self):
+        self.write(
+            {'op': 'planned', 'path': '/lib/G/redist/a.exe',
+             'mode': 'quarantine'},
+            {'op': 'planned', 'path': '/lib/G/redist/b.exe',
+             'mode': 'quarantine'},
+            {'op': 'planned', 'path': '/lib/G/redist/c.exe',
+             'mode': 'quarantine'},
+            {'op': 'quarantined', 'path': '/lib/G/redist/a.exe'},
+            {'op': 'failed', 'path': '/lib/G/redist/b.exe',
+             'error': 'Quarantine is on another device', 'retry': False})
+
+        # files planned for quarantine are never removed instead
+        self.assertEqual(libclean.read_journal(self.path), libclean.Pending(
+            [], ['/lib/G/redist/c.exe'], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
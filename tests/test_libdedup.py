@@ -0,0 +1,77 @@
+# filename:     test_libdedup.py
+# description:  Tests of finding identical files and the space reclaimable
+#               by linking them.
+#
+# usage:        python -m unittest tests.test_libdedup
+
+import os
+import tempfile
+import unittest
+
+import engine.libdedup as libdedup
+
+# a second file system for copies on another device, where available
+OTHERDEVICE = '/dev/shm'
+
+
+class FindDuplicatesTest(unittest.TestCase):
+    """ find_duplicates groups identical files and only counts the copies
+        which a hardlink can replace. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def write(self, directory, name, data):
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as newfile:
+            newfile.write(data)
+        return path
+
+    def test_same_device(self):
+        data = b'redist' * 1000
+        paths = [self.write(self.tempdir.name, name, data)
+                 for name in ('a.cab', 'b.cab', 'c.cab')]
+        other = self.write(self.tempdir.name, 'd.cab', b'other' * 1200)
+        files = {path: len(data) for path in paths}
+        files[other] = len(data)
+
+        duplicates = libdedup.find_duplicates(files)
+
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(duplicates[0].paths, sorted(paths))
+        self.assertEqual(duplicates[0].reclaimable, 2 * len(data))
+
+    def test_hardlinks_are_one_file(self):
+        data = b'redist' * 1000
+        path = self.write(self.tempdir.name, 'a.cab', data)
+        link = os.path.join(self.tempdir.name, 'b.cab')
+        os.link(path, link)
+
+        self.assertEqual(libdedup.find_duplicates(
+            {path: len(data), link: len(data)}), [])
+
+    def test_other_device(self):
+        if not os.path.isdir(OTHERDEVICE) or \
+                os.stat(OTHERDEVICE).st_dev == \
+                os.stat(self.tempdir.name).st_dev:
+            self.skipTest('no second device available')
+        otherdir = tempfile.TemporaryDirectory(dir=OTHERDEVICE)
+        self.addCleanup(otherdir.cleanup)
+
+        data = b'redist' * 1000
+        paths = [self.write(self.tempdir.name, 'a.cab', data),
+                 self.write(self.tempdir.name, 'b.cab', data),
+                 self.write(otherdir.name, 'c.cab', data)]
+
+        duplicates = libdedup.find_duplicates(
+            {path: len(data) for path in paths})
+
+        # every copy is reported but the one on the other device stays
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(len(duplicates[0].paths), 3)
+        self.assertEqual(duplicates[0].reclaimable, len(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
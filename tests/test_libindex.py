@@ -0,0 +1,98 @@
+# filename:     test_libindex.py
+# description:  Tests of the scan index staying valid across a clean.
+#
+# usage:        python -m unittest tests.test_libindex
+
+import os
+import tempfile
+import time
+import unittest
+
+import engine.libclean as libclean
+import engine.libindex as libindex
+import engine.librules as librules
+import engine.libscan as libscan
+
+
+class ForgetTest(unittest.TestCase):
+    """ A game directory cleaned through the index is served from it on the
+        next scan instead of being walked again. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.gamedir = os.path.join(self.tempdir.name, 'common', 'Game')
+        self.redist = os.path.join(self.gamedir, '_CommonRedist')
+
+        for name in ('DirectX', 'vcredist'):
+            os.makedirs(os.path.join(self.redist, name))
+            with open(os.path.join(self.redist, name, 'setup.exe'),
+                      'wb') as newfile:
+                newfile.write(b'x')
+        os.makedirs(os.path.join(self.gamedir, 'Data'))
+
+        # directories modified just now are never trusted by the index
+        past = time.time() - 60
+        for current, dirs, files in os.walk(self.gamedir):
+            os.utime(current, (past, past))
+
+        self.index = libindex.ScanIndex(
+            os.path.join(self.tempdir.name, 'index.db'))
+        self.addCleanup(self.index.close)
+        self.matcher = librules.get_matcher()
+
+    def scan(self):
+        return libscan.scan_gamedir(self.gamedir, self.index, self.matcher)
+
+    def remove(self, paths):
+        """ Remove paths and update the index as clean_data does. """
+
+        checked = {}
+        for path in paths:
+            self.index.check(path, checked)
+        removal = libclean.remove_files(paths, matcher=self.matcher,
+                                        games={self.gamedir})
+        self.index.forget(removal['files'], checked)
+        return removal
+
+    def test_clean_keeps_index_valid(self):
+        found = self.scan()
+        self.assertEqual(len(found), 2)
+
+        # removing one file prunes its directory and changes the parents
+        removal = self.remove([c.path for c in found if 'DirectX' in c.path])
+        self.assertEqual(removal['pruned'], 1)
+
+        found = self.scan()
+        self.assertEqual(self.index.hits, 1)
+        self.assertEqual([c.path for c in found], [
+            os.path.join(self.redist, 'vcredist', 'setup.exe')])
+
+    def test_files_added_before_clean_are_found(self):
+        # such as while the user is asked to confirm removal
+        self.scan()
+        directx = os.path.join(self.redist, 'DirectX')
+        with open(os.path.join(directx, 'new.exe'), 'wb') as newfile:
+            newfile.write(b'x')
+
+        self.remove([os.path.join(directx, 'setup.exe')])
+
+        found = self.scan()
+        self.assertEqual(self.index.hits, 0)
+        self.assertEqual(sorted(c.path for c in found), [
+            os.path.join(directx, 'new.exe'),
+            os.path.join(self.redist, 'vcredist', 'setup.exe')])
+
+    def test_new_files_are_still_found(self):
+        self.scan()
+        with open(os.path.join(self.redist, 'vcredist', 'new.exe'),
+                  'wb') as newfile:
+            newfile.write(b'x')
+
+        found = self.scan()
+        self.assertEqual(self.index.hits, 0)
+        self.assertEqual(len(found), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
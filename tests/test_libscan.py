@@ -0,0 +1,85 @@
+# filename:     test_libscan.py
+# description:  Tests of the single pass game directory traversal and the
+#               file system calls it makes.
+#
+# usage:        python -m unittest tests.test_libscan
+
+from unittest import mock
+import os
+import tempfile
+import unittest
+
+import engine.librules as librules
+import engine.libscan as libscan
+import engine.libstats as libstats
+
+
+def touch(path, data=b'x'):
+    """ Create the file at path along with its parent directories. """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as newfile:
+        newfile.write(data)
+
+
+class ScanGamedirTest(unittest.TestCase):
+    """ scan_gamedir lists each walked directory once and only stats the
+        files it reports. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.gamedir = os.path.join(self.tempdir.name, 'common', 'Game')
+
+        redist = os.path.join(self.gamedir, '_CommonRedist')
+        touch(os.path.join(redist, 'DirectX', 'Jun2010', 'a.cab'), b'ab')
+        touch(os.path.join(redist, 'DirectX', 'Jun2010', 'b.cab'), b'abc')
+        touch(os.path.join(redist, 'vcredist', 'vc_redist.x64.exe'))
+        touch(os.path.join(redist, 'readme.txt'))
+        # directories not matching a rule are never listed
+        touch(os.path.join(self.gamedir, 'Data', 'setup.exe'))
+        touch(os.path.join(self.gamedir, 'Data', 'Levels', 'level.cab'))
+
+    def tearDown(self):
+        libstats.disable()
+        self.tempdir.cleanup()
+
+    def scan(self):
+        libstats.enable()
+        with mock.patch.object(libscan.os, 'scandir',
+                               wraps=os.scandir) as scandir, \
+                mock.patch.object(libscan.os, 'stat',
+                                  wraps=os.stat) as stat:
+            found = libscan.scan_gamedir(self.gamedir,
+                                         matcher=librules.get_matcher())
+        return found, scandir, stat, libstats.disable().counters
+
+    def test_finds_only_redist_files(self):
+        found, scandir, stat, counters = self.scan()
+
+        redist = os.path.join(self.gamedir, '_CommonRedist')
+        self.assertEqual(sorted((c.path, c.size) for c in found), [
+            (os.path.join(redist, 'DirectX', 'Jun2010', 'a.cab'), 2),
+            (os.path.join(redist, 'DirectX', 'Jun2010', 'b.cab'), 3),
+            (os.path.join(redist, 'vcredist', 'vc_redist.x64.exe'), 1)])
+        self.assertTrue(all(c.game == self.gamedir and c.rule == 'redist'
+                            for c in found))
+
+    def test_syscall_counts(self):
+        found, scandir, stat, counters = self.scan()
+
+        # the game directory, _CommonRedist, DirectX, Jun2010 and vcredist
+        self.assertEqual(scandir.call_count, 5)
+        listed = {os.path.relpath(call[0][0], self.gamedir)
+                  for call in scandir.call_args_list}
+        self.assertNotIn('Data', listed)
+        # sizes come from the directory entries, never a separate stat
+        self.assertEqual(stat.call_count, 0)
+
+        self.assertEqual(counters['scandir'], scandir.call_count)
+        self.assertEqual(counters['dirs'], 5)
+        self.assertEqual(counters['stat'], len(found))
+        self.assertEqual(counters['syscalls'], 5 + len(found))
+
+
+if __name__ == '__main__':
+    unittest.main()
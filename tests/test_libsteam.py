@@ -0,0 +1,164 @@
+# filename:     test_libsteam.py
+# description:  Tests of reading Steam library folders from both layouts of
+#               libraryfolders.vdf and installation scripts of games.
+#
+# usage:        python -m unittest tests.test_libsteam
+
+import os
+import tempfile
+import unittest
+
+import engine.librules as librules
+import providers.libsteam as libsteam
+import steamclean as sc
+
+# original layout, each numbered key set to the path of a library
+OLDFORMAT = '''"LibraryFolders"
+{
+    "TimeNextStatsReport"   "1561832478"
+    "ContentStatsID"        "-158337411110787451"
+    "1"     "%s"
+    "2"     "D:\\\\SteamLibrary"
+}
+'''
+
+# newer layout, each numbered section holding a path and the apps in it,
+# starting with the Steam directory itself
+NEWFORMAT = '''"libraryfolders"
+{
+    "contentstatsid"        "-158337411110787451"
+    "0"
+    {
+        "path"      "%s"
+        "label"     ""
+        "apps"
+        {
+            "228980"        "169206442"
+        }
+    }
+    "1"
+    {
+        "path"      "%s"
+        "label"     "Games"
+        "totalsize" "0"
+        "apps"
+        {
+        }
+    }
+}
+'''
+
+
+class GetLibrariesTest(unittest.TestCase):
+    """ get_libraries reads every library from either layout and leaves out
+        the Steam directory itself. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.steamdir = os.path.join(self.tempdir.name, 'Steam')
+        self.library = os.path.join(self.tempdir.name, 'SteamLibrary')
+        os.makedirs(os.path.join(self.steamdir, 'steamapps'))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self, text):
+        path = os.path.join(self.steamdir, 'steamapps', 'libraryfolders.vdf')
+        with open(path, 'w', encoding='utf-8') as vdffile:
+            vdffile.write(text)
+
+    @staticmethod
+    def escape(path):
+        # paths are written with backslashes escaped as Steam does
+        return path.replace('\\', '\\\\')
+
+    def test_old_format(self):
+        self.write(OLDFORMAT % self.escape(self.library))
+
+        self.assertEqual(libsteam.get_libraries(self.steamdir),
+                         [os.path.normpath(self.library),
+                          os.path.normpath('D:\\SteamLibrary')])
+
+    def test_new_format(self):
+        self.write(NEWFORMAT % (self.escape(self.steamdir),
+                                self.escape(self.library)))
+
+        self.assertEqual(libsteam.get_libraries(self.steamdir),
+                         [os.path.normpath(self.library)])
+
+    def test_new_format_steamdir_spelled_differently(self):
+        # the Steam directory is skipped however its path is written
+        self.write(NEWFORMAT % (self.escape(self.steamdir + os.sep),
+                                self.escape(self.library)))
+
+        self.assertEqual(libsteam.get_libraries(self.steamdir),
+                         [os.path.normpath(self.library)])
+
+    def test_missing_file(self):
+        self.assertEqual(libsteam.get_libraries(self.steamdir), [])
+
+
+# installation script naming a single redistributable installer
+SCRIPT = '''"InstallScript"
+{
+    "Run Process"
+    {
+        "DirectX"
+        {
+            "process 1"     "%INSTALLDIR%\\_CommonRedist\\DirectX\\setup.exe"
+        }
+    }
+}
+'''
+
+
+class ReadVdfTest(unittest.TestCase):
+    """ read_vdf only reports a script which named something to clean, so
+        targeted scans fall back to walking games without one. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.gamedir = os.path.join(self.tempdir.name, 'Game')
+        self.redist = os.path.join(self.gamedir, '_CommonRedist')
+
+        for name in ('DirectX', 'vcredist'):
+            os.makedirs(os.path.join(self.redist, name))
+            with open(os.path.join(self.redist, name, 'setup.exe'),
+                      'wb') as newfile:
+                newfile.write(b'x')
+
+    def write(self, name, text):
+        path = os.path.join(self.gamedir, name)
+        with open(path, 'w', encoding='utf-8') as vdffile:
+            vdffile.write(text)
+        return path
+
+    def scan(self):
+        found = sc.scan_game(self.gamedir, appid='1', targeted=True,
+                             matcher=librules.get_matcher('steam'))
+        return sorted(c.path for c in found)
+
+    def test_script_read(self):
+        script = self.write('a.vdf', SCRIPT)
+        self.write('b.vdf', '"broken"\n{\n')
+        self.write('c.vdf', '"InstallScript"\n{\n}\n')
+
+        vpath, cleanable = libsteam.read_vdf(self.gamedir)
+        self.assertEqual(vpath, script)
+        self.assertEqual(list(cleanable), [
+            os.path.join(self.redist, 'DirectX', 'setup.exe')])
+        self.assertEqual(self.scan(), list(cleanable))
+
+    def test_unusable_scripts_walked(self):
+        self.write('b.vdf', '"broken"\n{\n')
+        self.write('c.vdf', '"InstallScript"\n{\n}\n')
+
+        self.assertEqual(libsteam.read_vdf(self.gamedir), ('', {}))
+        self.assertEqual(self.scan(), [
+            os.path.join(self.redist, 'DirectX', 'setup.exe'),
+            os.path.join(self.redist, 'vcredist', 'setup.exe')])
+
+
+if __name__ == '__main__':
+    unittest.main()